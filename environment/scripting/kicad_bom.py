@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Post-process the BOM CSV from 'kicad-cli sch export bom' (as set up in kicad_designpack_export.py): check it, and write a build BOM
+for ordering - rather than re-checking the export by hand in a spreadsheet.
+
+The CSV is loaded column-wise (one list per column), and each check is a pass down only the columns it needs, so a
+multi-thousand line BOM from a panelised build takes milliseconds.
+
+Checks:
+  - fitted lines missing any of REQUIRED_FIELDS (errors)
+  - references on more than one line (errors), and Qty not matching the number of references
+  - the same MPN on more than one line - usually a Value/Description difference splitting KiCad's grouping (merged in the build BOM)
+  - manufacturer/MPN and vendor/SKU pairs with only one half filled in, and alternates repeating the primary part
+  - MPNs not in the library, or in it under a different manufacturer (using kicad_library_index.py)
+  - DNP lines are listed, so they can be confirmed
+
+The build BOM has one line per part to buy (fitted lines with the same MPN1 merged), the approved alternates (Manufacturer2/MPN2)
+and suppliers (Vendor/SKU) merged into one column each, and the total quantity for each build size in BUILD_QUANTITIES.
+
+Usage:
+    python kicad_bom.py BOM_CSV [boards per build ...]    # writes <BOM>_build.csv next to it, exits with 1 on errors
+"""
+
+import csv
+import os
+import sys
+import time
+from pathlib import Path
+
+
+# ==== CONFIGURATION ====
+FIELD_LABELS = {                # KiCad field -> column label in the CSV, as CONFIG_PCB_EXPORT_BOM_FIELDS/LABELS in kicad_designpack_export.py
+    "${ITEM_NUMBER}": "Item",   # (fields not listed are labelled with their own name)
+    "Reference": "References",
+    "${QUANTITY}": "Qty",
+    "${DNP}": "FitPart",
+}
+REQUIRED_FIELDS = ["Manufacturer1", "MPN1"]                           # Must be filled in on every fitted line
+MANUFACTURER_FIELDS = [("Manufacturer1", "MPN1"), ("Manufacturer2", "MPN2")]   # The part, then its approved alternates
+SUPPLIER_FIELDS = [("Vendor1", "SKU1"), ("Vendor2", "SKU2")]
+BUILD_QUANTITIES = [1]                                                # Boards per build, a quantity column for each in the build BOM
+LIBRARY_FOLDER = Path(__file__).resolve().parent.parent.parent      # For the MPN cross-check, None to skip it
+# ========================
+
+
+class BomTable:
+    """A BOM CSV held column-wise, {label: values} with every value stripped, with columns looked up by KiCad field name."""
+
+    def __init__(self, header, rows, labels=None):
+        width = len(header)
+        rows = [row if len(row) == width else (row + [""] * width)[:width] for row in rows]
+        self.header = header
+        self.length = len(rows)
+        self.labels = FIELD_LABELS if labels is None else labels
+        columns = zip(*rows) if rows else [()] * width
+        self.columns = {label: [value.strip() for value in column] for label, column in zip(header, columns)}
+
+    @classmethod
+    def load(cls, path, labels=None):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            header = [label.strip() for label in next(reader, [])]
+            rows = [row for row in reader if any(row)]
+        return cls(header, rows, labels)
+
+    def __len__(self):
+        return self.length
+
+    def has(self, field):
+        return self.labels.get(field, field) in self.columns
+
+    def column(self, field):
+        """Values of a KiCad field, all blank if the BOM doesn't have it."""
+        values = self.columns.get(self.labels.get(field, field))
+        return values if values is not None else [""] * self.length
+
+    def line_names(self):
+        """How each line is reported, e.g. 'Item 4 (C3 C7)'."""
+        items = self.column("${ITEM_NUMBER}") if self.has("${ITEM_NUMBER}") else [str(i + 1) for i in range(self.length)]
+        return ["Item " + item + " (" + references + ")" for item, references in zip(items, self.column("Reference"))]
+
+    def references(self):
+        return [value.replace(",", " ").split() for value in self.column("Reference")]
+
+    def fitted(self):
+        # kicad-cli writes "DNP" (or the label's text) for do-not-populate parts, and nothing otherwise
+        return [not value for value in self.column("${DNP}")]
+
+    def quantities(self, references=None):
+        """Qty of each line, or its number of references where Qty is missing or not a number."""
+        references = self.references() if references is None else references
+        quantities = []
+        for value, line_references in zip(self.column("${QUANTITY}"), references):
+            try:
+                quantities.append(int(value))
+            except ValueError:
+                quantities.append(len(line_references))
+        return quantities
+
+
+def part_name(manufacturer, part_number):
+    return (manufacturer + " " + part_number).strip()
+
+
+def check_bom(table, mpn_manufacturers=None, required=REQUIRED_FIELDS):
+    """Returns (problems, summary) - problems as (severity, line, message), summary as counts for print_summary().
+    mpn_manufacturers is LibraryIndex.mpn_manufacturers(), or None to skip the library cross-check."""
+    problems = []
+    names = table.line_names()
+    references = table.references()
+    fitted = table.fitted()
+    quantities = table.quantities(references)
+
+    for field in required:
+        if not table.has(field):
+            problems.append(("error", "BOM", "no " + field + " column"))
+            continue
+        for name, value, is_fitted in zip(names, table.column(field), fitted):
+            if is_fitted and not value:
+                problems.append(("error", name, field + " missing"))
+
+    lines_by_reference = {}
+    for i, line_references in enumerate(references):
+        for reference in line_references:
+            lines_by_reference.setdefault(reference, []).append(i)
+    for reference, lines in lines_by_reference.items():
+        if len(lines) > 1:
+            problems.append(("error", reference, "on more than one line - " + ", ".join(names[i] for i in lines)))
+
+    if table.has("${QUANTITY}"):
+        for name, value, line_references in zip(names, table.column("${QUANTITY}"), references):
+            if value != str(len(line_references)):
+                problems.append(("warning", name, "Qty is '" + value + "' but there are " + str(len(line_references)) + " references"))
+
+    primary_manufacturer, primary_mpn = MANUFACTURER_FIELDS[0]
+    lines_by_mpn = {}
+    for i, (mpn, is_fitted) in enumerate(zip(table.column(primary_mpn), fitted)):
+        if mpn and is_fitted:
+            lines_by_mpn.setdefault(mpn.upper(), []).append(i)
+    for mpn, lines in lines_by_mpn.items():
+        if len(lines) > 1:
+            problems.append(("warning", names[lines[0]], primary_mpn + " " + mpn + " is also on " + ", ".join(names[i] for i in lines[1:])
+                             + " - different Value/Description? (merged in the build BOM)"))
+
+    primary_mpns = [mpn.upper() for mpn in table.column(primary_mpn)]
+    for pairs in (MANUFACTURER_FIELDS, SUPPLIER_FIELDS):
+        for first, second in pairs:
+            if not (table.has(first) or table.has(second)):
+                continue
+            for name, a, b, is_fitted in zip(names, table.column(first), table.column(second), fitted):
+                if is_fitted and bool(a) != bool(b) and first not in required and second not in required:
+                    problems.append(("warning", name, (first if a else second) + " without " + (second if a else first)))
+    for manufacturer_field, mpn_field in MANUFACTURER_FIELDS[1:]:
+        for name, mpn, primary, is_fitted in zip(names, table.column(mpn_field), primary_mpns, fitted):
+            if is_fitted and mpn and mpn.upper() == primary:
+                problems.append(("warning", name, mpn_field + " repeats " + primary_mpn))
+
+    if mpn_manufacturers is not None:
+        for manufacturer_field, mpn_field in MANUFACTURER_FIELDS:
+            for name, manufacturer, mpn, is_fitted in zip(names, table.column(manufacturer_field), table.column(mpn_field), fitted):
+                if not (is_fitted and mpn):
+                    continue
+                known = mpn_manufacturers.get(mpn.upper())
+                if known is None:
+                    problems.append(("warning", name, mpn_field + " " + mpn + " not in library"))
+                elif manufacturer and known and manufacturer.upper() not in known:
+                    problems.append(("warning", name, mpn_field + " " + mpn + " is from " + "/".join(sorted(known)) + " in the library, not " + manufacturer))
+
+    for name, is_fitted in zip(names, fitted):
+        if not is_fitted:
+            problems.append(("info", name, "DNP"))
+
+    summary = {
+        "lines": table.length,
+        "fitted lines": sum(fitted),
+        "parts per board": sum(quantity for quantity, is_fitted in zip(quantities, fitted) if is_fitted),
+        "DNP parts": sum(quantity for quantity, is_fitted in zip(quantities, fitted) if not is_fitted),
+        "unique MPNs": len(lines_by_mpn),
+    }
+    return problems, summary
+
+
+def build_bom(table, boards=BUILD_QUANTITIES):
+    """The build BOM as (header, rows) - fitted lines only, those with the same MPN1 merged into one, alternates and suppliers
+    merged into one column each, and the total quantity for each number of boards."""
+    references = table.references()
+    quantities = table.quantities(references)
+    manufacturers = [table.column(manufacturer) for manufacturer, _ in MANUFACTURER_FIELDS]
+    mpns = [table.column(mpn) for _, mpn in MANUFACTURER_FIELDS]
+    vendors = [table.column(vendor) for vendor, _ in SUPPLIER_FIELDS]
+    skus = [table.column(sku) for _, sku in SUPPLIER_FIELDS]
+    values = table.column("Value")
+    descriptions = table.column("Description")
+
+    lines = {}
+    for i, is_fitted in enumerate(table.fitted()):
+        if not is_fitted:
+            continue
+        mpn = mpns[0][i]
+        key = mpn.upper() if mpn else i    # Lines without an MPN are never merged
+        line = lines.get(key)
+        if line is None:
+            line = lines[key] = {"references": [], "quantity": 0, "value": values[i], "description": descriptions[i],
+                                 "manufacturer": manufacturers[0][i], "mpn": mpn, "alternates": [], "suppliers": []}
+        line["references"] += references[i]
+        line["quantity"] += quantities[i]
+        for manufacturer, alternate in zip(manufacturers[1:], mpns[1:]):
+            name = part_name(manufacturer[i], alternate[i])
+            if alternate[i] and alternate[i].upper() != key and name not in line["alternates"]:
+                line["alternates"].append(name)
+        for vendor, sku in zip(vendors, skus):
+            name = part_name(vendor[i], sku[i])
+            if name and name not in line["suppliers"]:
+                line["suppliers"].append(name)
+
+    header = ["Item", "References", "Qty per board"] + ["Qty for " + str(n) for n in boards] + \
+             ["Value", "Description", "Manufacturer", "MPN", "Alternates", "Suppliers"]
+    rows = []
+    for item, line in enumerate(lines.values(), 1):
+        rows.append([str(item), " ".join(line["references"]), str(line["quantity"])] + [str(line["quantity"] * n) for n in boards] +
+                    [line["value"], line["description"], line["manufacturer"], line["mpn"], "; ".join(line["alternates"]), "; ".join(line["suppliers"])])
+    return header, rows
+
+
+def write_csv(path, header, rows):
+    with open(str(path) + ".tmp", "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(str(path) + ".tmp", path)
+
+
+def print_problems(problems):
+    for severity, line, message in problems:
+        print(f"{severity.upper():<8} {line}: {message}")
+
+
+def print_summary(summary):
+    print(", ".join(str(count) + " " + name for name, count in summary.items()))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(2)
+    bom_path = Path(sys.argv[1])
+    boards = [int(n) for n in sys.argv[2:]] or BUILD_QUANTITIES
+
+    mpn_manufacturers = None
+    if LIBRARY_FOLDER:
+        from kicad_library_index import LibraryIndex
+        with LibraryIndex.open(LIBRARY_FOLDER) as index:
+            mpn_manufacturers = index.mpn_manufacturers()
+
+    start = time.perf_counter()
+    table = BomTable.load(bom_path)
+    problems, summary = check_bom(table, mpn_manufacturers)
+    header, rows = build_bom(table, boards)
+    elapsed = time.perf_counter() - start
+
+    build_path = bom_path.with_name(bom_path.stem + "_build.csv")
+    write_csv(build_path, header, rows)
+
+    print_problems(problems)
+    print()
+    print_summary(summary)
+    print(f"{len(table)} lines checked in {elapsed * 1000:.1f} ms, build BOM ({len(rows)} lines) written to {build_path}")
+    sys.exit(1 if any(problem[0] == "error" for problem in problems) else 0)
+
+
+if __name__ == "__main__":
+    main()
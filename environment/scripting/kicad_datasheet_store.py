@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Keep datasheets/ as a content-addressed store - one copy of each PDF, however many names and category folders it was
+committed under - and look up a symbol's datasheet file directly.
+
+Every datasheet is hashed once: hashes are kept in HASH_CACHE_FILENAME by path, with the size and mtime they were taken at,
+and only files whose size or mtime has changed since are read again (the sizes and mtimes come from kicad_library_index.py,
+so no extra scan of the folder). Files with the same content hash are duplicates; the copy kept is the one most symbols
+already point at, then the shortest path.
+
+Deduplicating (--apply) first rewrites every Datasheet property pointing at a duplicate to the kept copy - one load and one
+atomic save per .kicad_sym file, keeping each value's own path style (${KIPRJMOD}\\optimised_kicad-libraries\\datasheets\\...
+with '\\' or '/') - and only then deletes the duplicates, so an interrupted run never leaves a broken link.
+
+Usage:
+    python kicad_datasheet_store.py                     # report duplicates and datasheets no symbol uses
+    python kicad_datasheet_store.py --apply             # keep one copy of each, re-point the symbols, delete the rest
+    python kicad_datasheet_store.py LIB:SYMBOL ...      # datasheet file of each symbol
+
+    from kicad_datasheet_store import DatasheetStore
+
+    with DatasheetStore.open(library_folder) as store:
+        store.datasheet("Power_Management:TPS62130RGTR")   # absolute Path, or None
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+from kicad_library_check import resolve
+from kicad_library_index import LibraryIndex
+from kicad_sexpr import SymbolLibrary
+
+
+# ==== CONFIGURATION ====
+LIBRARY_FOLDER = Path(__file__).resolve().parent.parent.parent   # Root of the library (has datasheets/, symbols/)
+HASH_CACHE_FILENAME = ".datasheet_hash_cache.json"                # Created in LIBRARY_FOLDER
+READ_CHUNK_SIZE = 1024 * 1024                                     # Bytes read at a time while hashing
+# ========================
+
+URL_RE = re.compile(r'^[a-z]+://', flags=re.IGNORECASE)
+
+
+def hash_file(path: Path) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class DatasheetStore:
+    """Every datasheet by content hash, and every symbol's Datasheet link, for one library folder. Paths are relative, with '/' separators."""
+
+    def __init__(self, index: LibraryIndex):
+        self.index = index
+        self.root = index.root
+        self.hashes = {}       # datasheet path -> sha1
+        self.links = {}        # "library:name" -> (symbol file, Datasheet value, datasheet path)
+        self.users = {}        # datasheet path -> ["library:name" of the symbols using it]
+        self.hashed = 0        # Datasheets (re-)hashed by the last load_hashes()
+
+    @classmethod
+    def open(cls, library_folder=LIBRARY_FOLDER):
+        """The store of an up-to-date library index, with its hashes and links loaded."""
+        store = cls(LibraryIndex.open(library_folder))
+        store.load_hashes()
+        store.load_links()
+        return store
+
+    def close(self):
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load_hashes(self):
+        """Hash every datasheet not already in the hash cache at its current size and mtime, and save the cache."""
+        cache_path = self.root / HASH_CACHE_FILENAME
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (FileNotFoundError, ValueError):
+            cached = {}
+
+        files = self.index.db.execute("SELECT path, size, mtime_ns FROM files WHERE kind = 'datasheet' ORDER BY path").fetchall()
+        entries = {}
+        self.hashed = 0
+        for path, size, mtime_ns in files:
+            entry = cached.get(path)
+            if entry is None or entry.get("size") != size or entry.get("mtime_ns") != mtime_ns:
+                entry = {"size": size, "mtime_ns": mtime_ns, "sha1": hash_file(self.root / path)}
+                self.hashed += 1
+            entries[path] = entry
+        self.hashes = {path: entry["sha1"] for path, entry in entries.items()}
+
+        # Rewritten every time, so deleted datasheets drop out of it
+        with open(str(cache_path) + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(entries, f, indent=1)
+        os.replace(str(cache_path) + ".tmp", cache_path)
+
+    def load_links(self):
+        """Every symbol's Datasheet property that points at a file in the library (not URLs, or links to missing files)."""
+        rows = self.index.db.execute(
+            "SELECT symbols.file, symbols.library, symbols.name, symbol_properties.value FROM symbols "
+            "JOIN symbol_properties ON symbol_properties.symbol_id = symbols.id "
+            "WHERE symbol_properties.name = 'Datasheet' ORDER BY symbols.library, symbols.name").fetchall()
+        folded = {path.casefold(): path for path in self.hashes}
+        self.links = {}
+        self.users = {}
+        for file, library, name, value in rows:
+            if not value or value == "~" or URL_RE.match(value):
+                continue
+            kind, path = resolve(value)
+            if kind != "library":
+                continue
+            path = path if path in self.hashes else folded.get(path.casefold())
+            if path is None:
+                continue    # Broken link - for kicad_library_check.py to report
+            self.links[library + ":" + name] = (file, value, path)
+            self.users.setdefault(path, []).append(library + ":" + name)
+
+    ###########################################
+    #   Lookups
+    ###########################################
+
+    def datasheet(self, lib_id):
+        """Absolute path of a symbol's datasheet file, by its 'library:name' id, or None."""
+        link = self.links.get(lib_id)
+        return self.root / link[2] if link else None
+
+    def symbols(self, path):
+        """The 'library:name' ids of the symbols using a datasheet."""
+        return self.users.get(path, [])
+
+    def duplicates(self):
+        """{kept path: [duplicate paths]} for every datasheet content stored more than once."""
+        by_hash = {}
+        for path, sha1 in self.hashes.items():
+            by_hash.setdefault(sha1, []).append(path)
+        groups = {}
+        for paths in by_hash.values():
+            if len(paths) > 1:
+                paths.sort(key=lambda path: (-len(self.symbols(path)), len(path), path))
+                groups[paths[0]] = paths[1:]
+        return groups
+
+    def unused(self):
+        """Datasheets no symbol links to."""
+        return [path for path in self.hashes if path not in self.users]
+
+    ###########################################
+    #   Deduplicate
+    ###########################################
+
+    def deduplicate(self):
+        """Point every symbol at the kept copy of its datasheet, then delete the duplicates.
+        Returns (duplicates deleted, bytes freed, Datasheet properties rewritten, symbol libraries saved)."""
+        kept_path = {duplicate: kept for kept, duplicates in self.duplicates().items() for duplicate in duplicates}
+        if not kept_path:
+            return 0, 0, 0, 0
+
+        # Every symbol to re-point, by library file, so each library is loaded and saved once
+        by_file = {}
+        for lib_id, (file, value, path) in self.links.items():
+            if path in kept_path:
+                by_file.setdefault(file, {})[lib_id.partition(":")[2]] = relink(value, path, kept_path[path])
+
+        rewritten = 0
+        for file, values in by_file.items():
+            library = SymbolLibrary.load(self.root / file)
+            for symbol in library.symbols:
+                prop = symbol.properties.get("Datasheet")
+                if prop is not None and symbol.name in values:
+                    library.set_value(prop, values[symbol.name])
+                    rewritten += 1
+            library.save()
+
+        freed = 0
+        for path in kept_path:
+            freed += (self.root / path).stat().st_size
+            (self.root / path).unlink()
+
+        # Pick up the rewritten libraries and deleted datasheets
+        self.index.update()
+        self.load_hashes()
+        self.load_links()
+        return len(kept_path), freed, rewritten, len(by_file)
+
+
+def relink(value, path, new_path):
+    """A Datasheet value pointing at path, re-pointed at new_path - keeping its prefix and '\\' or '/' separators."""
+    normalised = value.replace("\\", "/")
+    tail = normalised.casefold().rfind(path.casefold())
+    separator = "\\" if "\\" in value else "/"
+    return value[:tail] + new_path.replace("/", separator)
+
+
+def print_report(store):
+    duplicates = store.duplicates()
+    for kept, paths in duplicates.items():
+        size = (store.root / kept).stat().st_size
+        print(f"DUPLICATE {kept} ({size / 1e6:.1f} MB, {len(store.symbols(kept))} symbols)")
+        for path in paths:
+            print(f"          = {path} ({len(store.symbols(path))} symbols)")
+    for path in store.unused():
+        print(f"UNUSED    {path}")
+    wasted = sum((store.root / path).stat().st_size for paths in duplicates.values() for path in paths)
+    print(f"\n{sum(len(paths) for paths in duplicates.values())} duplicate(s) of {len(duplicates)} datasheet(s), {wasted / 1e6:.1f} MB to free - "
+          f"run with --apply to deduplicate")
+
+
+def main():
+    args = sys.argv[1:]
+    start = time.perf_counter()
+    with DatasheetStore.open(LIBRARY_FOLDER) as store:
+        print(f"{len(store.hashes)} datasheets ({store.hashed} hashed, the rest from the hash cache), {len(store.links)} symbol links, "
+              f"loaded in {(time.perf_counter() - start) * 1000:.0f} ms\n")
+
+        lib_ids = [arg for arg in args if arg != "--apply"]
+        if lib_ids:
+            for lib_id in lib_ids:
+                path = store.datasheet(lib_id)
+                print(f"{lib_id}: {path if path else 'no datasheet file'}")
+        elif "--apply" in args:
+            start = time.perf_counter()
+            deleted, freed, rewritten, libraries = store.deduplicate()
+            print(f"Deleted {deleted} duplicate datasheet(s) ({freed / 1e6:.1f} MB), rewrote {rewritten} Datasheet properties "
+                  f"in {libraries} symbol libraries in {(time.perf_counter() - start) * 1000:.0f} ms")
+        else:
+            print_report(store)
+
+
+if __name__ == "__main__":
+    main()
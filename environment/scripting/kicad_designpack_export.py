@@ -7,13 +7,18 @@
 # REQUIRES 'pypdf' python package installed, Tested using v3.15.0 - install using 'pip3 install pypdf' on command line
 # 
 # Once all the requirements are installed and the CONFIG values are filled out, simply run this script with python in your preferred way.
+# The export stages are independent kicad-cli runs, so they run in parallel (see CONFIG_EXPORT_MAX_WORKERS) with a timing summary at the end.
+# Stages are skipped when nothing they depend on has changed since the last export (see CONFIG_EXPORT_CACHE), delete the cache file to force a full export.
+# To export every project under CONFIG_KICAD_FOLDER at once, run it with '--batch' (see BATCH EXPORT).
+# Every stage's wall/CPU time, memory and output size are saved to a trace file after each export (see STAGE TRACE), and '--benchmark' times repeated exports (see BENCHMARK).
+# Optionally install 'psutil' ('pip3 install psutil') to include the CPU time and memory of the kicad-cli processes.
+# kicad-cli output is printed line by line as it runs, prefixed with the stage name, and at most CONFIG_EXPORT_MAX_PROCESSES run at once (see kicad_process_runner.py).
 #
 # Copyright Optimised Product Design Ltd 2023-2025
 #
 #
 ## TO-DO
 #
-# - use new flag '--mode-multipage' for separate-page PDF export of multiple layers
 # - Set soldermask expansion/min web values(?)
 # - Use custom colour scheme(?)
 # - fixes before IPC-2581 can be used
@@ -25,7 +30,32 @@
 
 import subprocess
 import os
+import sys
+import csv
+import glob
+import json
+import hashlib
+import io
+import shutil
+import gzip
+import re
+import tempfile
+import time
+import threading
+import traceback
+import importlib.util
+import math
+import statistics
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pypdf import PdfMerger, PdfReader, PdfWriter
+from kicad_sexpr import iter_nodes, apply_edits, quote
+from kicad_bom import BomTable, check_bom, build_bom, write_csv, print_problems, print_summary
+from kicad_process_runner import JobGroup, JobCancelled, shared_runner
+
+try:
+    import psutil # Optional, install with 'pip3 install psutil' to also record the CPU time and memory of each kicad-cli process
+except ImportError:
+    psutil = None
 
 
 ###########################################
@@ -33,6 +63,7 @@ from pypdf import PdfMerger, PdfReader, PdfWriter
 #   CONFIG VALUES - set these before using script.
 #   For paths, use double backslashes '\\'
 #   All folders must *exist already*
+#   The project's own files and output paths are set from its name in set_project(), at the end
 #
 ###########################################
 
@@ -41,9 +72,6 @@ CONFIG_KICAD_VERSION_BOM = "1A"
 CONFIG_KICAD_CLI_PATH = "C:\\Program Files\\KiCad\\9.0\\bin\\kicad-cli"
 CONFIG_KICAD_FOLDER = "C:\\freelance\\git\\"
 CONFIG_KICAD_NAME = "pt140a_vsmsc_8sim_4g_usb_dongle"  # Main configuration to set, if design follows Optimiseds' conventions
-CONFIG_KICAD_PROJECT = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\" + CONFIG_KICAD_NAME + ".kicad_pro"
-CONFIG_KICAD_SCH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\" + CONFIG_KICAD_NAME + ".kicad_sch"
-CONFIG_KICAD_PCB = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\" + CONFIG_KICAD_NAME + ".kicad_pcb"
 CONFIG_KICAD_LAYERS_FRONT = "F.Fab,Edge.Cuts,User.Drawings,F.Cu,F.Mask,F.Paste,F.Silkscreen,"
 CONFIG_KICAD_LAYERS_BACK = "B.Fab,B.Cu,B.Mask,B.Paste,B.Silkscreen,User.Comments"
 CONFIG_KICAD_LAYERS_FLEX = "User.1,User.2" # i.e. "Flex.pcb.rigid,Flex.pcb.not.rigid"
@@ -54,63 +82,202 @@ CONFIG_KICAD_LAYERS_6L = CONFIG_KICAD_LAYERS_FRONT + "In1.Cu,In2.Cu,In3.Cu,In4.C
 CONFIG_KICAD_LAYERS_8L = CONFIG_KICAD_LAYERS_FRONT + "In1.Cu,In2.Cu,In3.Cu,In4.Cu,In5.Cu,In6.Cu," + CONFIG_KICAD_LAYERS_BACK
 CONFIG_KICAD_LAYERS_OUTPUT = CONFIG_KICAD_LAYERS_4L     # **Note**: Adjust based on the number/type of PCB layers
 
-# for sch_export_pdf
-CONFIG_SCH_EXPORT_PDF_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\" + CONFIG_KICAD_NAME + "_schematic.pdf"
+# for the export stage scheduler (see MAIN)
+CONFIG_EXPORT_MAX_WORKERS = 4         # Max stages (kicad-cli processes) running at once, 1 runs them one after another as before
+CONFIG_EXPORT_STAGE_TIMEOUT = 900     # Default per-stage timeout in seconds, None for no limit
+CONFIG_EXPORT_STAGE_TIMEOUTS = {      # Per-stage overrides of the above, by stage name
+    "pcb_export_step": 3600,
+    "pcb_export_render_top": 3600,
+    "pcb_export_render_bottom": 3600,
+}
+CONFIG_EXPORT_MAX_PROCESSES = 6       # Max kicad-cli/git processes running at once, across all the stages (and all the projects in batch mode)
+CONFIG_EXPORT_CANCEL_ON_FAILURE = False   # True to stop a project's export as soon as one of its stages times out or errors (or a gate stage fails) - its running kicad-cli processes are killed and the stages not yet started skipped
+CONFIG_EXPORT_AFTER_CHECKS = False    # True to only start the export stages once ERC and DRC have both finished
+CONFIG_EXPORT_LIBRARY_CHECK = False   # True to also check the library for broken footprint, 3D model and datasheet links (see kicad_library_check.py)
+CONFIG_EXPORT_LIBRARY_CHECK_GATE = False   # True to not export anything if the library check finds broken links
+CONFIG_EXPORT_CACHE = True            # Skip stages whose input files and settings are unchanged since the last export, and whose outputs are still in place
+
+# for the stage trace - wall/CPU time, peak memory and output size of every stage (see STAGE TRACE)
+CONFIG_EXPORT_TRACE_SAMPLE_INTERVAL = 0.1   # Seconds between samples of each kicad-cli process's CPU time and memory, needs 'psutil' (see top)
+
+# for benchmark mode (python kicad_designpack_export.py --benchmark RUNS [PROJECT_NAME]), exporting a reference project RUNS times without any caching
+CONFIG_BENCHMARK_FILEPATH = CONFIG_KICAD_FOLDER + ".designpack_benchmark.json"   # Results of every benchmark, each compared with the last one for the same project
+
+# for batch mode (python kicad_designpack_export.py --batch [PROJECT_NAME ...]), exporting all (or the named) projects under CONFIG_KICAD_FOLDER
+CONFIG_BATCH_MAX_WORKERS = 8          # Max stages running at once across all the projects
+CONFIG_BATCH_LAYOUT_FOLDERS = "design,manufacturing,mechanical,images"   # Sub-folders a project folder must have to be found, as well as design\\<name>.kicad_pro
+CONFIG_BATCH_TRACE_FILEPATH = CONFIG_KICAD_FOLDER + ".designpack_batch_trace"   # One stage trace for all the projects, None to disable
 
 # for sch_export_bom
-CONFIG_PCB_EXPORT_BOM_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\" + CONFIG_KICAD_NAME + "_bom_" + CONFIG_KICAD_VERSION_BOM + ".csv"
 CONFIG_PCB_EXPORT_BOM_FIELDS = "${ITEM_NUMBER},Reference,${QUANTITY},${DNP},Value,Description,Manufacturer1,MPN1,Manufacturer2,MPN2,Vendor1,SKU1,Vendor2,SKU2"
 CONFIG_PCB_EXPORT_BOM_LABELS = "Item,References,Qty,FitPart,Value,Description,Manufacturer1,MPN1,Manufacturer2,MPN2,Vendor1,SKU1,Vendor2,SKU2"
 CONFIG_PCB_EXPORT_BOM_GROUP = "Description,Manufacturer1,MPN1,Manufacturer2,MPN2,Value,${DNP},Footprint"
+CONFIG_PCB_EXPORT_BOM_REQUIRED = "Manufacturer1,MPN1"   # Fields every fitted BoM line must have, the stage fails if any are missing (see kicad_bom.py)
+CONFIG_PCB_EXPORT_BOM_BUILD_QUANTITIES = [1, 10, 100]   # Boards per build, for the build BoM quantities
 
 # for pcb_export_pdf
-CONFIG_PCB_EXPORT_PDF_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\" + CONFIG_KICAD_NAME + "_layout.pdf"
-CONFIG_PCB_EXPORT_PDF_FILEPATH_TEMP = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\" + CONFIG_KICAD_NAME + "_TEMP.pdf"
 CONFIG_PCB_EXPORT_PDF_LAYERS = CONFIG_KICAD_LAYERS_OUTPUT
+CONFIG_PCB_EXPORT_PDF_MULTIPAGE = True    # Export all layers in one kicad-cli call with '--mode-multipage' (KiCAD v9+), falls back to one call per layer if that fails
+CONFIG_PCB_EXPORT_PDF_MAX_WORKERS = 4     # For the one-call-per-layer fallback, max layers exported at once (on top of the other stages running)
 
-# for pcb_export_step
-CONFIG_PCB_EXPORT_STEP_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\mechanical\\" + CONFIG_KICAD_NAME + ".step"
-
-# for pcb_export_pos
-CONFIG_PCB_EXPORT_POS_FILEPATH_FRONT = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\" + CONFIG_KICAD_NAME + "-top-pos.csv"
-CONFIG_PCB_EXPORT_POS_FILEPATH_BACK = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\" + CONFIG_KICAD_NAME + "-bottom-pos.csv"
-
-# for pcb_export_drill
-CONFIG_PCB_EXPORT_DRILL_FOLDERPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\"  # Note: is a FOLDER not a FILE path for drill
+# for pcb_prepare_models (used by pcb_export_step and pcb_export_render)
+CONFIG_PCB_MODEL_CACHE = True         # Pre-process the board's STEP models once (keyed by content hash), and point the STEP export and renders at the cached copies
+CONFIG_PCB_MODEL_CACHE_COMPRESS = False   # Also gzip the cached models (.stpZ), smaller to read but KiCAD then has to decompress them
 
 # for pcb_export_gerbers
-CONFIG_PCB_EXPORT_GERBERS_FOLDERPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\"  # Note: is a FOLDER not a FILE path for gerbers
 CONFIG_PCB_EXPORT_GERBERS_LAYERS = CONFIG_KICAD_LAYERS_OUTPUT
 CONFIG_PCB_EXPORT_GERBERS_LAYERS_COMMON = ""    # Think best to have no common layers, though could be Edge.Cuts?
 
+# for pcb_export_fab (gerbers, drill and pos files together, see kicad_fab_worker.py)
+CONFIG_PCB_FAB_BACKEND = "kicad-cli"   # "pcbnew" to load the board once in KiCAD's Python and plot all of them from that, "kicad-cli" for one kicad-cli run each
+CONFIG_PCB_FAB_PYTHON_PATH = "C:\\Program Files\\KiCad\\9.0\\bin\\python.exe"   # KiCAD's own Python, which has pcbnew
+
 # for pcb_export_render
 CONFIG_PCB_EXPORT_RENDER_FILETYPE = ".png" # .png, .jpg, or .jpeg
-CONFIG_PCB_EXPORT_RENDER_FILEPATH_TOP = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\images\\" + CONFIG_KICAD_NAME + "_top" + CONFIG_PCB_EXPORT_RENDER_FILETYPE
-CONFIG_PCB_EXPORT_RENDER_FILEPATH_BOTTOM = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\images\\" + CONFIG_KICAD_NAME + "_bottom" + CONFIG_PCB_EXPORT_RENDER_FILETYPE
 CONFIG_PCB_EXPORT_RENDER_WIDTH = "3200"
 CONFIG_PCB_EXPORT_RENDER_HEIGHT = "1800"
 CONFIG_PCB_EXPORT_RENDER_ZOOM = "1"   # Zoom factor as INTEGER
+CONFIG_PCB_EXPORT_RENDER_QUALITY = "high"
+CONFIG_PCB_EXPORT_RENDER_DRAFT = False    # True for quick low-res previews, False for full renders, "auto" for full renders only when the design's git HEAD is tagged (a release pack, needs git on PATH)
+CONFIG_PCB_EXPORT_RENDER_DRAFT_SCALE = 4  # Draft renders are WIDTH and HEIGHT divided by this...
+CONFIG_PCB_EXPORT_RENDER_DRAFT_QUALITY = "basic"   # ...at this quality...
+CONFIG_PCB_EXPORT_RENDER_DRAFT_SUFFIX = "_draft"   # ...and saved with this added to the filename (e.g. NAME_top_draft.png), so they never replace the full renders
 
 # for pcb_export_odb
-CONFIG_PCB_EXPORT_ODB_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\" + CONFIG_KICAD_NAME + "_odb.zip"
 CONFIG_PCB_EXPORT_ODB_COMPRESSION = "zip" # none, zip (default), or tgz
 CONFIG_PCB_EXPORT_ODB_UNITS = "mm" # mm (default) or in
 CONFIG_PCB_EXPORT_ODB_PRECISION = "6"
 
 # for pcb_export_ipc2581
 CONFIG_PCB_EXPORT_IPC2581_VERSION = "B"
-CONFIG_PCB_EXPORT_IPC2581_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\" + CONFIG_KICAD_NAME + "_ipc2581.xml"
 CONFIG_PCB_EXPORT_IPC2581_BOM_ID = "Reference"
 CONFIG_PCB_EXPORT_IPC2581_BOM_MFG = "Manufacturer1"
 CONFIG_PCB_EXPORT_IPC2581_BOM_MFG_PN = "MPN1"
 CONFIG_PCB_EXPORT_IPC2581_BOM_DIST = "Vendor1"
 CONFIG_PCB_EXPORT_IPC2581_BOM_DIST_PN = "SKU1"
 
-# for sch_erc
-CONFIG_SCH_ERC_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\" + CONFIG_KICAD_NAME + "-erc.rpt"
+# for both checks - violations are compared against the baseline files (see set_project), so only new ones count
+CONFIG_CHECKS_FAIL_FAST = False         # True to not start any export stage if ERC or DRC has new errors
+CONFIG_CHECKS_BASELINE_UPDATE = False   # True to accept the current violations as the new baselines (set back to False afterwards)
+
+
+# Every CONFIG value derived from the project name (its files, output paths and caches), for the stages below.
+# Set for CONFIG_KICAD_NAME when the script loads, and for each project in batch mode (see BATCH EXPORT).
+def set_project(name):
+    global CONFIG_KICAD_NAME, CONFIG_KICAD_PROJECT, CONFIG_KICAD_SCH, CONFIG_KICAD_PCB, CONFIG_KICAD_LIBRARY_FOLDER, \
+           CONFIG_KICAD_LIBRARY_INDEX_FILEPATH, CONFIG_EXPORT_CACHE_FILEPATH, CONFIG_EXPORT_TRACE_FILEPATH, CONFIG_SCH_EXPORT_PDF_FILEPATH, \
+           CONFIG_PCB_EXPORT_BOM_FILEPATH, CONFIG_PCB_EXPORT_BOM_BUILD_FILEPATH, CONFIG_PCB_EXPORT_PDF_FILEPATH, CONFIG_PCB_EXPORT_PDF_FILEPATH_TEMP, \
+           CONFIG_PCB_EXPORT_STEP_FILEPATH, CONFIG_PCB_MODEL_CACHE_FOLDER, CONFIG_PCB_EXPORT_POS_FILEPATH_FRONT, CONFIG_PCB_EXPORT_POS_FILEPATH_BACK, \
+           CONFIG_PCB_EXPORT_DRILL_FOLDERPATH, CONFIG_PCB_EXPORT_GERBERS_FOLDERPATH, CONFIG_PCB_EXPORT_RENDER_FILEPATH_TOP, \
+           CONFIG_PCB_EXPORT_RENDER_FILEPATH_BOTTOM, CONFIG_PCB_EXPORT_RENDER_CACHE_FOLDER, CONFIG_PCB_EXPORT_ODB_FILEPATH, \
+           CONFIG_PCB_EXPORT_IPC2581_FILEPATH, CONFIG_SCH_ERC_FILEPATH, CONFIG_SCH_ERC_BASELINE_FILEPATH, CONFIG_PCB_DRC_FILEPATH, \
+           CONFIG_PCB_DRC_BASELINE_FILEPATH
+    CONFIG_KICAD_NAME = name
+    CONFIG_KICAD_PROJECT = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\" + CONFIG_KICAD_NAME + ".kicad_pro"
+    CONFIG_KICAD_SCH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\" + CONFIG_KICAD_NAME + ".kicad_sch"
+    CONFIG_KICAD_PCB = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\" + CONFIG_KICAD_NAME + ".kicad_pcb"
+    CONFIG_KICAD_LIBRARY_FOLDER = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\optimised_kicad-libraries\\"  # This library, as a submodule of the design - None to skip the library checks below
+    CONFIG_KICAD_LIBRARY_INDEX_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\.library_index.sqlite"   # Index of the library for the checks (see kicad_library_index.py), kept out of the submodule checkout - created if needed, safe to delete
+
+    # for the export stage scheduler (see MAIN)
+    CONFIG_EXPORT_CACHE_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\.designpack_cache.json"
+
+    # for the stage trace - wall/CPU time, peak memory and output size of every stage (see STAGE TRACE)
+    CONFIG_EXPORT_TRACE_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\.designpack_trace"   # Written as .json, .csv and .chrome.json (open in chrome://tracing or ui.perfetto.dev), None to disable
+
+    # for sch_export_pdf
+    CONFIG_SCH_EXPORT_PDF_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\" + CONFIG_KICAD_NAME + "_schematic.pdf"
+
+    # for sch_export_bom
+    CONFIG_PCB_EXPORT_BOM_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\" + CONFIG_KICAD_NAME + "_bom_" + CONFIG_KICAD_VERSION_BOM + ".csv"
+    CONFIG_PCB_EXPORT_BOM_BUILD_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\" + CONFIG_KICAD_NAME + "_bom_" + CONFIG_KICAD_VERSION_BOM + "_build.csv"  # One line per part to buy, None to skip
+
+    # for pcb_export_pdf
+    CONFIG_PCB_EXPORT_PDF_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\" + CONFIG_KICAD_NAME + "_layout.pdf"
+    CONFIG_PCB_EXPORT_PDF_FILEPATH_TEMP = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\" + CONFIG_KICAD_NAME + "_TEMP.pdf"
+
+    # for pcb_export_step
+    CONFIG_PCB_EXPORT_STEP_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\mechanical\\" + CONFIG_KICAD_NAME + ".step"
+
+    # for pcb_prepare_models (used by pcb_export_step and pcb_export_render)
+    CONFIG_PCB_MODEL_CACHE_FOLDER = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\.model_cache\\"   # Created if needed, safe to delete
+
+    # for pcb_export_pos
+    CONFIG_PCB_EXPORT_POS_FILEPATH_FRONT = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\" + CONFIG_KICAD_NAME + "-top-pos.csv"
+    CONFIG_PCB_EXPORT_POS_FILEPATH_BACK = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\" + CONFIG_KICAD_NAME + "-bottom-pos.csv"
+
+    # for pcb_export_drill
+    CONFIG_PCB_EXPORT_DRILL_FOLDERPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\"  # Note: is a FOLDER not a FILE path for drill
+
+    # for pcb_export_gerbers
+    CONFIG_PCB_EXPORT_GERBERS_FOLDERPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\"  # Note: is a FOLDER not a FILE path for gerbers
+
+    # for pcb_export_render
+    CONFIG_PCB_EXPORT_RENDER_FILEPATH_TOP = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\images\\" + CONFIG_KICAD_NAME + "_top" + CONFIG_PCB_EXPORT_RENDER_FILETYPE
+    CONFIG_PCB_EXPORT_RENDER_FILEPATH_BOTTOM = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\images\\" + CONFIG_KICAD_NAME + "_bottom" + CONFIG_PCB_EXPORT_RENDER_FILETYPE
+    CONFIG_PCB_EXPORT_RENDER_CACHE_FOLDER = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\.render_cache\\"  # Renders by board content + settings, reused whenever both match again, None to disable
+
+    # for pcb_export_odb
+    CONFIG_PCB_EXPORT_ODB_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\" + CONFIG_KICAD_NAME + "_odb.zip"
+
+    # for pcb_export_ipc2581
+    CONFIG_PCB_EXPORT_IPC2581_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\manufacturing\\" + CONFIG_KICAD_NAME + "_ipc2581.xml"
+
+    # for sch_erc
+    CONFIG_SCH_ERC_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\" + CONFIG_KICAD_NAME + "-erc.json"
+    CONFIG_SCH_ERC_BASELINE_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\" + CONFIG_KICAD_NAME + "-erc-baseline.json"
+
+    # for pcb_drc
+    CONFIG_PCB_DRC_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\" + CONFIG_KICAD_NAME + "-drc.json"
+    CONFIG_PCB_DRC_BASELINE_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\" + CONFIG_KICAD_NAME + "-drc-baseline.json"
+
+
+set_project(CONFIG_KICAD_NAME)
+
+
+###########################################
+#
+#   Run a KiCAD CLI command for the current export stage
+#   When run from the stage scheduler, the stage's timeout is applied and the exit code recorded for the summary
+#   Not run through the shell, so that a timeout kills kicad-cli itself rather than just the shell around it
+#   All the commands go through one shared runner (see kicad_process_runner.py), which prints their output as it comes,
+#   caps the number running at once, and kills those of a project whose export is cancelled (see CONFIG_EXPORT_CANCEL_ON_FAILURE)
+#
+###########################################
+
+_stage_context = threading.local()
+
+def stage_returncode(code):
+    # Record a result for the current stage that isn't a kicad-cli exit code, e.g. a check failing on its parsed report
+    stage = getattr(_stage_context, "stage", None)
+    if stage is not None:
+        stage.returncodes.append(code)
+
+
+def run_cli(cmd, record=True, echo=True, jobs=None):
+    # record=False is for attempts that the caller falls back from itself, so a failure doesn't count against the stage
+    # echo=False for output the caller parses rather than shows, jobs to put the process in a group of its own rather than the stage's
+    stage = getattr(_stage_context, "stage", None)
+
+    timeout = None
+    if stage is not None and stage.deadline is not None:
+        timeout = max(stage.deadline - time.perf_counter(), 0)
+
+    process = shared_runner(CONFIG_EXPORT_MAX_PROCESSES).run(cmd,
+                                                             timeout=timeout,
+                                                             prefix="[" + (stage.name if stage is not None else "kicad-cli") + "] ",
+                                                             echo=echo,
+                                                             jobs=jobs if jobs is not None else (stage.jobs if stage is not None else None),
+                                                             sample_interval=CONFIG_EXPORT_TRACE_SAMPLE_INTERVAL if stage is not None else None)
+
+    if stage is not None:
+        if process.cpu_time is not None:
+            stage.children.append((process.cpu_time, process.peak_rss))
+        if record:
+            stage.returncodes.append(process.returncode)
+
+    return process
 
-# for pcb_drc
-CONFIG_PCB_DRC_FILEPATH = CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME + "\\design\\" + CONFIG_KICAD_NAME + "-drc.rpt"
 
 
 ###########################################
@@ -131,12 +298,9 @@ def sch_export_pdf():
             '--no-background-color',
             CONFIG_KICAD_SCH]
             
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
+    process = run_cli(cmd)
     
-    print("Result: " + process.stdout)
+    print("Result: exit code " + str(process.returncode))
 
     # Don't read and re-write PDF here - actually *increases* PDF size for Schematic unlike Layout PDF so not worth it.
     # Also want to keep the schematic links (v useful feature in KiCAD v7+) so can't use that saving.
@@ -173,12 +337,40 @@ def sch_export_bom():
             CONFIG_KICAD_SCH,
             '--sort-asc']
            
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
+    process = run_cli(cmd)
     
-    print("Result: " + process.stdout)   
+    print("Result: exit code " + str(process.returncode))
+
+    if process.returncode == 0:
+        sch_process_bom()
+
+
+def sch_process_bom():
+    # Check the exported BoM (required fields, duplicates, DNP, MPNs against the library index) and write the build BoM, see kicad_bom.py
+    table = BomTable.load(CONFIG_PCB_EXPORT_BOM_FILEPATH, dict(zip(CONFIG_PCB_EXPORT_BOM_FIELDS.split(","), CONFIG_PCB_EXPORT_BOM_LABELS.split(","))))
+
+    # Not every design has the library submodule checked out, and the BoM is still worth exporting without it
+    mpn_manufacturers = None
+    if CONFIG_KICAD_LIBRARY_FOLDER and os.path.isdir(CONFIG_KICAD_LIBRARY_FOLDER):
+        from kicad_library_index import LibraryIndex
+        with LibraryIndex.open(CONFIG_KICAD_LIBRARY_FOLDER, CONFIG_KICAD_LIBRARY_INDEX_FILEPATH) as index:
+            mpn_manufacturers = index.mpn_manufacturers()
+    elif CONFIG_KICAD_LIBRARY_FOLDER:
+        print("No library folder at " + CONFIG_KICAD_LIBRARY_FOLDER + ", so the MPNs aren't checked against the library")
+
+    problems, summary = check_bom(table, mpn_manufacturers, CONFIG_PCB_EXPORT_BOM_REQUIRED.split(",") if CONFIG_PCB_EXPORT_BOM_REQUIRED else [])
+    print_problems(problems)
+    print_summary(summary)
+
+    if CONFIG_PCB_EXPORT_BOM_BUILD_FILEPATH:
+        header, rows = build_bom(table, CONFIG_PCB_EXPORT_BOM_BUILD_QUANTITIES)
+        write_csv(CONFIG_PCB_EXPORT_BOM_BUILD_FILEPATH, header, rows)
+        print("Build BoM (" + str(len(rows)) + " lines) saved to;\n" + CONFIG_PCB_EXPORT_BOM_BUILD_FILEPATH)
+
+    errors = sum(1 for problem in problems if problem[0] == "error")
+    if errors:
+        print("BoM has " + str(errors) + " errors.")
+        stage_returncode(1)
 
 
 
@@ -192,45 +384,42 @@ def sch_export_bom():
 def pcb_export_pdf():
     print("\n## Exporting Layout PDF of all layers...")
 
-    # Create PDF Object to merge all the individual Layer PDFs into
-    merger = PdfWriter()
-    #pypdf.errors.DeprecationError: PdfMerger is deprecated and was removed in pypdf 5.0.0. Use PdfWriter instead.
-
-    # Loop over layers in CONFIG_PCB_EXPORT_PDF_LAYERS_2L to export individually
-    layers = CONFIG_PCB_EXPORT_PDF_LAYERS
-    for layer in layers.split(","):
-
-        # Export single-layer temporary PDF using KiCAD CLI
-        print("Exporting Layout PDF (temp single layer: " + layer + ")...")
-        pcb_export_pdf_single(layer)
-
-        # Append this temporary PDF page to our created PDF object
-        merger.append(open(CONFIG_PCB_EXPORT_PDF_FILEPATH_TEMP, 'rb'))
-    
-    # Save merged PDF of all the individual layer pages
-    print("Saving merged Layout PDF of all layers, to;\n" + CONFIG_PCB_EXPORT_PDF_FILEPATH + " ...\n")
-    with open(CONFIG_PCB_EXPORT_PDF_FILEPATH, "wb") as fout:
-        merger.write(fout)
+    # Export all the layers as separate pages in a single board load if the CLI supports it, otherwise one layer at a time
+    if CONFIG_PCB_EXPORT_PDF_MULTIPAGE and pcb_export_pdf_multipage():
+        with open(CONFIG_PCB_EXPORT_PDF_FILEPATH_TEMP, 'rb') as fin:
+            readers = [PdfReader(io.BytesIO(fin.read()))]
 
-    # Delete temporary PDF file
-    os.remove(CONFIG_PCB_EXPORT_PDF_FILEPATH_TEMP)
+        # Delete temporary PDF file
+        os.remove(CONFIG_PCB_EXPORT_PDF_FILEPATH_TEMP)
+    else:
+        readers = pcb_export_pdf_layers(CONFIG_PCB_EXPORT_PDF_LAYERS.split(","))
 
-    # Read and re-write PDF to reduce file size by approx 10%...
-    print("Reading & re-writing PDF to reduce file size...")
-    reader = PdfReader(CONFIG_PCB_EXPORT_PDF_FILEPATH)
+    # Save all the pages in one write, without the links
+    print("Saving Layout PDF of all layers, to;\n" + CONFIG_PCB_EXPORT_PDF_FILEPATH + " ...\n")
     writer = PdfWriter()
-    
-    for page in reader.pages:
-        writer.add_page(page)
+    #pypdf.errors.DeprecationError: PdfMerger is deprecated and was removed in pypdf 5.0.0. Use PdfWriter instead.
+
+    for reader in readers:
+        for page in reader.pages:
+            writer.add_page(page)
 
     writer.remove_links()   # Reduces PDF size by further 76% on test project (7.6MB to 1.8MB)!
-    writer.add_metadata(reader.metadata)
+    if readers[0].metadata is not None:
+        writer.add_metadata(readers[0].metadata)
 
     with open(CONFIG_PCB_EXPORT_PDF_FILEPATH, "wb") as fp:
         writer.write(fp)
 
 
-def pcb_export_pdf_single(layer):
+def pcb_export_pdf_multipage():
+    print("Exporting Layout PDF (temp multipage: " + CONFIG_PCB_EXPORT_PDF_LAYERS + ")...")
+
+    # Remove any old temporary PDF, so can tell below if this export actually wrote one
+    try:
+        os.remove(CONFIG_PCB_EXPORT_PDF_FILEPATH_TEMP)
+    except FileNotFoundError:
+        pass
+
     cmd = [CONFIG_KICAD_CLI_PATH,
             'pcb',
             'export',
@@ -238,6 +427,72 @@ def pcb_export_pdf_single(layer):
             '--output',
             CONFIG_PCB_EXPORT_PDF_FILEPATH_TEMP,
             '--layers',
+            CONFIG_PCB_EXPORT_PDF_LAYERS,
+            '--common-layers',
+            'Edge.Cuts',
+            '--mode-multipage',     # One page per layer in a single file, requires KiCAD v9
+            '--include-border-title',
+            '--black-and-white',
+            '--drill-shape-opt',    # Fix for missing copper in drill holes, requires KiCAD v7.0.8
+            '0',                    # Fix for missing copper in drill holes, requires KiCAD v7.0.8
+            CONFIG_KICAD_PCB]
+
+    process = run_cli(cmd, record=False)
+
+    print("Result: exit code " + str(process.returncode))
+
+    if process.returncode != 0 or not os.path.exists(CONFIG_PCB_EXPORT_PDF_FILEPATH_TEMP):
+        print("Multipage export not supported by this kicad-cli (see its output above), exporting one layer at a time instead")
+        return False
+
+    return True
+
+
+def pcb_export_pdf_layers(layers):
+    # Each layer goes to its own file in a scratch folder, so they can all be exported at once
+    stage = getattr(_stage_context, "stage", None)
+
+    # The layers are no use without each other, so the first to fail cancels the rest (as does the stage being cancelled)
+    layer_jobs = JobGroup(stage.jobs if stage is not None else None)
+
+    with tempfile.TemporaryDirectory(prefix=CONFIG_KICAD_NAME + "_pdf_") as scratch:
+
+        def export_layer(index, layer):
+            _stage_context.stage = stage    # So the stage's timeout and exit codes still apply in this worker thread
+
+            try:
+                # Export single-layer temporary PDF using KiCAD CLI
+                print("Exporting Layout PDF (temp single layer: " + layer + ")...")
+                layer_filepath = os.path.join(scratch, "%02d_%s.pdf" % (index, layer))
+                pcb_export_pdf_single(layer, layer_filepath, layer_jobs)
+
+                # Read it into memory, so the scratch folder can be deleted
+                with open(layer_filepath, 'rb') as fin:
+                    return PdfReader(io.BytesIO(fin.read()))
+            except Exception:
+                layer_jobs.cancel("layer " + layer + " failed")
+                raise
+
+        with ThreadPoolExecutor(max_workers=CONFIG_PCB_EXPORT_PDF_MAX_WORKERS) as pool:
+            futures = [pool.submit(export_layer, index, layer) for index, layer in enumerate(layers)]
+            wait(futures)
+
+            # Report the layer that failed rather than those cancelled because of it, then collect in layer order
+            errors = [future.exception() for future in futures if future.exception() is not None]
+            for error in errors:
+                if not isinstance(error, JobCancelled):
+                    raise error
+            return [future.result() for future in futures]
+
+
+def pcb_export_pdf_single(layer, output_filepath, jobs=None):
+    cmd = [CONFIG_KICAD_CLI_PATH,
+            'pcb',
+            'export',
+            'pdf',
+            '--output',
+            output_filepath,
+            '--layers',
             layer + ",Edge.Cuts",
             '--include-border-title',
             '--black-and-white',
@@ -245,12 +500,180 @@ def pcb_export_pdf_single(layer):
             '0',                    # Fix for missing copper in drill holes, requires KiCAD v7.0.8
             CONFIG_KICAD_PCB]
             
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
+    process = run_cli(cmd, jobs=jobs)
     
-    print("Result: " + process.stdout)
+    print("Result: exit code " + str(process.returncode))
+
+
+
+###########################################
+#
+#   Prepare the board's STEP models for pcb_export_step and pcb_export_render
+#   Each model is simplified once into CONFIG_PCB_MODEL_CACHE_FOLDER, named by a hash of its content, and a copy of the board
+#   pointing at those is written there too - the original board and library models are never changed.
+#   Simplification is lossless: comments and whitespace stripped, reals written in their shortest exact form (the 19 digit
+#   exports from SolidWorks etc are beyond double precision anyway), and duplicate points/directions merged.
+#
+###########################################
+
+STEP_TOKEN_RE = re.compile(r"('(?:[^']|'')*')|/\*.*?\*/|(\s+)|(;)|([-+]?\d+\.\d*(?:[eE][-+]?\d+)?)|#(\d+)", flags=re.DOTALL)
+STEP_ENTITY_RE = re.compile(r"^#(\d+)=(CARTESIAN_POINT|DIRECTION)(\(.*\));\n", flags=re.MULTILINE)
+STEP_MODEL_EXTENSIONS = (".stp", ".step")
+STEP_SIMPLIFY_VERSION = "1"   # Bump when step_simplify() changes, so cached models are redone
+
+
+def step_real(text):
+    # Shortest text that reads back as the same double, in STEP form (always with a '.', e.g. '2.', '1.5E-05')
+    mantissa, _, exponent = repr(float(text)).upper().partition("E")
+    if "." not in mantissa:
+        mantissa += "."
+    elif mantissa.endswith(".0"):
+        mantissa = mantissa[:-1]
+    return mantissa + ("E" + exponent if exponent else "")
+
+
+def step_simplify(data):
+    text = data.decode("latin-1")
+
+    def compact(match):
+        if match.group(1) is not None:
+            return match.group(1)
+        if match.group(3) is not None:
+            return ";\n"
+        if match.group(4) is not None:
+            return step_real(match.group(4))
+        if match.group(5) is not None:
+            return match.group(0)
+        return ""   # comments and whitespace
+
+    text = STEP_TOKEN_RE.sub(compact, text)
+
+    # Merge duplicate points and directions - pure values, so sharing them changes nothing - then point every reference at the one kept
+    first = {}
+    merged = {}
+    for match in STEP_ENTITY_RE.finditer(text):
+        key = match.group(2) + match.group(3)
+        if key in first:
+            merged[match.group(1)] = first[key]
+        else:
+            first[key] = match.group(1)
+
+    if merged:
+        text = STEP_ENTITY_RE.sub(lambda match: "" if match.group(1) in merged else match.group(0), text)
+        text = STEP_TOKEN_RE.sub(lambda match: "#" + merged[match.group(5)] if match.group(5) in merged else match.group(0), text)
+
+    return text.encode("latin-1")
+
+
+def resolve_model_path(path):
+    # ${KIPRJMOD} and relative paths are from the board's folder, other variables come from the environment (unresolved ones are left for KiCAD)
+    board_folder = os.path.dirname(os.path.abspath(CONFIG_KICAD_PCB))
+    def variable(match):
+        if match.group(1) == "KIPRJMOD":
+            return board_folder
+        return os.environ.get(match.group(1), match.group(0))
+    path = re.sub(r'\$\{([^}]+)\}', variable, path)
+    if "${" not in path and not os.path.isabs(path):
+        path = os.path.join(board_folder, path)
+    return os.path.normpath(path)
+
+
+def pcb_model_nodes(text):
+    # Footprints are at depth 2 of the board, so their (model ...) lists are at depth 3 - yields (path atom, resolved path)
+    for node in iter_nodes(text, 3, 3):
+        atoms = node.atoms()
+        if node.head == "model" and atoms:
+            yield atoms[0], resolve_model_path(atoms[0].value)
+
+
+def pcb_model_files():
+    # Every model file the board's 3D view loads, including the STEP stand-ins --subst-models uses for VRML models,
+    # for the cache keys of the STEP export and renders (the board alone doesn't change when a library model does).
+    # The board's model paths are only parsed again when it changes, but resolved and looked for every time.
+    record = file_record(CONFIG_KICAD_PCB)
+    if "models" not in record:
+        with open(CONFIG_KICAD_PCB, "r", encoding="utf-8", newline="") as f:
+            text = f.read()
+        record["models"] = sorted({atom.value for atom, _ in pcb_model_nodes(text)})
+    files = set()
+    for model_path in (resolve_model_path(path) for path in record["models"]):
+        base = os.path.splitext(model_path)[0]
+        for path in (model_path, base + ".step", base + ".stp"):
+            if os.path.isfile(path):
+                files.add(path)
+    return sorted(files)
+
+
+def pcb_model_board():
+    # The board to give kicad-cli for anything that loads the 3D models
+    prepared = CONFIG_PCB_MODEL_CACHE_FOLDER + CONFIG_KICAD_NAME + ".kicad_pcb"
+    if CONFIG_PCB_MODEL_CACHE and os.path.exists(prepared):
+        return prepared
+    return CONFIG_KICAD_PCB
+
+
+def pcb_prepare_models():
+    print("\n## Preparing 3D models...")
+    prepared = CONFIG_PCB_MODEL_CACHE_FOLDER + CONFIG_KICAD_NAME + ".kicad_pcb"
+
+    # Any failure leaves no board copy, so the STEP export and renders still run, on the original board (see pcb_model_board)
+    try:
+        if os.path.exists(prepared):
+            os.remove(prepared)
+        pcb_prepare_models_board(prepared)
+    except (OSError, UnicodeError, ValueError) as e:
+        print("Couldn't prepare the 3D models (" + str(e) + "), so the STEP export and renders use the original board")
+        stage_returncode(1)
+
+
+def pcb_prepare_models_board(prepared):
+    start = time.perf_counter()
+    os.makedirs(CONFIG_PCB_MODEL_CACHE_FOLDER, exist_ok=True)
+    with open(CONFIG_KICAD_PCB, "r", encoding="utf-8", newline="") as f:
+        text = f.read()
+
+    edits = []
+    done = {}
+    size_before = size_after = simplified = 0
+    for atom, model_path in pcb_model_nodes(text):
+        if model_path.lower().endswith(STEP_MODEL_EXTENSIONS) and os.path.isfile(model_path) and model_path not in done:
+            done[model_path] = None
+            try:
+                # Named by the model's content hash (from its file record, so only models that changed are read), and only read to simplify it
+                key = hashlib.sha256((hash_file_cached(model_path) + STEP_SIMPLIFY_VERSION + str(CONFIG_PCB_MODEL_CACHE_COMPRESS)).encode()).hexdigest()[:16]
+                cached = os.path.join(CONFIG_PCB_MODEL_CACHE_FOLDER, os.path.splitext(os.path.basename(model_path))[0] + "_" + key
+                                      + (".stpZ" if CONFIG_PCB_MODEL_CACHE_COMPRESS else ".step"))
+                if not os.path.exists(cached):
+                    with open(model_path, "rb") as f:
+                        data = f.read()
+                    output = step_simplify(data)
+                    if CONFIG_PCB_MODEL_CACHE_COMPRESS:
+                        output = gzip.compress(output, 6)
+                    with open(cached + ".tmp", "wb") as f:
+                        f.write(output)
+                    os.replace(cached + ".tmp", cached)
+                    simplified += 1
+                size_before += os.path.getsize(model_path)
+                size_after += os.path.getsize(cached)
+                done[model_path] = cached.replace("\\", "/")
+            except (OSError, UnicodeError, ValueError) as e:
+                print("Keeping original model " + model_path + " (" + str(e) + ")")
+
+        # The copy is in another folder, so every other model (VRML, missing, failed to simplify) gets its absolute path instead,
+        # or ${KIPRJMOD} and relative paths would resolve from the cache folder. Paths still using a variable are left for KiCAD.
+        if done.get(model_path) is not None:
+            edits.append((atom.start, atom.end, quote(done[model_path])))
+        elif "${" not in model_path:
+            edits.append((atom.start, atom.end, quote(model_path.replace("\\", "/"))))
+
+    # The project file goes alongside, so its settings (text variables etc) still apply to the copy
+    shutil.copyfile(CONFIG_KICAD_PROJECT, CONFIG_PCB_MODEL_CACHE_FOLDER + CONFIG_KICAD_NAME + ".kicad_pro")
+    with open(prepared + ".tmp", "w", encoding="utf-8", newline="") as f:
+        f.write(apply_edits(text, edits))
+    os.replace(prepared + ".tmp", prepared)
+
+    print("Result: " + str(sum(1 for cached in done.values() if cached)) + " STEP models (" + str(simplified) + " newly simplified), "
+          + ("%.1f MB -> %.1f MB" % (size_before / 1e6, size_after / 1e6)) + (" in %.1fs" % (time.perf_counter() - start)))
 
 
 
@@ -272,14 +695,11 @@ def pcb_export_step():
             '--subst-models',
             '--force',
             '--drill-origin',
-            CONFIG_KICAD_PCB]
+            pcb_model_board()]
             
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
+    process = run_cli(cmd)
     
-    print("Result: " + process.stdout)
+    print("Result: exit code " + str(process.returncode))
 
 
 
@@ -315,12 +735,9 @@ def pcb_export_pos(side):
             side,
             CONFIG_KICAD_PCB]
             
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
+    process = run_cli(cmd)
     
-    print("Result: " + process.stdout)
+    print("Result: exit code " + str(process.returncode))
 
 
 
@@ -348,12 +765,9 @@ def pcb_export_drill():
             'plot',
             CONFIG_KICAD_PCB]
             
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
+    process = run_cli(cmd)
     
-    print("Result: " + process.stdout)
+    print("Result: exit code " + str(process.returncode))
 
 
 
@@ -386,64 +800,170 @@ def pcb_export_gerbers():
             CONFIG_PCB_EXPORT_GERBERS_LAYERS_COMMON,
             CONFIG_KICAD_PCB]
             
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
+    process = run_cli(cmd)
     
-    print("Result: " + process.stdout)
+    print("Result: exit code " + str(process.returncode))
+
+
+
+###########################################
+#
+#   Export gerbers, drill and position files from ONE board load, in a pcbnew worker (see CONFIG_PCB_FAB_BACKEND)
+#   Uses: <KiCAD python> kicad_fab_worker.py JOB_JSON, falling back to the kicad-cli stage functions for any output it couldn't do
+#
+###########################################
+
+def pcb_export_fab():
+    print("\n## Exporting Layout gerbers, drill and .pos files from one pcbnew board load ...")
+
+    job = {"board": os.path.abspath(CONFIG_KICAD_PCB),
+           "drill": {"folder": CONFIG_PCB_EXPORT_DRILL_FOLDERPATH},
+           "pos": [{"side": "front", "output": CONFIG_PCB_EXPORT_POS_FILEPATH_FRONT},
+                   {"side": "back", "output": CONFIG_PCB_EXPORT_POS_FILEPATH_BACK}]}
+
+    # The worker's plot controller can't add common layers to every gerber, so with any set those are left to kicad-cli
+    cli_only = []
+    if CONFIG_PCB_EXPORT_GERBERS_LAYERS_COMMON:
+        print("Common gerber layers (" + CONFIG_PCB_EXPORT_GERBERS_LAYERS_COMMON + ") set, so the gerbers are exported with kicad-cli")
+        cli_only.append("gerbers")
+    else:
+        job["gerbers"] = {"folder": CONFIG_PCB_EXPORT_GERBERS_FOLDERPATH,
+                          "layers": [layer for layer in CONFIG_PCB_EXPORT_GERBERS_LAYERS.split(",") if layer],
+                          "precision": 6}
+
+    cmd = [CONFIG_PCB_FAB_PYTHON_PATH,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "kicad_fab_worker.py"),
+            json.dumps(job)]
+
+    # Not recorded as the stage result - anything the worker couldn't do is redone with kicad-cli below, and that decides it
+    try:
+        process = run_cli(cmd, record=False, echo=False)
+        result = json.loads(process.stdout.strip().splitlines()[-1]) if process.returncode == 0 else None
+    except (OSError, ValueError, IndexError):
+        process, result = None, None
+
+    fallbacks = {"gerbers": pcb_export_gerbers,
+                 "drill": pcb_export_drill,
+                 "pos_front": lambda: pcb_export_pos("front"),
+                 "pos_back": lambda: pcb_export_pos("back")}
+    if result is None:
+        print("pcbnew worker failed, using kicad-cli for all outputs" + (": " + process.stderr.strip() if process is not None else ""))
+        redo = list(fallbacks)
+    else:
+        print("Result (pcbnew worker);\n  " + "\n  ".join(name.ljust(12) + ("%6.1fs" % seconds) for name, seconds in result["timings"].items()))
+        for name, error in result["failed"].items():
+            print("pcbnew worker couldn't export " + name + ", using kicad-cli;\n" + error)
+        redo = cli_only + list(result["failed"])
+
+    for name in redo:
+        fallbacks[name]()
 
 
 
 ###########################################
 #
 #   Export KICAD PCB Layout Render Image
-#   Param: "top" or "bottom"
+#   Param: "top" or "bottom", and whether to render a draft (None to go by CONFIG_PCB_EXPORT_RENDER_DRAFT)
 #   Uses: kicad-cli pcb render [--help] [--output OUTPUT_FILE] [--define-var KEY=VALUE] [--width WIDTH] [--height HEIGHT] [--side SIDE] [--background BG] [--quality QUALITY] [--preset PRESET] [--floor] [--perspective] [--zoom ZOOM] [--pan VECTOR] [--pivot PIVOT] [--rotate ANGLES] [--light-top COLOR] [--light-bottom COLOR] [--light-side COLOR] [--light-camera COLOR] [--light-side-elevation ANGLE] INPUT_FILE
 #
 ###########################################
 
-def pcb_export_render(side):
-    print("\n## Exporting Layout Render image (side: " + side + ") ...")
+def pcb_export_render(side, draft=None):
+    if draft is None:
+        draft = pcb_render_draft()
+    print("\n## Exporting Layout Render image (side: " + side + ", " + ("draft" if draft else "full") + ") ...")
 
-    # set the output filename based on whether "top" or "bottom" for the 'side' argument
-    if side == "top":
-        CONFIG_PCB_EXPORT_RENDER_FILEPATH = CONFIG_PCB_EXPORT_RENDER_FILEPATH_TOP
-    if side == "bottom":
-        CONFIG_PCB_EXPORT_RENDER_FILEPATH = CONFIG_PCB_EXPORT_RENDER_FILEPATH_BOTTOM
-        
-        
-    cmd = [CONFIG_KICAD_CLI_PATH,
-            'pcb',
-            'render',
-            '--output',
-            CONFIG_PCB_EXPORT_RENDER_FILEPATH,
-            '--side',
+    CONFIG_PCB_EXPORT_RENDER_FILEPATH = pcb_render_filepath(side, draft)
+
+    # Only known now that draft is decided, for the stage trace
+    stage = getattr(_stage_context, "stage", None)
+    if stage is not None:
+        stage.outputs = [CONFIG_PCB_EXPORT_RENDER_FILEPATH]
+
+    scale = CONFIG_PCB_EXPORT_RENDER_DRAFT_SCALE if draft else 1
+    options = ['--side',
             side,
             '--quality',
-            'high',
+            CONFIG_PCB_EXPORT_RENDER_DRAFT_QUALITY if draft else CONFIG_PCB_EXPORT_RENDER_QUALITY,
             '--background',
             'transparent',
             '--preset',
             'follow_plot_settings',
             '--width',
-            CONFIG_PCB_EXPORT_RENDER_WIDTH,
+            str(int(CONFIG_PCB_EXPORT_RENDER_WIDTH) // scale),
             '--height',
-            CONFIG_PCB_EXPORT_RENDER_HEIGHT,
+            str(int(CONFIG_PCB_EXPORT_RENDER_HEIGHT) // scale),
             '--zoom',
             CONFIG_PCB_EXPORT_RENDER_ZOOM,
-            '--floor',
-            CONFIG_KICAD_PCB]
-            
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
-    
-    print("Result: " + process.stdout)
+            '--floor']
+    board = pcb_model_board()
+
+    # The model files are hashed too - the board copy from pcb_prepare_models only names the simplified ones by content hash
+    cached = None
+    if CONFIG_PCB_EXPORT_RENDER_CACHE_FOLDER:
+        models = "".join(hash_file_cached(path) for path in pcb_model_files())
+        key = hashlib.sha256((hash_file_cached(board) + hash_file_cached(CONFIG_KICAD_PROJECT) + models + kicad_cli_stamp() + ("draft" if draft else "full") + "\0".join(options)).encode()).hexdigest()
+        cached = CONFIG_PCB_EXPORT_RENDER_CACHE_FOLDER + key[:32] + CONFIG_PCB_EXPORT_RENDER_FILETYPE
+        if os.path.exists(cached):
+            shutil.copyfile(cached, CONFIG_PCB_EXPORT_RENDER_FILEPATH)
+            print("Result: reused the render of an identical board and settings")
+            return
+
+    cmd = [CONFIG_KICAD_CLI_PATH,
+            'pcb',
+            'render',
+            '--output',
+            CONFIG_PCB_EXPORT_RENDER_FILEPATH] + options + [board]
+
+    process = run_cli(cmd)
+
+    print("Result: exit code " + str(process.returncode))
+
+    if cached is not None and process.returncode == 0 and os.path.exists(CONFIG_PCB_EXPORT_RENDER_FILEPATH):
+        os.makedirs(CONFIG_PCB_EXPORT_RENDER_CACHE_FOLDER, exist_ok=True)
+        shutil.copyfile(CONFIG_PCB_EXPORT_RENDER_FILEPATH, cached + ".tmp")
+        os.replace(cached + ".tmp", cached)
+
+
+def pcb_render_filepath(side, draft):
+    # set the output filename based on whether "top" or "bottom" for the 'side' argument, drafts alongside under their own name
+    filepath = CONFIG_PCB_EXPORT_RENDER_FILEPATH_TOP if side == "top" else CONFIG_PCB_EXPORT_RENDER_FILEPATH_BOTTOM
+    if draft:
+        root, extension = os.path.splitext(filepath)
+        filepath = root + CONFIG_PCB_EXPORT_RENDER_DRAFT_SUFFIX + extension
+    return filepath
+
+
+_render_draft = {}
+_render_draft_lock = threading.Lock()
+
+def pcb_render_draft():
+    if CONFIG_PCB_EXPORT_RENDER_DRAFT != "auto":
+        return CONFIG_PCB_EXPORT_RENDER_DRAFT
+
+    # Asked by the render stages as they start rather than when the stages are set up, so the git call is only made when
+    # something is actually rendered - and only once, for both sides
+    with _render_draft_lock:
+        if "auto" not in _render_draft:
+            _render_draft["auto"] = pcb_head_untagged()
+        return _render_draft["auto"]
+
+
+def pcb_head_untagged():
+    # Only a confirmed untagged commit gives a draft - if git isn't there or it isn't a repo, render in full as before
+    try:
+        process = shared_runner(CONFIG_EXPORT_MAX_PROCESSES).run(["git", "describe", "--exact-match", "--tags", "HEAD"], timeout=60, echo=False,
+                                                                 cwd=CONFIG_KICAD_FOLDER + CONFIG_KICAD_NAME)
+    except (OSError, subprocess.SubprocessError) as e:
+        print("Couldn't run git to check for a release tag (" + str(e) + "), so rendering in full")
+        return False
+    untagged = "no tag exactly matches" in process.stderr or "No names found" in process.stderr
+    if process.returncode != 0 and not untagged:
+        print("Couldn't check for a release tag (" + process.stderr.strip() + "), so rendering in full")
+    return process.returncode != 0 and untagged
+
+
 
-    
-    
 ###########################################
 #
 #   Export KICAD PCB Layout ODB++ archive
@@ -473,11 +993,8 @@ def pcb_export_odb():
             '--precision',
             CONFIG_PCB_EXPORT_ODB_PRECISION,
             CONFIG_KICAD_PCB]
-    process = subprocess.run(args=cmd,
-                            stdout=subprocess.PIPE,
-                            shell=True,
-                            universal_newlines=True)
-    print("Result: " + process.stdout)
+    process = run_cli(cmd)
+    print("Result: exit code " + str(process.returncode))
 
 
 
@@ -514,12 +1031,9 @@ def pcb_export_ipc2581():
             CONFIG_PCB_EXPORT_IPC2581_BOM_DIST_PN,
             CONFIG_KICAD_PCB]
             
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
+    process = run_cli(cmd)
     
-    print("Result: " + process.stdout)
+    print("Result: exit code " + str(process.returncode))
 
 
 ###########################################
@@ -537,22 +1051,16 @@ def sch_erc():
             'erc',
             '--output',
             CONFIG_SCH_ERC_FILEPATH,
+            '--format',
+            'json',
             '--severity-all',
-            '--exit-code-violations',
             CONFIG_KICAD_SCH]
             
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
+    process = run_cli(cmd)
     
-    print("Result: " + process.stdout)
-    if process.returncode != 0:
-        print("KiCad reported violations.")
-        print("Error: " + process.stderr)
-    else:
-        print("KiCad reported No violations.")
+    print("Result: exit code " + str(process.returncode))
+    if process.returncode == 0:
+        check_report("ERC", CONFIG_SCH_ERC_FILEPATH, CONFIG_SCH_ERC_BASELINE_FILEPATH)
 
 
 ###########################################
@@ -570,54 +1078,882 @@ def pcb_drc():
             'drc',
             '--output',
             CONFIG_PCB_DRC_FILEPATH,
+            '--format',
+            'json',
             '--severity-all',
-            '--exit-code-violations',
             CONFIG_KICAD_PCB]
             
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
+    process = run_cli(cmd)
     
-    print("Result: " + process.stdout)
+    print("Result: exit code " + str(process.returncode))
+
+    if process.returncode == 0:
+        check_report("DRC", CONFIG_PCB_DRC_FILEPATH, CONFIG_PCB_DRC_BASELINE_FILEPATH)
+
+
+
+###########################################
+#
+#   ERC/DRC JSON reports - counts by severity and rule, and new violations compared to a baseline
+#   A check stage "fails" (exit 1, which stops the export with CONFIG_CHECKS_FAIL_FAST) only if it has errors not in its baseline.
+#
+###########################################
+
+def check_baseline_inputs(baseline_path):
+    # For the stage cache key, so a new or changed baseline re-runs the check
+    return [baseline_path] if os.path.exists(baseline_path) else []
+
+
+def check_violations(report):
+    # ERC lists violations per sheet, DRC has violations, unconnected items and schematic parity at the top level
+    violations = []
+    for section in ("violations", "unconnected_items", "schematic_parity"):
+        violations += report.get(section, [])
+    for sheet in report.get("sheets", []):
+        violations += check_violations(sheet)
+    return violations
+
 
+def violation_key(violation):
+    # Same rule on the same items - by uuid, so moving things around doesn't make a violation 'new'
+    items = sorted(item.get("uuid") or item.get("description", "") for item in violation.get("items", []))
+    return "|".join([violation.get("type", ""), violation.get("severity", "")] + items)
+
+
+def check_report(name, report_path, baseline_path):
+    with open(report_path, "r", encoding="utf-8") as f:
+        violations = check_violations(json.load(f))
+
+    by_severity = {}
+    by_rule = {}
+    for violation in violations:
+        severity = violation.get("severity", "")
+        by_severity[severity] = by_severity.get(severity, 0) + 1
+        rule = (severity, violation.get("type", ""))
+        by_rule[rule] = by_rule.get(rule, 0) + 1
+
+    keys = [violation_key(violation) for violation in violations]
+    if CONFIG_CHECKS_BASELINE_UPDATE:
+        with open(baseline_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(sorted(keys), f, indent=1)
+        os.replace(baseline_path + ".tmp", baseline_path)
+        print(name + " baseline updated with " + str(len(keys)) + " violations")
+
+    try:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = []
+        print("No " + name + " baseline yet, so every violation counts as new")
+
+    # Compare as multisets, so a second copy of a baselined violation is still new
+    remaining = {}
+    for key in baseline:
+        remaining[key] = remaining.get(key, 0) + 1
+    new = []
+    for key, violation in zip(keys, violations):
+        if remaining.get(key, 0) > 0:
+            remaining[key] -= 1
+        else:
+            new.append(violation)
+    fixed = sum(remaining.values())
+
+    print(name + ": " + str(len(violations)) + " violations (" + ", ".join(severity + " " + str(count) for severity, count in sorted(by_severity.items())) + ")"
+          + ", " + str(len(new)) + " new, " + str(fixed) + " fixed since the baseline")
+    for (severity, rule), count in sorted(by_rule.items()):
+        print("  " + severity.ljust(10) + rule.ljust(36) + str(count).rjust(5))
+    new_errors = [violation for violation in new if violation.get("severity") == "error"]
+    for violation in new_errors:
+        print("  NEW ERROR: " + violation.get("type", "") + " - " + violation.get("description", "") + "; "
+              + ", ".join(item.get("description", "") for item in violation.get("items", [])))
+
+    if new_errors:
+        print("KiCad reported " + str(len(new_errors)) + " new " + name + " errors.")
+        stage_returncode(1)
+    else:
+        print("KiCad reported no new " + name + " errors.")
+
+
+
+###########################################
+#
+#   Check the library for broken footprint, 3D model and datasheet links
+#   Uses: kicad_library_check.py [library folder] [index file], which exits non-zero if any link is broken
+#
+###########################################
+
+def library_check():
+    print("\n## Library link check ...")
+
+    cmd = [sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "kicad_library_check.py"),
+            CONFIG_KICAD_LIBRARY_FOLDER,
+            CONFIG_KICAD_LIBRARY_INDEX_FILEPATH]
+
+    process = run_cli(cmd)
+
+    print("Result: exit code " + str(process.returncode))
     if process.returncode != 0:
-        print("KiCad reported violations.")
-        print("Error: " + process.stderr)
+        print("Library has broken links.")
+
+
+
+###########################################
+#
+#   Export stage cache
+#   Each stage gets a key from the hashes of the KiCAD files it reads, plus the code and CONFIG values its function uses (i.e. its CLI arguments).
+#   If the key matches the last export and the outputs recorded then are still in place and untouched, the stage is skipped.
+#   Only stages which finish "ok" are recorded, so failures and reported violations always run again.
+#
+###########################################
+
+def kicad_cli_stamp():
+    try:
+        return str(os.stat(CONFIG_KICAD_CLI_PATH + (".exe" if os.name == "nt" else "")).st_mtime_ns)
+    except OSError:
+        return ""
+
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# What is known about each input file (its hash, the board's model paths), as {path: {"size", "mtime_ns", ...}}. Kept in the cache file
+# with CONFIG_EXPORT_CACHE, and only worked out again for a file whose size or mtime has changed, as in kicad_library_index.py -
+# so an export with nothing changed doesn't re-read the (often multi-MB) STEP models
+_file_records = {}
+
+def file_record(path):
+    st = os.stat(path)
+    record = _file_records.get(path)
+    if record is None or record["size"] != st.st_size or record["mtime_ns"] != st.st_mtime_ns:
+        record = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        _file_records[path] = record
+    return record
+
+
+def hash_file_cached(path):
+    record = file_record(path)
+    if "sha256" not in record:
+        record["sha256"] = hash_file(path)
+    return record["sha256"]
+
+
+def hash_code(code, sha, seen):
+    sha.update(code.co_code)
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            hash_code(const, sha, seen)
+        else:
+            sha.update(repr(const).encode())
+
+    for name in code.co_names:
+        value = globals().get(name)
+        if name.startswith("CONFIG_"):
+            sha.update((name + "=" + repr(value)).encode())
+        elif callable(value) and getattr(value, "__module__", None) == __name__ and hasattr(value, "__code__") and value not in seen:
+            # Follow calls into our own helper functions (e.g. pcb_export_pdf -> pcb_export_pdf_single)
+            seen.add(value)
+            hash_code(value.__code__, sha, seen)
+
+
+def stage_cache_key(stage, input_hashes):
+    sha = hashlib.sha256()
+    sha.update(stage.name.encode())
+    sha.update(repr(stage.args).encode())
+    for path in stage.inputs:
+        sha.update((path + "=" + input_hashes[path]).encode())
+    hash_code(stage.func.__code__, sha, {stage.func})
+    return sha.hexdigest()
+
+
+def output_snapshot(patterns):
+    snapshot = {}
+    for pattern in patterns:
+        paths = glob.glob(pattern)
+        if not paths:
+            return None
+        for path in paths:
+            st = os.stat(path)
+            snapshot[path] = [st.st_size, st.st_mtime_ns]
+    return snapshot
+
+
+def cache_is_fresh(cache, stage):
+    entry = cache.get(stage.name)
+    if entry is None or entry["key"] != stage.cache_key:
+        return False
+    return output_snapshot(entry["outputs"].keys()) == entry["outputs"] and output_snapshot(stage.outputs) is not None
+
+
+def cache_record(cache, stage):
+    snapshot = output_snapshot(stage.outputs) if stage.status == "ok" else None
+    if snapshot is None:
+        cache.pop(stage.name, None)
     else:
-        print("KiCad reported No violations.")
+        cache[stage.name] = {"key": stage.cache_key, "outputs": snapshot}
+
+
+FILE_RECORDS_KEY = "_files"   # Not a stage name, see file_record
+
+def load_cache(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_cache(path, cache):
+    with open(path + ".tmp", "w") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def load_file_records(cache):
+    # The file records are kept in the cache under their own key, and this module's records become that same dict, so saving the cache saves them.
+    # Records of files that are gone are dropped, so a board's old models don't build up.
+    global _file_records
+    records = cache.setdefault(FILE_RECORDS_KEY, {})
+    for path in [path for path in records if not os.path.exists(path)]:
+        del records[path]
+    records.update(_file_records)
+    _file_records = records
+
+
+def prepare_cache(stages):
+    # Hash each input file once, however many stages read it
+    input_hashes = {}
+    for stage in stages:
+        for path in stage.inputs:
+            if path not in input_hashes:
+                input_hashes[path] = hash_file_cached(path)
+
+    # Include the kicad-cli install, so upgrading KiCAD re-exports everything
+    cli_stamp = kicad_cli_stamp()
+
+    for stage in stages:
+        stage.cache_key = hashlib.sha256((stage_cache_key(stage, input_hashes) + cli_stamp).encode()).hexdigest()
+
+
+
+###########################################
+#
+#   Export stage scheduler
+#   Runs each stage (one of the functions above) on a bounded worker pool as soon as all the stages it depends on have finished.
+#   Every stage is a separate kicad-cli process, so the pool threads just wait on those and the stages run in parallel.
+#   A stage is skipped if a stage it depends on timed out, raised an error or was itself skipped (or cancelled).
+#   With CONFIG_EXPORT_CANCEL_ON_FAILURE, a stage timing out or raising an error (or a gate stage failing) cancels the rest of its project,
+#   and Ctrl+C cancels every project - either way their kicad-cli processes are killed rather than left running.
+#
+###########################################
+
+STAGE_FAILED_STATES = ("timeout", "error", "skipped", "cancelled")
+
+class ExportStage:
+    def __init__(self, name, func, args=(), deps=(), inputs=(), outputs=(), gate=False, cacheable=True):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.deps = list(deps)
+        self.inputs = list(inputs)      # KiCAD files the stage reads, for the cache key
+        self.outputs = list(outputs)    # Files (or glob patterns) the stage writes, checked before reusing a cached result
+        self.gate = gate                # If True, a non-zero exit also stops the stages that depend on this one
+        self.cacheable = cacheable
+        self.timeout = CONFIG_EXPORT_STAGE_TIMEOUTS.get(name, CONFIG_EXPORT_STAGE_TIMEOUT)
+        self.deadline = None
+        self.cache_key = None
+        self.returncodes = []
+        self.status = None      # None until finished, then "ok", "cached", "exit N", "timeout", "error", "skipped" or "cancelled"
+        self.jobs = None        # The project's JobGroup, set by ProjectExport
+        self.wall_time = 0.0
+        self.start = None       # For the stage trace (see STAGE TRACE)
+        self.worker = None
+        self.cpu_time = 0.0     # Of the stage's own (Python) thread
+        self.children = []      # (CPU seconds, peak memory bytes) of each kicad-cli process, with psutil
+        self.output_bytes = 0
+
+
+def run_stage(stage, cache=None):
+    _stage_context.stage = stage
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    stage.start = start
+    stage.worker = threading.current_thread().name
+    if stage.timeout is not None:
+        stage.deadline = start + stage.timeout
+
+    try:
+        if cache is not None and stage.cacheable and cache_is_fresh(cache, stage):
+            print("\n## Skipping '" + stage.name + "', unchanged since the last export")
+            stage.status = "cached"
+            return stage
+
+        stage.func(*stage.args)
+        failed_codes = [code for code in stage.returncodes if code != 0]
+        stage.status = "exit " + str(failed_codes[0]) if failed_codes else "ok"
+
+        if cache is not None and stage.cacheable:
+            cache_record(cache, stage)
+    except subprocess.TimeoutExpired:
+        print("\n!! Stage '" + stage.name + "' timed out after " + str(stage.timeout) + "s")
+        stage.status = "timeout"
+    except JobCancelled as e:
+        print("\n!! Stage '" + stage.name + "' cancelled, as " + e.reason)
+        stage.status = "cancelled"
+    except Exception:
+        print("\n!! Stage '" + stage.name + "' failed;\n" + traceback.format_exc())
+        stage.status = "error"
+    finally:
+        stage.wall_time = time.perf_counter() - start
+        stage.cpu_time = time.thread_time() - cpu_start
+        stage.output_bytes = stage_output_bytes(stage)
+        _stage_context.stage = None
+
+    return stage
+
+
+class ProjectExport:
+    # One project's stages for the scheduler, with the run_stage and cache of the module instance they come from (see BATCH EXPORT)
+    def __init__(self, name, stages, cache=None, runner=run_stage):
+        self.name = name
+        self.stages = stages
+        self.cache = cache
+        self.runner = runner
+        self.by_name = {stage.name: stage for stage in stages}
+        self.pending = list(stages)
+        self.start = None
+        self.end = None
+        self.jobs = JobGroup()
+
+        for stage in stages:
+            stage.jobs = self.jobs
+
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.by_name:
+                    raise ValueError("Stage '" + stage.name + "' depends on unknown stage '" + dep + "'")
+
+    def skip_blocked(self):
+        # Skips (and returns) the pending stages which a stage they depend on has stopped
+        skipped = []
+        for stage in list(self.pending):
+            deps = [self.by_name[dep] for dep in stage.deps]
+            if any(dep.status in STAGE_FAILED_STATES or (dep.gate and dep.status is not None and dep.status.startswith("exit")) for dep in deps):
+                print("\n!! Skipping stage '" + stage.name + "', as a stage it depends on did not complete")
+                stage.status = "skipped"
+                self.pending.remove(stage)
+                skipped.append(stage)
+        return skipped
+
+    def cancel(self, reason):
+        # Kills the processes of the running stages (which then finish as "cancelled") and skips the stages not started yet
+        if self.jobs.cancelled:
+            return []
+        print("\n!! Cancelling the export of " + self.name + ", as " + reason)
+        self.jobs.cancel(reason)
+        skipped = self.pending
+        for stage in skipped:
+            stage.status = "skipped"
+        self.pending = []
+        return skipped
+
+    def next_ready(self):
+        # The first pending stage whose dependencies have all finished, taken off the pending list
+        for stage in self.pending:
+            if all(self.by_name[dep].status is not None for dep in stage.deps):
+                self.pending.remove(stage)
+                return stage
+        return None
+
+
+def stage_failed(stage):
+    # Timed out or raised an error, or a gate stage that exited non-zero - what stops the stages that depend on it
+    return stage.status in ("timeout", "error") or (stage.gate and stage.status.startswith("exit"))
+
+
+def run_projects(projects, max_workers=CONFIG_EXPORT_MAX_WORKERS, progress=False):
+    # Only as many stages are handed to the pool as it has workers, taking the next ready stage from each project in turn,
+    # so with several projects they all make progress rather than the first one's stages filling the queue
+    running = {}
+    turn = 0
+    total = sum(len(project.stages) for project in projects)
+    finished = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            for project in projects:
+                finished += len(project.skip_blocked())
+
+            while len(running) < max_workers:
+                ready = None
+                for offset in range(len(projects)):
+                    project = projects[(turn + offset) % len(projects)]
+                    stage = project.next_ready()
+                    if stage is not None:
+                        ready = (project, stage)
+                        turn = (turn + offset + 1) % len(projects)
+                        break
+                if ready is None:
+                    break
+                project, stage = ready
+                if project.start is None:
+                    project.start = time.perf_counter()
+                running[pool.submit(project.runner, stage, project.cache)] = ready
+
+            if not running:
+                # Nothing can start and nothing is left to finish, so the remaining stages depend on each other
+                for project in projects:
+                    for stage in project.pending:
+                        print("\n!! Skipping stage '" + stage.name + "', as its dependencies form a cycle")
+                        stage.status = "skipped"
+                    project.pending = []
+                break
+
+            try:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                for project in projects:
+                    project.cancel("the export was interrupted")
+                raise
+            for future in done:
+                future.result()
+                project, stage = running.pop(future)
+                project.end = time.perf_counter()
+                finished += 1
+                if CONFIG_EXPORT_CANCEL_ON_FAILURE and stage_failed(stage):
+                    finished += len(project.cancel("stage '" + stage.name + "' " + stage.status))
+                if progress:
+                    print("\n## [" + str(finished) + "/" + str(total) + "] " + project.name + ": " + stage.name + " " + stage.status + (" (%.1fs)" % stage.wall_time))
+
+    return projects
+
+
+def print_stage_summary(stages, total_time):
+    print("\n####################################################################")
+    print("Stage summary (" + str(CONFIG_EXPORT_MAX_WORKERS) + " workers);\n")
+    print("  " + "".ljust(28) + "Wall".rjust(9) + "CPU".rjust(9) + "Peak MB".rjust(9) + "Out MB".rjust(9) + "   Status")
+    for stage in stages:
+        cpu_time, peak_rss = stage_resources(stage)
+        print("  " + stage.name.ljust(28) + ("%8.1fs" % stage.wall_time) + (("%8.1fs" % cpu_time) if cpu_time is not None else "-".rjust(9))
+              + (("%9.0f" % (peak_rss / 1e6)) if peak_rss is not None else "-".rjust(9)) + ("%9.1f" % (stage.output_bytes / 1e6)) + "   " + stage.status)
+    print("\n  " + "Total stage time".ljust(28) + ("%8.1fs" % sum(stage.wall_time for stage in stages)))
+    print("  " + "Total wall time".ljust(28) + ("%8.1fs" % total_time))
+
+
+
+###########################################
+#
+#   STAGE TRACE
+#   Wall time, CPU time (the stage's own thread plus its kicad-cli processes), peak memory of its largest kicad-cli process
+#   and total output size of every stage, written after each export to CONFIG_EXPORT_TRACE_FILEPATH as;
+#       .json           everything, plus the KiCAD version, to compare runs
+#       .csv            one row per stage, for a spreadsheet
+#       .chrome.json    Chrome trace format, one row per worker - open in chrome://tracing or ui.perfetto.dev to see the overlap
+#   CPU time and memory of the kicad-cli processes need 'psutil', without it they are left out (shown as '-').
+#
+###########################################
+
+TRACE_FIELDS = ["stage", "status", "start", "wall_time", "cpu_time", "peak_rss_bytes", "output_bytes"]
+
+def stage_output_bytes(stage):
+    total = 0
+    for pattern in stage.outputs:
+        for path in glob.glob(pattern):
+            if os.path.isfile(path):
+                total += os.path.getsize(path)
+            else:
+                for folder, _, files in os.walk(path):
+                    total += sum(os.path.getsize(os.path.join(folder, name)) for name in files)
+    return total
+
+
+def stage_resources(stage):
+    # (CPU seconds, peak memory bytes), either None if they couldn't be measured
+    if psutil is None:
+        return None, None
+    cpu_time = stage.cpu_time + sum(cpu for cpu, _ in stage.children)
+    peak_rss = max([rss for _, rss in stage.children], default=0)
+    return cpu_time, peak_rss
+
+
+def kicad_cli_version():
+    try:
+        return shared_runner(CONFIG_EXPORT_MAX_PROCESSES).run([CONFIG_KICAD_CLI_PATH, "version"], timeout=60, echo=False).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def stage_record(stage, origin):
+    cpu_time, peak_rss = stage_resources(stage)
+    values = [stage.name,
+              stage.status,
+              round(stage.start - origin, 3) if stage.start is not None else None,
+              round(stage.wall_time, 3),
+              round(cpu_time, 3) if cpu_time is not None else None,
+              peak_rss,
+              stage.output_bytes]
+    return dict(zip(TRACE_FIELDS, values))
+
+
+def save_trace(path, projects, origin, total_time):
+    trace = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+             "kicad_cli": kicad_cli_version(),
+             "workers": CONFIG_BATCH_MAX_WORKERS if len(projects) > 1 else CONFIG_EXPORT_MAX_WORKERS,
+             "wall_time": round(total_time, 3),
+             "projects": {project.name: [stage_record(stage, origin) for stage in project.stages] for project in projects}}
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump(trace, f, indent=1)
+
+    with open(path + ".csv", "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["project"] + TRACE_FIELDS)
+        for name, records in trace["projects"].items():
+            for record in records:
+                writer.writerow([name] + ["" if record[field] is None else record[field] for field in TRACE_FIELDS])
+
+    # Chrome trace - a 'process' per project, a 'thread' per pool worker, times in microseconds
+    events = []
+    workers = {}
+    for pid, project in enumerate(projects, 1):
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": project.name}})
+        for stage in project.stages:
+            if stage.start is None:
+                continue
+            tid = workers.setdefault(stage.worker, len(workers) + 1)
+            events.append({"name": stage.name, "cat": "stage", "ph": "X", "pid": pid, "tid": tid,
+                           "ts": round((stage.start - origin) * 1e6), "dur": round(stage.wall_time * 1e6),
+                           "args": stage_record(stage, origin)})
+    with open(path + ".chrome.json", "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+
+###########################################
+#
+#   Export stages for the project set in CONFIG (CONFIG_KICAD_NAME)
+#
+###########################################
+
+# Design checks, which the export stages can optionally wait for (see CONFIG_EXPORT_AFTER_CHECKS)
+CHECK_STAGES = ["sch_erc", "pcb_drc"]
+
+# Stages which load the 3D models, from the board copy of pcb_prepare_models with CONFIG_PCB_MODEL_CACHE
+MODEL_STAGES = ["pcb_export_step", "pcb_export_render_top", "pcb_export_render_bottom"]
+
+def project_stages():
+    export_deps = CHECK_STAGES if CONFIG_EXPORT_AFTER_CHECKS or CONFIG_CHECKS_FAIL_FAST else []
+    run_library_check = CONFIG_EXPORT_LIBRARY_CHECK and CONFIG_KICAD_LIBRARY_FOLDER
+    if run_library_check and (CONFIG_EXPORT_LIBRARY_CHECK_GATE or CONFIG_EXPORT_AFTER_CHECKS):
+        export_deps = export_deps + ["library_check"]
+
+    # Input files for the cache key - the project file, plus the board or all the schematic sheets
+    sch_inputs = sorted(glob.glob(os.path.join(os.path.dirname(CONFIG_KICAD_SCH), "*.kicad_sch"))) + [CONFIG_KICAD_PROJECT]
+    pcb_inputs = [CONFIG_KICAD_PCB, CONFIG_KICAD_PROJECT]
+    bom_inputs = sch_inputs + [os.path.join(os.path.dirname(os.path.abspath(__file__)), "kicad_bom.py")] + (sorted(glob.glob(os.path.join(CONFIG_KICAD_LIBRARY_FOLDER, "symbols", "*.kicad_sym"))) if CONFIG_KICAD_LIBRARY_FOLDER and os.path.isdir(CONFIG_KICAD_LIBRARY_FOLDER) else [])
+
+    # Gerbers, drill and pos files - one stage for the pcbnew backend, otherwise one per kicad-cli run
+    drill_outputs = [CONFIG_PCB_EXPORT_DRILL_FOLDERPATH + CONFIG_KICAD_NAME + "*.drl"]
+    gerber_outputs = [CONFIG_PCB_EXPORT_GERBERS_FOLDERPATH + CONFIG_KICAD_NAME + "*.gbr"]
+    if CONFIG_PCB_FAB_BACKEND == "pcbnew":
+        fab_stages = [
+            ExportStage("pcb_export_fab", pcb_export_fab, deps=export_deps, inputs=pcb_inputs,
+                        outputs=[CONFIG_PCB_EXPORT_POS_FILEPATH_FRONT, CONFIG_PCB_EXPORT_POS_FILEPATH_BACK] + drill_outputs + gerber_outputs),
+        ]
+    else:
+        fab_stages = [
+            ExportStage("pcb_export_pos_front", pcb_export_pos, ("front",), deps=export_deps, inputs=pcb_inputs, outputs=[CONFIG_PCB_EXPORT_POS_FILEPATH_FRONT]),
+            ExportStage("pcb_export_pos_back", pcb_export_pos, ("back",), deps=export_deps, inputs=pcb_inputs, outputs=[CONFIG_PCB_EXPORT_POS_FILEPATH_BACK]),
+            ExportStage("pcb_export_drill", pcb_export_drill, deps=export_deps, inputs=pcb_inputs, outputs=drill_outputs),
+            ExportStage("pcb_export_gerbers", pcb_export_gerbers, deps=export_deps, inputs=pcb_inputs, outputs=gerber_outputs),
+        ]
+
+    # The STEP export and renders load the models, so wait for them to be prepared, and the STEP export is redone when a model file changes.
+    # The renders have their own cache (see pcb_export_render), which also covers the draft/full choice and the models, so aren't cached as stages
+    model_deps = export_deps + (["pcb_prepare_models"] if CONFIG_PCB_MODEL_CACHE else [])
+    model_inputs = pcb_inputs + pcb_model_files()
+
+    # The BoM check and the library check both bring the library index up to date, so they take turns rather than both writing it at once
+    bom_deps = export_deps + (["library_check"] if run_library_check and "library_check" not in export_deps else [])
+
+    # The longest stages (STEP and renders) are listed first, so they start straight away rather than queueing behind the quick ones
+    stages = [
+        ExportStage("sch_erc", sch_erc, inputs=sch_inputs + check_baseline_inputs(CONFIG_SCH_ERC_BASELINE_FILEPATH), outputs=[CONFIG_SCH_ERC_FILEPATH], gate=CONFIG_CHECKS_FAIL_FAST,
+                    cacheable=not CONFIG_CHECKS_BASELINE_UPDATE),
+        ExportStage("pcb_drc", pcb_drc, inputs=pcb_inputs + check_baseline_inputs(CONFIG_PCB_DRC_BASELINE_FILEPATH), outputs=[CONFIG_PCB_DRC_FILEPATH], gate=CONFIG_CHECKS_FAIL_FAST,
+                    cacheable=not CONFIG_CHECKS_BASELINE_UPDATE),
+        ExportStage("pcb_export_step", pcb_export_step, deps=model_deps, inputs=model_inputs, outputs=[CONFIG_PCB_EXPORT_STEP_FILEPATH]),
+        ExportStage("pcb_export_render_top", pcb_export_render, ("top",), deps=model_deps, cacheable=False),
+        ExportStage("pcb_export_render_bottom", pcb_export_render, ("bottom",), deps=model_deps, cacheable=False),
+        ExportStage("pcb_export_pdf", pcb_export_pdf, deps=export_deps, inputs=pcb_inputs, outputs=[CONFIG_PCB_EXPORT_PDF_FILEPATH]),
+        ExportStage("sch_export_pdf", sch_export_pdf, deps=export_deps, inputs=sch_inputs, outputs=[CONFIG_SCH_EXPORT_PDF_FILEPATH]),
+        ExportStage("sch_export_bom", sch_export_bom, deps=bom_deps, inputs=bom_inputs, outputs=[CONFIG_PCB_EXPORT_BOM_FILEPATH] + ([CONFIG_PCB_EXPORT_BOM_BUILD_FILEPATH] if CONFIG_PCB_EXPORT_BOM_BUILD_FILEPATH else [])),
+        *fab_stages,
+        ExportStage("pcb_export_odb", pcb_export_odb, deps=export_deps, inputs=pcb_inputs, outputs=[CONFIG_PCB_EXPORT_ODB_FILEPATH]),
+        #ExportStage("pcb_export_ipc2581", pcb_export_ipc2581, deps=export_deps, inputs=pcb_inputs, outputs=[CONFIG_PCB_EXPORT_IPC2581_FILEPATH]), - DRAFT for future addition once issues are resolved (see top)
+    ]
+    if CONFIG_PCB_MODEL_CACHE:
+        # Keyed on the model files too, as the library models can change without the board changing
+        stages.insert(0, ExportStage("pcb_prepare_models", pcb_prepare_models, deps=export_deps, inputs=model_inputs,
+                                     outputs=[CONFIG_PCB_MODEL_CACHE_FOLDER + "*"]))
+    if run_library_check:
+        # Not cached - it is quick, and links can break through files it doesn't parse (models, datasheets) being moved or deleted
+        stages.insert(0, ExportStage("library_check", library_check, gate=CONFIG_EXPORT_LIBRARY_CHECK_GATE, cacheable=False))
+    return stages
+
+
+def project_export():
+    print("\n####################################################################")
+    print("Exporting design pack from;\n" + CONFIG_KICAD_PROJECT)
+    print("####################################################################\n")
+
+    # The cache is loaded first, so setting up the stages can already use its file records
+    cache = None
+    if CONFIG_EXPORT_CACHE:
+        cache = load_cache(CONFIG_EXPORT_CACHE_FILEPATH)
+        load_file_records(cache)
+
+    stages = project_stages()
+    if cache is not None:
+        prepare_cache(stages)
+    return ProjectExport(CONFIG_KICAD_NAME, stages, cache)
+
+
+
+###########################################
+#
+#   BATCH EXPORT
+#   Exports every project under CONFIG_KICAD_FOLDER which follows the Optimised layout (or just those named), with all their
+#   stages on one pool of CONFIG_BATCH_MAX_WORKERS workers, so the number of kicad-cli processes at once stays bounded.
+#   Each project gets its own copy of this script's globals, loaded as a separate module instance, and then its own
+#   CONFIG paths from set_project().
+#   Uses: python kicad_designpack_export.py --batch [PROJECT_NAME ...]
+#
+###########################################
+
+def batch_find_projects():
+    projects = []
+    for name in sorted(os.listdir(CONFIG_KICAD_FOLDER)):
+        folder = os.path.join(CONFIG_KICAD_FOLDER, name)
+        if all(os.path.isdir(os.path.join(folder, sub)) for sub in CONFIG_BATCH_LAYOUT_FOLDERS.split(",")) \
+                and os.path.isfile(os.path.join(folder, "design", name + ".kicad_pro")):
+            projects.append(name)
+    return projects
+
+
+def batch_load_project(name):
+    spec = importlib.util.spec_from_file_location("designpack_" + re.sub(r'\W', '_', name), os.path.abspath(__file__))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.set_project(name)
+    return module
+
+
+def batch_export(names):
+    names = names or batch_find_projects()
+    print("\n####################################################################")
+    print("Batch exporting " + str(len(names)) + " design packs from;\n" + CONFIG_KICAD_FOLDER)
+    print("####################################################################\n")
+
+    projects = []
+    caches = {}
+    for name in names:
+        try:
+            module = batch_load_project(name)
+            project = module.project_export()
+        except Exception:
+            print("\n!! Project '" + name + "' could not be set up;\n" + traceback.format_exc())
+            continue
+        project.runner = module.run_stage
+        projects.append(project)
+        if project.cache is not None:
+            caches[name] = (module.CONFIG_EXPORT_CACHE_FILEPATH, project.cache)
+
+    export_start = time.perf_counter()
+    run_projects(projects, CONFIG_BATCH_MAX_WORKERS, progress=True)
+    total_time = time.perf_counter() - export_start
+
+    for path, cache in caches.values():
+        save_cache(path, cache)
+    if CONFIG_BATCH_TRACE_FILEPATH and projects:
+        save_trace(CONFIG_BATCH_TRACE_FILEPATH, projects, export_start, total_time)
+
+    print("\n####################################################################")
+    print("Batch summary (" + str(CONFIG_BATCH_MAX_WORKERS) + " workers);\n")
+    print("  " + "Project".ljust(40) + "Stages".rjust(8) + "Cached".rjust(8) + "Failed".rjust(8) + "Wall".rjust(10) + "   Status")
+    by_name = {project.name: project for project in projects}
+    succeeded = 0
+    for name in names:
+        project = by_name.get(name)
+        if project is None:
+            print("  " + name.ljust(40) + "-".rjust(8) + "-".rjust(8) + "-".rjust(8) + "-".rjust(10) + "   not set up")
+            continue
+        failed = [stage for stage in project.stages if stage.status not in ("ok", "cached")]
+        cached = sum(1 for stage in project.stages if stage.status == "cached")
+        wall = (project.end - project.start) if project.start is not None else 0.0
+        status = "ok" if not failed else ", ".join(stage.name + " " + stage.status for stage in failed)
+        print("  " + name.ljust(40) + str(len(project.stages)).rjust(8) + str(cached).rjust(8) + str(len(failed)).rjust(8) + ("%9.1fs" % wall) + "   " + status)
+        succeeded += not failed
+    print("\n  " + "Total stage time".ljust(40) + ("%8.1fs" % sum(stage.wall_time for project in projects for stage in project.stages)))
+    print("  " + "Total wall time".ljust(40) + ("%8.1fs" % total_time))
+    print("\n" + str(succeeded) + " of " + str(len(names)) + " design packs exported without failures")
+
+
+
+###########################################
+#
+#   BENCHMARK
+#   Exports one reference project (CONFIG_KICAD_NAME, or the one named) RUNS times, with the stage and render caches off,
+#   and reports the median and 95th percentile wall time of each stage. The results are added to CONFIG_BENCHMARK_FILEPATH
+#   along with the KiCAD version, and compared with the last benchmark of the same project - e.g. to see what a KiCAD upgrade changed.
+#   With CONFIG_PCB_MODEL_CACHE, the STEP export and renders are also run RUNS times on the original models, to compare with the prepared ones.
+#   Uses: python kicad_designpack_export.py --benchmark RUNS [PROJECT_NAME]
+#
+###########################################
+
+def percentile(values, fraction):
+    # Nearest rank, so with only a few runs it is one of the actual times
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def benchmark_original_models(module, runs):
+    # Wall times of the stages that load the 3D models, with CONFIG_PCB_MODEL_CACHE off so they read the board's own models
+    module.CONFIG_PCB_MODEL_CACHE = False
+    wall_times = {}
+    try:
+        for run in range(runs):
+            print("\n## Benchmark run " + str(run + 1) + " of " + str(runs) + " with the original 3D models")
+            stages = [stage for stage in module.project_export().stages if stage.name in MODEL_STAGES]
+            for stage in stages:
+                stage.deps = []
+            project = module.ProjectExport(module.CONFIG_KICAD_NAME, stages, runner=module.run_stage)
+            run_projects([project], module.CONFIG_EXPORT_MAX_WORKERS)
+            for stage in stages:
+                wall_times.setdefault(stage.name, []).append(stage.wall_time)
+    finally:
+        module.CONFIG_PCB_MODEL_CACHE = True
+    return wall_times
+
+
+def benchmark(runs, name=None):
+    name = name or CONFIG_KICAD_NAME
+    module = batch_load_project(name)
+    module.CONFIG_EXPORT_CACHE = False
+    module.CONFIG_PCB_EXPORT_RENDER_CACHE_FOLDER = None
+
+    wall_times = {}
+    cpu_times = {}
+    failures = {}
+    totals = []
+    for run in range(runs):
+        print("\n## Benchmark run " + str(run + 1) + " of " + str(runs))
+        project = module.project_export()
+        project.runner = module.run_stage
+        start = time.perf_counter()
+        run_projects([project], module.CONFIG_EXPORT_MAX_WORKERS)
+        totals.append(time.perf_counter() - start)
+        for stage in project.stages:
+            wall_times.setdefault(stage.name, []).append(stage.wall_time)
+            cpu_time, _ = stage_resources(stage)
+            if cpu_time is not None:
+                cpu_times.setdefault(stage.name, []).append(cpu_time)
+            failures[stage.name] = failures.get(stage.name, 0) + (stage.status != "ok")
+
+    # The STEP export and renders again, loading the original models, to show what preparing them saves
+    original_times = benchmark_original_models(module, runs) if module.CONFIG_PCB_MODEL_CACHE else {}
+
+    def stats(values):
+        return {"median": round(statistics.median(values), 3), "p95": round(percentile(values, 0.95), 3)}
+
+    result = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "project": name,
+              "kicad_cli": kicad_cli_version(),
+              "runs": runs,
+              "workers": module.CONFIG_EXPORT_MAX_WORKERS,
+              "total": stats(totals),
+              "stages": {stage: dict(stats(times), cpu_median=round(statistics.median(cpu_times[stage]), 3) if stage in cpu_times else None,
+                                     failed=failures[stage]) for stage, times in wall_times.items()},
+              "original_models": {stage: stats(times) for stage, times in original_times.items()}}
+
+    try:
+        with open(CONFIG_BENCHMARK_FILEPATH, "r", encoding="utf-8") as f:
+            history = json.load(f)
+    except (FileNotFoundError, ValueError):
+        history = []
+    previous = next((entry for entry in reversed(history) if entry["project"] == name), None)
+
+    def change(current, before):
+        if before is None or not before.get("median"):
+            return ""
+        return ("%+7.0f%%" % ((current["median"] / before["median"] - 1) * 100)) + "  (was %.1fs)" % before["median"]
+
+    print("\n####################################################################")
+    print("Benchmark of " + name + ", " + str(runs) + " runs, " + (result["kicad_cli"] or "unknown KiCAD version"))
+    if previous is not None:
+        print("Compared with " + previous["date"] + ", " + (previous["kicad_cli"] or "unknown KiCAD version"))
+    print("\n  " + "".ljust(28) + "Median".rjust(9) + "p95".rjust(9) + "CPU".rjust(9) + "Failed".rjust(8) + "   Change")
+    for stage, values in result["stages"].items():
+        before = previous["stages"].get(stage) if previous is not None else None
+        print("  " + stage.ljust(28) + ("%8.1fs" % values["median"]) + ("%8.1fs" % values["p95"])
+              + (("%8.1fs" % values["cpu_median"]) if values["cpu_median"] is not None else "-".rjust(9)) + str(values["failed"]).rjust(8)
+              + "   " + change(values, before))
+    print("\n  " + "Total wall time".ljust(28) + ("%8.1fs" % result["total"]["median"]) + ("%8.1fs" % result["total"]["p95"]) + "".rjust(17)
+          + "   " + change(result["total"], previous["total"] if previous is not None else None))
+
+    if original_times:
+        print("\n  " + "3D models".ljust(28) + "Original".rjust(9) + "Prepared".rjust(9) + "   Change")
+        for stage, values in result["original_models"].items():
+            prepared = result["stages"][stage]["median"]
+            print("  " + stage.ljust(28) + ("%8.1fs" % values["median"]) + ("%8.1fs" % prepared)
+                  + ("   %+6.0f%%" % ((prepared / values["median"] - 1) * 100) if values["median"] else ""))
+        print("  " + "(plus pcb_prepare_models)".ljust(28) + "".rjust(9) + ("%8.1fs" % result["stages"]["pcb_prepare_models"]["median"]))
+
+    history.append(result)
+    with open(CONFIG_BENCHMARK_FILEPATH + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(history, f, indent=1)
+    os.replace(CONFIG_BENCHMARK_FILEPATH + ".tmp", CONFIG_BENCHMARK_FILEPATH)
+    print("\nBenchmark results added to;\n" + CONFIG_BENCHMARK_FILEPATH)
 
 
 
 ###########################################
 #
 #   MAIN
-#   Calls all the other functions in turn to export the design pack
+#   Exports the design pack for CONFIG_KICAD_NAME, or with --batch for several projects (see BATCH EXPORT), or --benchmark (see BENCHMARK)
 #
 ###########################################
 
-print("\n####################################################################")
-print("Exporting design pack from;\n" + CONFIG_KICAD_PROJECT)
-print("####################################################################\n")
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        batch_export(sys.argv[2:])
+        print("\nEnd of batch design pack export!")
+        print("\n####################################################################\n")
+        return
+    if len(sys.argv) > 2 and sys.argv[1] == "--benchmark":
+        benchmark(int(sys.argv[2]), sys.argv[3] if len(sys.argv) > 3 else None)
+        return
+
+    project = project_export()
 
-sch_erc()
-pcb_drc()
-sch_export_pdf()
-sch_export_bom()
-pcb_export_pdf()
-pcb_export_step()
-pcb_export_render("top")
-pcb_export_render("bottom")
-pcb_export_pos("front")
-pcb_export_pos("back")
-pcb_export_drill()
-pcb_export_gerbers()
-pcb_export_odb()
-#pcb_export_ipc2581() - DRAFT for future addition once issues are resolved (see top)
+    export_start = time.perf_counter()
+    run_projects([project])
+    total_time = time.perf_counter() - export_start
+    print_stage_summary(project.stages, total_time)
 
-print("\nEnd of design pack export!")
-print("\n####################################################################\n")
+    if project.cache is not None:
+        save_cache(CONFIG_EXPORT_CACHE_FILEPATH, project.cache)
+    if CONFIG_EXPORT_TRACE_FILEPATH:
+        save_trace(CONFIG_EXPORT_TRACE_FILEPATH, [project], export_start, total_time)
+        print("\nStage trace saved to;\n" + CONFIG_EXPORT_TRACE_FILEPATH + ".json/.csv/.chrome.json")
 
+    print("\nEnd of design pack export!")
+    print("\n####################################################################\n")
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Fabrication outputs (gerbers, drill + map files, position files) from ONE load of the board, using the pcbnew Python API.
+kicad-cli loads and parses the board again for every output, which dominates on large boards - this loads it once and
+plots everything from the board in memory.
+
+Must be run with KiCAD's own Python (the one with pcbnew), e.g. "C:\\Program Files\\KiCad\\9.0\\bin\\python.exe".
+Started by kicad_designpack_export.py when CONFIG_PCB_FAB_BACKEND = "pcbnew", which passes the job as JSON:
+    python kicad_fab_worker.py '{"board": ..., "gerbers": {...}, "drill": {...}, "pos": [...]}'
+
+Settings match the kicad-cli calls in kicad_designpack_export.py. Each output is done (and timed) separately, and the last
+line printed is a JSON result with the seconds taken for each output and any that failed - the export then redoes only
+those with kicad-cli.
+"""
+
+import json
+import os
+import sys
+import time
+import traceback
+
+import pcbnew
+
+
+def export_gerbers(board, job):
+    """One .gbr per layer, named <board>-<layer>.gbr like kicad-cli's --no-protel-ext output. Common layers aren't supported, so
+    kicad_designpack_export.py exports the gerbers with kicad-cli instead when CONFIG_PCB_EXPORT_GERBERS_LAYERS_COMMON is set."""
+    # Every option is set, as the plot controller otherwise starts from the plot settings saved in the board,
+    # where kicad-cli (without --board-plot-params) starts from its own defaults
+    controller = pcbnew.PLOT_CONTROLLER(board)
+    options = controller.GetPlotOptions()
+    options.SetOutputDirectory(job["folder"])
+    options.SetFormat(pcbnew.PLOT_FORMAT_GERBER)
+    options.SetPlotValue(False)                    # --exclude-value
+    options.SetPlotReference(True)                 # no --exclude-refdes
+    options.SetPlotFrameRef(False)                 # no --include-border-title
+    options.SetUseGerberX2format(True)             # no --no-x2
+    options.SetIncludeGerberNetlistInfo(True)      # no --no-netlist
+    options.SetUseAuxOrigin(True)                  # --use-drill-file-origin
+    options.SetUseGerberProtelExtensions(False)    # --no-protel-ext
+    options.SetSubtractMaskFromSilk(True)          # --subtract-soldermask
+    options.SetDisableGerberMacros(True)           # --disable-aperture-macros
+    options.SetGerberPrecision(job["precision"])   # --precision
+    # Not options of kicad-cli, which always plots this way
+    options.SetPlotInvisibleText(False)
+    options.SetSketchPadsOnFabLayers(False)
+    options.SetDrillMarksType(pcbnew.DRILL_MARKS_NO_DRILL_SHAPE)
+    options.SetMirror(False)
+    options.SetNegative(False)
+    options.SetAutoScale(False)
+    options.SetScale(1)
+
+    written = []
+    for name in job["layers"]:
+        layer = board.GetLayerID(name)
+        if layer < 0:
+            raise ValueError("unknown layer '" + name + "'")
+        controller.SetLayer(layer)
+        controller.OpenPlotfile(name.replace(".", "_"), pcbnew.PLOT_FORMAT_GERBER, name)
+        controller.PlotLayer()
+        written.append(controller.GetPlotFileName())
+    controller.ClosePlot()
+    return written
+
+
+def export_drill(board, job):
+    """Separate PTH/NPTH Excellon files plus gerber drill maps, absolute ('plot') origin, in mm."""
+    writer = pcbnew.EXCELLON_WRITER(board)
+    writer.SetOptions(False, False, pcbnew.VECTOR2I(0, 0), False)   # mirror, minimal header, origin, merge PTH/NPTH
+    writer.SetFormat(True)                                         # metric
+    writer.SetRouteModeForOvalHoles(False)                         # --excellon-oval-format alternate (the kicad-cli default)
+    writer.SetMapFileFormat(pcbnew.PLOT_FORMAT_GERBER)             # --map-format gerberx2
+    writer.CreateDrillandMapFilesSet(job["folder"], True, True)    # drill files, map files
+    return [job["folder"]]
+
+
+def export_pos(board, job):
+    """CSV position file for one side, mm, relative to the drill/place origin."""
+    top = job["side"] == "front"
+    exporter = pcbnew.PLACE_FILE_EXPORTER(board,
+                                          True,       # units mm
+                                          False,      # only SMD
+                                          False,      # exclude all TH
+                                          False,      # exclude DNP
+                                          top,        # top side
+                                          not top,    # bottom side
+                                          True,       # CSV format
+                                          True,       # use aux (drill file) origin
+                                          False)      # negate bottom X
+    data = exporter.GenPositionData()
+    with open(job["output"], "w", encoding="utf-8", newline="") as f:
+        f.write(data)
+    return [job["output"]]
+
+
+def main():
+    job = json.loads(sys.argv[1])
+    timings = {}
+    failed = {}
+
+    start = time.perf_counter()
+    board = pcbnew.LoadBoard(job["board"])
+    timings["load"] = time.perf_counter() - start
+
+    outputs = []
+    if job.get("gerbers"):
+        outputs.append(("gerbers", export_gerbers, job["gerbers"]))
+    if job.get("drill"):
+        outputs.append(("drill", export_drill, job["drill"]))
+    for pos_job in job.get("pos", []):
+        outputs.append(("pos_" + pos_job["side"], export_pos, pos_job))
+
+    for name, func, output_job in outputs:
+        start = time.perf_counter()
+        try:
+            for path in func(board, output_job):
+                print(name + ": " + os.path.basename(path))
+        except Exception:
+            failed[name] = traceback.format_exc(limit=2)
+        timings[name] = time.perf_counter() - start
+
+    print(json.dumps({"timings": timings, "failed": failed}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Geometry lint for every footprint in footprints/*.pretty - pads outside the courtyard or too close to its edge, overlapping pads,
+and footprints without a courtyard, fab outline or silkscreen.
+
+Each footprint's pads and graphic primitives are parsed into NumPy arrays for the whole set of footprints being checked, and
+the checks run on those arrays at once - pad extents, per-layer bounding boxes, courtyard containment, and the overlaps of
+every pair of pads in the same footprint. Results are cached per footprint by file hash (from kicad_library_index.py), so a
+re-run only parses and checks the footprints edited since - delete CACHE_FILENAME, or change a setting below, to check everything again.
+
+Simplifications: pads are taken as their rotated bounding box (custom pad primitives and drill offsets are ignored), arcs by
+their three points, and the courtyard as the bounding box of the courtyard layer - so an L-shaped courtyard can hide a pad
+outside it, but nothing is reported that isn't there.
+
+REQUIRES 'numpy' python package installed - install using 'pip3 install numpy' on command line
+
+Usage:
+    python kicad_footprint_lint.py [library folder]     # exits with 1 on errors
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from kicad_library_index import LibraryIndex
+from kicad_sexpr import iter_nodes
+
+
+# ==== CONFIGURATION ====
+LIBRARY_FOLDER = Path(__file__).resolve().parent.parent.parent   # Root of the library (has footprints/)
+CACHE_FILENAME = ".footprint_lint_cache.json"                     # Created in LIBRARY_FOLDER
+COURTYARD_CLEARANCE = 0.1    # mm, pads closer than this to the courtyard edge are warned about (IPC-7351 least density is 0.1)
+OVERLAP_TOLERANCE = 0.001    # mm, pads with different numbers overlapping by more than this are an error
+# ========================
+
+LINT_VERSION = 1    # Bump when the checks change, so cached results are redone
+
+LAYERS = ["F.CrtYd", "B.CrtYd", "F.Fab", "B.Fab", "F.SilkS", "B.SilkS"]
+LAYER_CODES = {name: code for code, name in enumerate(LAYERS)}
+SHAPES = ("fp_line", "fp_rect", "fp_circle", "fp_arc", "fp_poly", "fp_curve")
+FRONT_COPPER = ("F.Cu", "*.Cu", "F&B.Cu")
+BACK_COPPER = ("B.Cu", "*.Cu", "F&B.Cu")
+
+
+def numbers(node):
+    return [float(atom.value) for atom in node.atoms()] if node is not None else []
+
+
+def shape_points(node):
+    """Points spanning a graphic primitive - its ends, corners, or a circle's bounding box."""
+    if node.head == "fp_circle":
+        (cx, cy), (ex, ey) = numbers(node.find("center")), numbers(node.find("end"))
+        r = ((ex - cx) ** 2 + (ey - cy) ** 2) ** 0.5
+        return [(cx - r, cy - r), (cx + r, cy + r)]
+    if node.head in ("fp_poly", "fp_curve"):
+        pts = node.find("pts")
+        return [tuple(numbers(xy)) for xy in pts.children("xy")] if pts is not None else []
+    return [tuple(numbers(node.find(head))) for head in ("start", "mid", "end") if node.find(head) is not None]
+
+
+def parse_footprint(text):
+    """(pads, points) of one footprint - pads as (number, x, y, w, h, angle, front, back, round, net tie group), graphic points as
+    (layer code, x, y). The net tie group is the pad's position in net_tie_pad_groups, or -1."""
+    pads = []
+    points = []
+    net_tie_groups = {}
+    for node in iter_nodes(text, 2, 4):
+        if node.head == "pad":
+            atoms = node.atoms()
+            at = numbers(node.find("at"))
+            size = numbers(node.find("size"))
+            layers = [atom.value for atom in node.find("layers").atoms()] if node.find("layers") is not None else []
+            if len(at) < 2 or len(size) < 2:
+                continue
+            pads.append([atoms[0].value if atoms else "", at[0], at[1], size[0], size[1], at[2] if len(at) > 2 else 0.0,
+                         any(layer in FRONT_COPPER for layer in layers), any(layer in BACK_COPPER for layer in layers),
+                         len(atoms) > 2 and atoms[2].value == "circle", -1])
+        elif node.head in SHAPES:
+            layer = node.find("layer")
+            code = LAYER_CODES.get(layer.atoms()[0].value) if layer is not None and layer.atoms() else None
+            if code is not None:
+                points += [(code, x, y) for x, y in shape_points(node)]
+        elif node.head == "net_tie_pad_groups":
+            for group, atom in enumerate(node.atoms()):
+                for number in atom.value.split(","):
+                    net_tie_groups[number.strip()] = group
+
+    for pad in pads:
+        pad[9] = net_tie_groups.get(pad[0], -1)
+    return [tuple(pad) for pad in pads], points
+
+
+class FootprintSet:
+    """The pads and graphic points of a set of footprints as flat arrays, each row tagged with its footprint's position in the set."""
+
+    def __init__(self, parsed):
+        pad_rows = [(i,) + pad[1:] for i, (pads, _) in enumerate(parsed) for pad in pads]
+        point_rows = [(i,) + point for i, (_, points) in enumerate(parsed) for point in points]
+        self.count = len(parsed)
+        self.pad_numbers = [pad[0] for pads, _ in parsed for pad in pads]
+
+        pads = np.array(pad_rows, dtype=float).reshape(-1, 10)
+        self.pad_fp = pads[:, 0].astype(int)
+        self.pad_x, self.pad_y = pads[:, 1], pads[:, 2]
+        w, h, angle = pads[:, 3], pads[:, 4], np.radians(pads[:, 5])
+        cos, sin = np.abs(np.cos(angle)), np.abs(np.sin(angle))
+        self.pad_hx = (w * cos + h * sin) / 2     # Half extents of the rotated pad's bounding box
+        self.pad_hy = (w * sin + h * cos) / 2
+        self.pad_front = pads[:, 6].astype(bool)
+        self.pad_back = pads[:, 7].astype(bool)
+        self.pad_round = pads[:, 8].astype(bool)
+        self.pad_net_tie = pads[:, 9].astype(int)
+
+        points = np.array(point_rows, dtype=float).reshape(-1, 4)
+        fp, layer = points[:, 0].astype(int), points[:, 1].astype(int)
+        # Bounding box of each layer of each footprint, infinite where the footprint has nothing on that layer
+        self.box_min = np.full((self.count, len(LAYERS), 2), np.inf)
+        self.box_max = np.full((self.count, len(LAYERS), 2), -np.inf)
+        np.minimum.at(self.box_min, (fp, layer), points[:, 2:4])
+        np.maximum.at(self.box_max, (fp, layer), points[:, 2:4])
+        self.has_layer = np.isfinite(self.box_min[:, :, 0])
+
+    def pad_counts(self):
+        return np.bincount(self.pad_fp, minlength=self.count)
+
+    def courtyards(self):
+        """Per pad, the (min, max) corners of the courtyard it should be inside - front for front and through hole pads, back for
+        back only pads, either side's if the footprint only has the one - plus a mask of pads whose footprint has a courtyard."""
+        front, back = LAYER_CODES["F.CrtYd"], LAYER_CODES["B.CrtYd"]
+        use_back = (self.pad_back & ~self.pad_front & self.has_layer[self.pad_fp, back]) | ~self.has_layer[self.pad_fp, front]
+        layer = np.where(use_back, back, front)
+        return self.box_min[self.pad_fp, layer], self.box_max[self.pad_fp, layer], self.has_layer[self.pad_fp, layer]
+
+
+def pad_pairs(pad_fp, pad_counts):
+    """Every pair of pads in the same footprint as two index arrays (a, b) with a < b, in order - pads being grouped by footprint."""
+    index = np.arange(len(pad_fp))
+    after = np.cumsum(pad_counts)[pad_fp] - index - 1    # Pads after each one in its footprint
+    a = np.repeat(index, after)
+    b = a + 1 + np.arange(len(a)) - np.repeat(np.cumsum(after) - after, after)
+    return a, b
+
+
+def check_footprints(parsed):
+    """Problems of each of the parsed footprints, as lists of (severity, message)."""
+    problems = [[] for _ in parsed]
+    if not parsed:
+        return problems
+    fps = FootprintSet(parsed)
+    pad_counts = fps.pad_counts()
+
+    # Outlines - only for footprints with pads, so logos and drawings are left alone
+    for layers, severity, message in ((("F.CrtYd", "B.CrtYd"), "error", "no courtyard"),
+                                      (("F.Fab", "B.Fab"), "warning", "no fab outline"),
+                                      (("F.SilkS", "B.SilkS"), "warning", "no silkscreen")):
+        missing = ~fps.has_layer[:, [LAYER_CODES[layer] for layer in layers]].any(axis=1) & (pad_counts > 0)
+        for i in np.flatnonzero(missing):
+            problems[i].append((severity, message))
+
+    # Pad extents against the courtyard, all pads at once
+    court_min, court_max, has_court = fps.courtyards()
+    margin = np.minimum.reduce([fps.pad_x - fps.pad_hx - court_min[:, 0], fps.pad_y - fps.pad_hy - court_min[:, 1],
+                                court_max[:, 0] - fps.pad_x - fps.pad_hx, court_max[:, 1] - fps.pad_y - fps.pad_hy])
+    for i in np.flatnonzero(has_court & (margin < -OVERLAP_TOLERANCE)):
+        problems[fps.pad_fp[i]].append(("error", "pad " + fps.pad_numbers[i] + " outside the courtyard by %.3f mm" % -margin[i]))
+    for i in np.flatnonzero(has_court & (margin >= -OVERLAP_TOLERANCE) & (margin < COURTYARD_CLEARANCE - OVERLAP_TOLERANCE)):
+        problems[fps.pad_fp[i]].append(("warning", "pad " + fps.pad_numbers[i] + " only %.3f mm inside the courtyard" % max(margin[i], 0)))
+
+    # Overlaps of copper pads with different (non-empty) numbers on the same side - except net tie pads. Every pair of pads in the
+    # same footprint is checked at once, as flat arrays indexed by pair
+    a, b = pad_pairs(fps.pad_fp, pad_counts)
+    dx = np.abs(fps.pad_x[a] - fps.pad_x[b])
+    dy = np.abs(fps.pad_y[a] - fps.pad_y[b])
+    hx_a, hx_b, hy_a, hy_b = fps.pad_hx[a], fps.pad_hx[b], fps.pad_hy[a], fps.pad_hy[b]
+    boxes = (hx_a + hx_b - dx > OVERLAP_TOLERANCE) & (hy_a + hy_b - dy > OVERLAP_TOLERANCE)
+    # Round pads by distance, as their bounding boxes overlap diagonally before they do
+    round_a, round_b = fps.pad_round[a], fps.pad_round[b]
+    round_a_box_b = np.hypot(np.maximum(dx - hx_b, 0), np.maximum(dy - hy_b, 0)) < hx_a - OVERLAP_TOLERANCE
+    round_b_box_a = np.hypot(np.maximum(dx - hx_a, 0), np.maximum(dy - hy_a, 0)) < hx_b - OVERLAP_TOLERANCE
+    round_round = np.hypot(dx, dy) < hx_a + hx_b - OVERLAP_TOLERANCE
+    touching = np.select([round_a & round_b, round_a, round_b], [round_round, round_a_box_b, round_b_box_a], boxes)
+
+    pad_numbers = np.array(fps.pad_numbers, dtype=object)
+    same_side = (fps.pad_front[a] & fps.pad_front[b]) | (fps.pad_back[a] & fps.pad_back[b])
+    numbered = (pad_numbers[a] != "") & (pad_numbers[b] != "")
+    net_tie = (fps.pad_net_tie[a] == fps.pad_net_tie[b]) & (fps.pad_net_tie[a] >= 0)
+    clash = touching & same_side & numbered & (pad_numbers[a] != pad_numbers[b]) & ~net_tie
+    for pair in np.flatnonzero(clash):
+        problems[fps.pad_fp[a[pair]]].append(("error", "pads " + pad_numbers[a[pair]] + " and " + pad_numbers[b[pair]] + " overlap"))
+
+    return problems
+
+
+def settings_key():
+    return hashlib.sha1(repr((LINT_VERSION, COURTYARD_CLEARANCE, OVERLAP_TOLERANCE)).encode()).hexdigest()
+
+
+def lint_library(library_folder=LIBRARY_FOLDER, use_cache=True):
+    """Returns (problems, counts) - problems as (severity, footprint, message), counts of footprints checked and reused from the cache."""
+    root = Path(library_folder).resolve()
+    with LibraryIndex.open(root) as index:
+        files = index.db.execute("SELECT path, sha1 FROM files WHERE kind = 'footprint' ORDER BY path").fetchall()
+
+    cache_path = root / CACHE_FILENAME
+    cached = {}
+    if use_cache:
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache.get("settings") == settings_key():
+                cached = cache["footprints"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+    stale = [(path, sha1) for path, sha1 in files if cached.get(path, {}).get("sha1") != sha1]
+    parsed = [parse_footprint((root / path).read_text(encoding="utf-8")) for path, _ in stale]
+    for (path, sha1), footprint_problems in zip(stale, check_footprints(parsed)):
+        cached[path] = {"sha1": sha1, "problems": footprint_problems}
+
+    results = {path: cached[path] for path, _ in files}
+    with open(str(cache_path) + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"settings": settings_key(), "footprints": results}, f, indent=1)
+    os.replace(str(cache_path) + ".tmp", cache_path)
+
+    problems = []
+    for path, result in results.items():
+        name = Path(path).parent.stem + ":" + Path(path).stem
+        problems += [(severity, name, message) for severity, message in result["problems"]]
+    return problems, {"footprints": len(files), "checked": len(stale), "cached": len(files) - len(stale)}
+
+
+def main():
+    start = time.perf_counter()
+    problems, counts = lint_library(sys.argv[1] if len(sys.argv) > 1 else LIBRARY_FOLDER)
+    elapsed = time.perf_counter() - start
+
+    for severity, name, message in problems:
+        print(f"{severity.upper():<8} {name}: {message}")
+
+    errors = sum(1 for problem in problems if problem[0] == "error")
+    warnings = len(problems) - errors
+    print(f"\n{counts['footprints']} footprints in {elapsed * 1000:.0f} ms - {counts['checked']} checked, {counts['cached']} unchanged (cached), "
+          f"{errors} errors, {warnings} warnings")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
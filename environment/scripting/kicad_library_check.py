@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Check every link in the library - symbol Footprint and Datasheet properties, footprint (model ...) paths, and the
+sym-lib-table/fp-lib-table entries themselves - and report any that don't resolve to a file.
+Footprint ids are resolved through the fp-lib-table nicknames (falling back to KiCad's standard libraries, as the default global
+fp-lib-table does), and ${KIPRJMOD}/${KICAD9_3DMODEL_DIR} style paths
+(with either slash) through VARIABLES below.
+
+All lookups go against one path index built up front (from kicad_library_index.py, so unchanged libraries aren't even re-parsed),
+rather than a stat() per reference. Paths that only match with different letter case are warned about, as they work on
+Windows but not for a Linux CAM/assembly house.
+
+Exits with 1 if any link is broken, so it can gate the design pack export (see CONFIG_EXPORT_LIBRARY_CHECK in kicad_designpack_export.py).
+
+Usage:
+    python kicad_library_check.py [library folder] [index file]     # index file defaults to the one in the library folder
+"""
+
+import os
+import re
+import sys
+import time
+from pathlib import Path, PurePosixPath
+
+from kicad_library_index import LibraryIndex
+from kicad_sexpr import iter_nodes
+
+
+# ==== CONFIGURATION ====
+LIBRARY_FOLDER = Path(__file__).resolve().parent.parent.parent   # Root of the library (has symbols/, footprints/, sym-lib-table etc)
+LIBRARY_PREFIX = "${KIPRJMOD}/optimised_kicad-libraries/"         # How projects refer to the library root (as a git submodule)
+VARIABLES = {                                                     # Other path variables, None or a missing folder leaves their links unchecked
+    "KICAD9_3DMODEL_DIR": os.environ.get("KICAD9_3DMODEL_DIR", "C:\\Program Files\\KiCad\\9.0\\share\\kicad\\3dmodels"),
+    "KICAD9_FOOTPRINT_DIR": os.environ.get("KICAD9_FOOTPRINT_DIR", "C:\\Program Files\\KiCad\\9.0\\share\\kicad\\footprints"),
+}
+STANDARD_FP_LIBRARY_URI = "${KICAD9_FOOTPRINT_DIR}/{nickname}.pretty"   # For nicknames not in our fp-lib-table - KiCad's own libraries
+SYM_LIB_TABLE = "sym-lib-table"
+FP_LIB_TABLE = "fp-lib-table"
+# ========================
+
+VARIABLE_RE = re.compile(r'\$\{([^}]+)\}')
+
+
+class PathIndex:
+    """Every file and folder under the library root (from the library index), plus any outside folders listed on demand."""
+
+    def __init__(self, index: LibraryIndex):
+        self.files = set()
+        self.folders = set()
+        for (path,) in index.db.execute("SELECT path FROM files"):
+            self.files.add(path)
+            parent = PurePosixPath(path).parent
+            while str(parent) != "." and str(parent) not in self.folders:
+                self.folders.add(str(parent))
+                parent = parent.parent
+        # Links to folders that hold nothing indexed (e.g. an empty datasheets folder)
+        for path in index.root.glob("*/*"):
+            if path.is_dir():
+                self.folders.add(path.relative_to(index.root).as_posix())
+
+        self.folded = {path.casefold(): path for path in self.files | self.folders}
+        self.outside = {}
+
+    def lookup(self, location):
+        """(status, detail) for a resolved location - ('ok', None), ('case', actual path), ('missing', None) or ('unchecked', reason)."""
+        kind, path = location
+        if kind == "library":
+            if path in self.files or path in self.folders:
+                return "ok", None
+            actual = self.folded.get(path.casefold())
+            return ("case", actual) if actual else ("missing", None)
+
+        if kind == "unresolved":
+            return "unchecked", "${" + path + "} not set"
+
+        # Outside the library - list each folder once, rather than a stat() per link
+        folder, name = os.path.split(path)
+        if folder not in self.outside:
+            try:
+                self.outside[folder] = set(os.listdir(folder))
+            except OSError:
+                self.outside[folder] = None
+        names = self.outside[folder]
+        if names is None:
+            return "missing", None
+        if name in names:
+            return "ok", None
+        actual = {entry.casefold(): entry for entry in names}.get(name.casefold())
+        return ("case", os.path.join(folder, actual)) if actual else ("missing", None)
+
+
+def resolve(uri: str):
+    """Where a KiCad path points - ('library', relative path), ('outside', absolute path) or ('unresolved', variable name)."""
+    path = uri.replace("\\", "/")
+    if path.startswith(LIBRARY_PREFIX):
+        return "library", path[len(LIBRARY_PREFIX):].rstrip("/")
+
+    match = VARIABLE_RE.search(path)
+    while match:
+        value = VARIABLES.get(match.group(1))
+        if not value or not os.path.isdir(value):
+            return "unresolved", match.group(1)
+        path = path[:match.start()] + value.replace("\\", "/") + path[match.end():]
+        match = VARIABLE_RE.search(path)
+
+    if not os.path.isabs(path):
+        return "library", path.rstrip("/")
+    return "outside", os.path.normpath(path)
+
+
+def read_lib_table(path: Path):
+    """{nickname: uri} from a sym-lib-table or fp-lib-table."""
+    table = {}
+    text = path.read_text(encoding="utf-8")
+    for node in iter_nodes(text, 2):
+        if node.head != "lib":
+            continue
+        fields = {child.head: child.atoms()[0].value for child in node.children() if child.atoms()}
+        if "name" in fields and "uri" in fields:
+            table[fields["name"]] = fields["uri"]
+    return table
+
+
+def check_library(library_folder=LIBRARY_FOLDER, index_path=None):
+    """Returns (problems, counts) - problems as (severity, source, reference, message), counts by link status."""
+    root = Path(library_folder).resolve()
+    problems = []
+    counts = {"ok": 0, "case": 0, "missing": 0, "unchecked": 0, "skipped": 0}
+
+    with LibraryIndex.open(root, index_path) as index:
+        paths = PathIndex(index)
+
+        def check(source, reference, location):
+            status, detail = paths.lookup(location)
+            counts[status] += 1
+            if status == "missing":
+                problems.append(("error", source, reference, "not found"))
+            elif status == "case":
+                problems.append(("warning", source, reference, "only matches with different case: " + detail))
+            return status
+
+        fp_libraries = {}
+        for table_name in (SYM_LIB_TABLE, FP_LIB_TABLE):
+            table_path = root / table_name
+            if not table_path.is_file():
+                problems.append(("error", table_name, "", "library table not found"))
+                continue
+            for nickname, uri in read_lib_table(table_path).items():
+                location = resolve(uri)
+                check(table_name, nickname, location)
+                if table_name == FP_LIB_TABLE:
+                    fp_libraries[nickname] = location
+
+        symbol_links = index.db.execute(
+            "SELECT symbols.library, symbols.name, symbol_properties.name, symbol_properties.value FROM symbols "
+            "JOIN symbol_properties ON symbol_properties.symbol_id = symbols.id "
+            "WHERE symbol_properties.name IN ('Footprint', 'Datasheet') ORDER BY symbols.library, symbols.name").fetchall()
+        for library, name, prop_name, value in symbol_links:
+            source = library + ":" + name
+            if not value or value == "~" or re.match(r'^[a-z]+://', value, flags=re.IGNORECASE):
+                counts["skipped"] += 1     # Empty, or a URL - not checked offline
+                continue
+
+            if prop_name == "Datasheet":
+                check(source, "Datasheet " + value, resolve(value))
+                continue
+
+            nickname, _, footprint = value.partition(":")
+            library_location = fp_libraries.get(nickname)
+            if library_location is None:
+                library_location = resolve(STANDARD_FP_LIBRARY_URI.replace("{nickname}", nickname))
+            if library_location[0] == "unresolved":
+                check(source, "Footprint " + value, library_location)
+            elif library_location[0] == "library":
+                check(source, "Footprint " + value, ("library", library_location[1] + "/" + footprint + ".kicad_mod"))
+            else:
+                check(source, "Footprint " + value, (library_location[0], os.path.join(library_location[1], footprint + ".kicad_mod")))
+
+        model_links = index.db.execute(
+            "SELECT footprints.library, footprints.name, footprint_models.path FROM footprints "
+            "JOIN footprint_models ON footprint_models.footprint_id = footprints.id ORDER BY footprints.library, footprints.name").fetchall()
+        for library, name, model in model_links:
+            check(library + ":" + name, "Model " + model, resolve(model))
+
+    return problems, counts
+
+
+def main():
+    start = time.perf_counter()
+    problems, counts = check_library(sys.argv[1] if len(sys.argv) > 1 else LIBRARY_FOLDER, sys.argv[2] if len(sys.argv) > 2 else None)
+    elapsed = time.perf_counter() - start
+
+    for severity, source, reference, message in problems:
+        print(f"{severity.upper():<8} {source}: {reference} - {message}")
+
+    errors = sum(1 for problem in problems if problem[0] == "error")
+    print(f"\n{sum(counts.values())} links checked in {elapsed * 1000:.0f} ms - {counts['ok']} ok, {counts['missing']} broken, "
+          f"{counts['case']} case mismatch, {counts['unchecked']} unchecked (path variable not available), {counts['skipped']} empty/URL")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Persistent index of the whole library - symbols, footprints, 3D models and datasheets - in one SQLite file, for fast lookups by property.
+Updated incrementally: files whose size and mtime are unchanged are skipped, and changed ones are only re-parsed if their content hash differs
+(so a git checkout that only touches mtimes is cheap).
+
+Symbol properties are stored one row per property (indexed, case-insensitive) for exact lookups such as MPN1 or Footprint,
+plus an FTS5 full text table over names, descriptions, keywords and all property values for free text search.
+
+Usage:
+    from kicad_library_index import LibraryIndex
+
+    with LibraryIndex.open(library_folder) as index:    # updates the index, then queries it
+        index.find_symbols("MPN1", "GRM0335C1E100JA01D")
+        index.find_mpn("GRM0335C1E100JA01D")           # MPN1 or MPN2
+        index.search("buck 3A")
+
+From the command line (from anywhere in the library):
+    python kicad_library_index.py                       # update only
+    python kicad_library_index.py MPN1=TPS62130RGTR     # exact property lookup
+    python kicad_library_index.py "usb esd"             # full text search
+"""
+
+import hashlib
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+from kicad_sexpr import SymbolLibrary, iter_nodes
+
+
+# ==== CONFIGURATION ====
+LIBRARY_FOLDER = Path(__file__).resolve().parent.parent.parent   # Root of the library (has symbols/, footprints/ etc)
+INDEX_FILENAME = ".library_index.sqlite"                         # Created in LIBRARY_FOLDER
+SEARCH_LIMIT = 50                                                # Max results for a full text search
+# ========================
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT
+);
+CREATE TABLE IF NOT EXISTS symbols (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL,
+    library TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS symbols_file ON symbols(file);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols(library, name);
+CREATE TABLE IF NOT EXISTS symbol_properties (
+    symbol_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS symbol_properties_lookup ON symbol_properties(name COLLATE NOCASE, value COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS symbol_properties_symbol ON symbol_properties(symbol_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS symbols_fts USING fts5(name, library, description, keywords, properties);
+CREATE TABLE IF NOT EXISTS footprints (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL,
+    library TEXT NOT NULL,
+    name TEXT NOT NULL,
+    descr TEXT NOT NULL,
+    tags TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS footprints_name ON footprints(library, name);
+CREATE TABLE IF NOT EXISTS footprint_models (
+    footprint_id INTEGER NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS footprint_models_footprint ON footprint_models(footprint_id);
+CREATE TABLE IF NOT EXISTS assets (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS assets_name ON assets(kind, name COLLATE NOCASE);
+"""
+
+# kind -> (folder, glob) of everything indexed. Symbols and footprints are parsed, models and datasheets are indexed by path only.
+SOURCES = {
+    "symbol": ("symbols", "*.kicad_sym"),
+    "footprint": ("footprints", "*.pretty/*.kicad_mod"),
+    "model3d": ("models3d", "**/*"),
+    "datasheet": ("datasheets", "**/*"),
+}
+PARSED_KINDS = ("symbol", "footprint")
+IGNORED_ASSETS = (".keep",)
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+class LibraryIndex:
+    """The on-disk index for one library folder. Paths are stored relative to the library, with '/' separators."""
+
+    def __init__(self, library_folder, index_path=None):
+        self.root = Path(library_folder).resolve()
+        self.db = sqlite3.connect(str(index_path or self.root / INDEX_FILENAME))
+        self.db.row_factory = sqlite3.Row
+
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # Older (or newer) layout - just rebuild, it is only a cache of the library files
+            tables = [row[0] for row in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+            for name in tables:
+                # The FTS shadow tables go with their virtual table
+                if not name.startswith("symbols_fts_"):
+                    self.db.execute("DROP TABLE IF EXISTS " + name)
+            self.db.execute("PRAGMA user_version = " + str(SCHEMA_VERSION))
+        self.db.executescript(SCHEMA)
+
+    @classmethod
+    def open(cls, library_folder=LIBRARY_FOLDER, index_path=None, update=True):
+        index = cls(library_folder, index_path)
+        if update:
+            index.update()
+        return index
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    ###########################################
+    #   Incremental update
+    ###########################################
+
+    def scan(self):
+        """Every indexable file currently in the library, as {relative path: (kind, stat)}."""
+        found = {}
+        for kind, (folder, pattern) in SOURCES.items():
+            for path in (self.root / folder).glob(pattern):
+                if path.is_file() and path.name not in IGNORED_ASSETS:
+                    found[path.relative_to(self.root).as_posix()] = (kind, path.stat())
+        return found
+
+    def update(self):
+        """Bring the index up to date with the library files. Returns (files re-indexed, files removed, seconds)."""
+        start = time.perf_counter()
+        known = {row["path"]: row for row in self.db.execute("SELECT * FROM files")}
+        found = self.scan()
+
+        reindexed = 0
+        with self.db:
+            for rel_path in known.keys() - found.keys():
+                self.forget(rel_path, known[rel_path]["kind"])
+                self.db.execute("DELETE FROM files WHERE path = ?", (rel_path,))
+
+            for rel_path, (kind, stat) in found.items():
+                row = known.get(rel_path)
+                if row is not None and row["size"] == stat.st_size and row["mtime_ns"] == stat.st_mtime_ns:
+                    continue
+
+                sha1 = None
+                if kind in PARSED_KINDS:
+                    data = (self.root / rel_path).read_bytes()
+                    sha1 = hash_bytes(data)
+                    if row is None or row["sha1"] != sha1:
+                        self.forget(rel_path, kind)
+                        self.index_file(rel_path, kind, data.decode("utf-8"))
+                        reindexed += 1
+                else:
+                    self.forget(rel_path, kind)
+                    self.index_asset(rel_path, kind, stat.st_size)
+                    reindexed += 1
+
+                self.db.execute("INSERT OR REPLACE INTO files (path, kind, size, mtime_ns, sha1) VALUES (?, ?, ?, ?, ?)",
+                                (rel_path, kind, stat.st_size, stat.st_mtime_ns, sha1))
+
+        return reindexed, len(known.keys() - found.keys()), time.perf_counter() - start
+
+    def forget(self, rel_path, kind):
+        """Remove everything indexed from one file."""
+        if kind == "symbol":
+            ids = "SELECT id FROM symbols WHERE file = ?"
+            self.db.execute("DELETE FROM symbols_fts WHERE rowid IN (" + ids + ")", (rel_path,))
+            self.db.execute("DELETE FROM symbol_properties WHERE symbol_id IN (" + ids + ")", (rel_path,))
+            self.db.execute("DELETE FROM symbols WHERE file = ?", (rel_path,))
+        elif kind == "footprint":
+            self.db.execute("DELETE FROM footprint_models WHERE footprint_id IN (SELECT id FROM footprints WHERE file = ?)", (rel_path,))
+            self.db.execute("DELETE FROM footprints WHERE file = ?", (rel_path,))
+        else:
+            self.db.execute("DELETE FROM assets WHERE path = ?", (rel_path,))
+
+    def index_file(self, rel_path, kind, text):
+        if kind == "symbol":
+            self.index_symbols(rel_path, text)
+        else:
+            self.index_footprint(rel_path, text)
+
+    def index_symbols(self, rel_path, text):
+        library = Path(rel_path).stem
+        for symbol in SymbolLibrary(text).symbols:
+            symbol_id = self.db.execute("INSERT INTO symbols (file, library, name) VALUES (?, ?, ?)",
+                                        (rel_path, library, symbol.name)).lastrowid
+            props = {name: prop.value for name, prop in symbol.properties.items()}
+            self.db.executemany("INSERT INTO symbol_properties (symbol_id, name, value) VALUES (?, ?, ?)",
+                                [(symbol_id, name, value) for name, value in props.items()])
+            self.db.execute("INSERT INTO symbols_fts (rowid, name, library, description, keywords, properties) VALUES (?, ?, ?, ?, ?, ?)",
+                            (symbol_id, symbol.name, library, props.get("Description", ""), props.get("ki_keywords", ""),
+                             " ".join(value for name, value in props.items() if name not in ("Description", "ki_keywords"))))
+
+    def index_footprint(self, rel_path, text):
+        library = Path(rel_path).parent.stem
+        for node in iter_nodes(text, 1, 2):
+            if node.head != "footprint":
+                continue
+            atoms = node.atoms()
+            name = atoms[0].value if atoms else Path(rel_path).stem
+
+            def child_value(head):
+                child = node.find(head)
+                child_atoms = child.atoms() if child is not None else []
+                return child_atoms[0].value if child_atoms else ""
+
+            footprint_id = self.db.execute("INSERT INTO footprints (file, library, name, descr, tags) VALUES (?, ?, ?, ?, ?)",
+                                           (rel_path, library, name, child_value("descr"), child_value("tags"))).lastrowid
+            models = [model.atoms()[0].value for model in node.children("model") if model.atoms()]
+            self.db.executemany("INSERT INTO footprint_models (footprint_id, path) VALUES (?, ?)",
+                                [(footprint_id, path) for path in models])
+
+    def index_asset(self, rel_path, kind, size):
+        path = Path(rel_path)
+        self.db.execute("INSERT OR REPLACE INTO assets (path, kind, folder, name, size) VALUES (?, ?, ?, ?, ?)",
+                        (rel_path, kind, path.parent.name, path.name, size))
+
+    ###########################################
+    #   Queries
+    ###########################################
+
+    def symbol_rows(self, where, params):
+        rows = self.db.execute("SELECT symbols.id, symbols.file, symbols.library, symbols.name FROM symbols WHERE " + where, params).fetchall()
+        results = []
+        for row in rows:
+            props = dict(self.db.execute("SELECT name, value FROM symbol_properties WHERE symbol_id = ?", (row["id"],)).fetchall())
+            results.append({"library": row["library"], "name": row["name"], "file": row["file"], "properties": props})
+        return results
+
+    def find_symbols(self, prop_name, value):
+        """Symbols whose property prop_name equals value (case-insensitive)."""
+        return self.symbol_rows("id IN (SELECT symbol_id FROM symbol_properties WHERE name = ? COLLATE NOCASE AND value = ? COLLATE NOCASE)",
+                                (prop_name, value))
+
+    def find_mpn(self, mpn):
+        """Symbols with mpn as either their MPN1 or MPN2, ignoring spaces around it (property values are indexed as written)."""
+        return self.symbol_rows("id IN (SELECT symbol_id FROM symbol_properties WHERE name IN ('MPN1', 'MPN2') AND trim(value) = ? COLLATE NOCASE)",
+                                (mpn.strip(),))
+
+    def known_mpns(self):
+        """Every MPN1/MPN2 in the library, stripped and upper-cased, for checking a whole BOM at once - blank ones aren't MPNs."""
+        values = (row[0].strip() for row in self.db.execute("SELECT value FROM symbol_properties WHERE name IN ('MPN1', 'MPN2')"))
+        return {value.upper() for value in values if value}
+
+    def mpn_manufacturers(self):
+        """{MPN: manufacturers} for every MPN1/MPN2 in the library, paired with the same symbol's Manufacturer1/Manufacturer2, all stripped
+        and upper-cased. Blank (e.g. ' ') MPNs are skipped, or every part with one would seem to share a part number."""
+        rows = self.db.execute(
+            "SELECT mpn.value, manufacturer.value FROM symbol_properties AS mpn "
+            "LEFT JOIN symbol_properties AS manufacturer ON manufacturer.symbol_id = mpn.symbol_id "
+            "AND manufacturer.name = 'Manufacturer' || substr(mpn.name, 4) "
+            "WHERE mpn.name IN ('MPN1', 'MPN2')")
+        manufacturers = {}
+        for mpn, manufacturer in rows:
+            mpn = mpn.strip()
+            if not mpn:
+                continue
+            names = manufacturers.setdefault(mpn.upper(), set())
+            if manufacturer and manufacturer.strip():
+                names.add(manufacturer.strip().upper())
+        return manufacturers
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Full text search over symbol names, descriptions, keywords and property values, best matches first."""
+        # Quote each word so part numbers with '-' or '.' are taken literally, and prefix match the last one
+        words = query.split()
+        fts_query = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+        if words:
+            fts_query += "*"
+        return self.symbol_rows("id IN (SELECT rowid FROM symbols_fts WHERE symbols_fts MATCH ? ORDER BY rank LIMIT ?)", (fts_query, limit))
+
+    def footprint(self, lib_id):
+        """Footprint by its 'library:name' id (with or without the '_kb_' nickname prefix), with its 3D model paths, or None."""
+        library, _, name = lib_id.rpartition(":")
+        library = library[len("_kb_"):] if library.startswith("_kb_") else library
+        row = self.db.execute("SELECT * FROM footprints WHERE library = ? AND name = ?", (library, name)).fetchone()
+        if row is None:
+            return None
+        models = [r[0] for r in self.db.execute("SELECT path FROM footprint_models WHERE footprint_id = ?", (row["id"],))]
+        return {"library": row["library"], "name": row["name"], "file": row["file"], "descr": row["descr"], "tags": row["tags"], "models": models}
+
+    def assets(self, kind, name):
+        """Relative paths of models ('model3d') or datasheets ('datasheet') with the given file name (case-insensitive)."""
+        return [row[0] for row in self.db.execute("SELECT path FROM assets WHERE kind = ? AND name = ? COLLATE NOCASE", (kind, name))]
+
+
+def print_symbols(symbols):
+    for symbol in symbols:
+        props = symbol["properties"]
+        print(f"  {symbol['library']}:{symbol['name']:<40} {props.get('MPN1', ''):<28} {props.get('Description', '')}")
+    print(f"\n{len(symbols)} symbol(s)")
+
+
+def main():
+    with LibraryIndex(LIBRARY_FOLDER) as index:
+        reindexed, removed, elapsed = index.update()
+        print(f"Index updated in {elapsed * 1000:.0f} ms ({reindexed} file(s) re-indexed, {removed} removed)\n")
+
+        for query in sys.argv[1:]:
+            start = time.perf_counter()
+            if "=" in query:
+                prop_name, _, value = query.partition("=")
+                symbols = index.find_symbols(prop_name, value)
+            else:
+                symbols = index.search(query)
+            print_symbols(symbols)
+            print(f"Query '{query}' took {(time.perf_counter() - start) * 1000:.1f} ms\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,27 @@
 ## INFO
 # Simple script to export PNG images of the KiCAD PCB file from the X most recent commits in a particular branch of a local Git repo
 # Both KiCAD v7.0+ and Inkscape must be installed, the Git repo locally cloned, and the config values filled out below
+# If the 'cairosvg' python package is installed ('pip3 install cairosvg'), the opacity and PNG steps run in-process instead of with Inkscape, which is much faster
 #
-# First outputs all the X .kicad_pcb files
-# Next outputs all the X .svg files using the KiCAD CLI
+# Each commit goes through these steps independently, on a pool of worker processes (see CONFIG_MAX_WORKERS), each running one git/kicad-cli/inkscape step at a time
+# through kicad_process_runner.py - their output is printed line by line as they run, prefixed with the output file number, and a hung step is killed.
+# So CONFIG_MAX_WORKERS is also the cap on steps running at once. The 'git cat-file --batch' reader and ffmpeg (for "mp4") aren't steps and are outside it:
+# each is one process in the main script, fed through its stdin for the whole run, which the runner's run-to-the-end calls can't do;
+# First outputs the .kicad_pcb file for that commit (streamed from a single 'git cat-file --batch' reader, and deleted again once exported to SVG)
+# Next outputs the .svg file using the KiCAD CLI
 # Next sets all the layers of the SVG to a % opacity for visual clarity
-# Next converts the X .svg to .png using inkscape
-# Finally, crops the PNGs to a specified area
+# Next converts the .svg to .png (in memory with cairosvg, or using inkscape)
+# Finally, crops the PNG to a specified area
+# Rendered (uncropped) frames are cached by the git blob id of the PCB file, so boards unchanged between commits or since a previous run aren't exported and rendered again
 # Then the .PNG are available to use as you wish - e.g. Flowframes to merge (and AI interpolate) to a Gif https://github.com/n00mkrad/flowframes
+# Or set CONFIG_OUTPUT_ENCODE to have the cropped frames written straight to an animated GIF/APNG, or an MP4 via ffmpeg, with a hold time per frame
+#
+# Diff mode, for design reviews - 'python kicad_pcb_timelapse.py --diff OLD [NEW]' with any two git revisions (tag, branch, commit; NEW defaults to CONFIG_GIT_BRANCH)
+# Renders both revisions of the PCB file layer by layer (CONFIG_DIFF_LAYERS) on the same page at the same DPI, so pixels line up, then compares them with NumPy;
+# copper only in NEW is added (green), only in OLD removed (red), in both unchanged (grey) - written as one overlay PNG per layer, plus the changed area of each layer
+# Each layer render goes in the frame cache like the timelapse frames, so comparing adjacent commits only renders the one new revision
+# The 'All' layer is the timelapse frame itself (CONFIG_KICAD_LAYERS), so is taken straight from the frame cache for any commit the timelapse has rendered
+# Needs the 'numpy' python package ('pip3 install numpy')
 #
 # My initial investigations info for reference;
 #'git show HASH:file/path/name.ext > some_new_name.ext' example to pipe output from a single Git hash to a file
@@ -22,13 +36,31 @@
 ## TO-DO
 # Crop based on pixels rather than margins
 # Document FlowFrames settings better (RIFE CUDA??, approx 3x FPS, input FPS for length desired, no de-duplication, loop round, MP4 with CRF=15 ish)
-# Add config of additional duplication for final frame
 
 
 
+import csv
+import io
+import os
+import sys
+import hashlib
 import subprocess
 import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from PIL import Image # Install with 'pip3 install Pillow' before
+from kicad_process_runner import shared_runner
+
+try:
+    import cairosvg # Optional, install with 'pip3 install cairosvg' to rasterise in-process instead of with Inkscape
+except ImportError:
+    cairosvg = None
+
+try:
+    import numpy as np # Optional, install with 'pip3 install numpy' for the --diff mode
+except ImportError:
+    np = None
 
 ## CONFIG VALUES - set these before using script.
 ## For paths, use double backslashes '\\'
@@ -48,144 +80,621 @@ CONFIG_OUTPUT_IMAGE_CROP_LEFT = 300 #margin from left
 CONFIG_OUTPUT_IMAGE_CROP_RIGHT = 2100 #margin from right
 CONFIG_OUTPUT_IMAGE_CROP_TOP = 750 #margin from top
 CONFIG_OUTPUT_IMAGE_CROP_BOTTOM = 950 #margin from bottom
-CONFIG_OUTPUT_IMAGE_DUPLICATE = 2 # 1 default, 9 max (set higher for duplicates of each one, ensure image interpolation has de-duplication OFF)
+CONFIG_OUTPUT_IMAGE_DUPLICATE = 2 # 1 default, 9 max (set higher for duplicates of each one, ensure image interpolation has de-duplication OFF). Not used with CONFIG_OUTPUT_ENCODE
+CONFIG_OUTPUT_ENCODE = None # None to just output the PNG frames, or "gif", "apng" or "mp4" (needs ffmpeg) to also encode them into one animation
+CONFIG_OUTPUT_FRAME_DURATION_MS = 500 # hold time of each commit's frame in the animation
+CONFIG_OUTPUT_LAST_FRAME_DURATION_MS = 3000 # hold time of the final frame in the animation
+CONFIG_OUTPUT_BACKGROUND = "white" # animation background colour behind the (transparent) board image
+CONFIG_FFMPEG_PATH = "ffmpeg" # for "mp4", full path if not on the PATH
+CONFIG_FFMPEG_FPS = 30 # for "mp4", output frame rate (frames are held for their duration, not interpolated)
 CONFIG_INKSCAPE_PATH = "C:\\Program Files\\Inkscape\\bin\inkscape.com"
+CONFIG_USE_INKSCAPE = False # True to always use Inkscape for the opacity and PNG steps, even if cairosvg is installed
 CONFIG_KICAD_CLI_PATH = "C:\\Program Files\\KiCad\\7.0\\bin\\kicad-cli"
 CONFIG_KICAD_LAYERS = "F.Silkscreen,F.Paste,F.Cu,F.Courtyard,In2.Cu,B.Cu,Edge.Cuts"
+CONFIG_MAX_WORKERS = 6 # commits processed at once, each running its own git/kicad-cli/inkscape steps one after another - so also the most steps running at once
+CONFIG_STEP_TIMEOUT = 300 # seconds before a hung git/kicad-cli/inkscape step is killed and retried
+CONFIG_STEP_RETRIES = 1 # times a step is retried after timing out
+CONFIG_FRAME_CACHE = True # reuse rendered frames from previous runs, only the crop and duplicate steps are re-run for those
+CONFIG_FRAME_CACHE_PATH = CONFIG_OUTPUT_IMAGE_PATH + "frame_cache\\" # created if it doesn't exist, delete to clear the cache
+CONFIG_DIFF_LAYERS = "F.Cu,B.Cu" # layers compared one by one in --diff mode, add the inner layers (e.g. "F.Cu,In1.Cu,In2.Cu,B.Cu") for multilayer boards
+CONFIG_DIFF_ALL_LAYERS = True # also compare the timelapse frame (all of CONFIG_KICAD_LAYERS together), reusing its cached frames
+CONFIG_DIFF_COLOURS = {"unchanged": (170, 170, 170), "removed": (220, 40, 40), "added": (30, 160, 60), "background": (255, 255, 255)}
+
+
+# Each worker process (and the main script, before the pool starts) runs its steps one after another, so its runner is capped at one process
+STEP_PROCESSES_PER_WORKER = 1
+
+
+# Runs one external step for a commit, killing and retrying it if it hangs (instead of the old sleep() between Inkscape runs)
+# Its output is printed as it comes, prefixed with prefix, unless echo is False (for output that is parsed rather than shown)
+def run_step(cmd, prefix="", echo=True):
+    for attempt in range(CONFIG_STEP_RETRIES + 1):
+        try:
+            return shared_runner(STEP_PROCESSES_PER_WORKER).run(cmd, timeout=CONFIG_STEP_TIMEOUT, prefix=prefix, echo=echo)
+        except subprocess.TimeoutExpired:
+            print("Timed out after " + str(CONFIG_STEP_TIMEOUT) + "s, attempt #" + str(attempt + 1) + ": " + " ".join(cmd[:2]))
+    raise RuntimeError("Gave up after " + str(CONFIG_STEP_RETRIES + 1) + " attempts: " + " ".join(cmd))
+
+
+# Reads file contents from the Git repo by blob id, through one long-lived 'git cat-file --batch' process rather than a 'git show' per commit
+# Each reply is read on a helper thread, so a hung git is killed after CONFIG_STEP_TIMEOUT like any other step (and restarted for the next read)
+# Started directly rather than through run_step, as it stays running and is written to for every read (see the header)
+class GitBlobReader:
+    def __init__(self):
+        self.process = self.start()
+        self.thread = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        return subprocess.Popen(args=[CONFIG_GIT_EXE_PATH, '-C', CONFIG_GIT_REPO_PATH, 'cat-file', '--batch'],
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE)
+
+    def read(self, blob):
+        future = self.thread.submit(self.request, self.process, blob)
+        try:
+            return future.result(timeout=CONFIG_STEP_TIMEOUT)
+        except FutureTimeoutError:
+            # Killing it ends the helper thread's read too
+            self.process.kill()
+            self.process.wait()
+            self.process = self.start()
+            raise RuntimeError("Timed out after " + str(CONFIG_STEP_TIMEOUT) + "s reading git blob " + blob)
+
+    def request(self, process, blob):
+        process.stdin.write(blob.encode() + b"\n")
+        process.stdin.flush()
+
+        # Reply is '<blob> blob <size>\n<contents>\n', or '<blob> missing\n'
+        header = process.stdout.readline().split()
+        if len(header) != 3 or header[1] != b"blob":
+            raise RuntimeError("Git blob " + blob + " not found in " + CONFIG_GIT_REPO_PATH)
+
+        data = process.stdout.read(int(header[2]))
+        process.stdout.read(1)
+        return data
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait(timeout=CONFIG_STEP_TIMEOUT)
+        self.thread.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Outputs the .kicad_pcb file for this commit, as kicad-cli needs a file to export from
+def export_pcb(commit_num, commit_hash, pcb_data):
+    print("Exporting KiCAD PCB file for commit #" + commit_hash + " as commit #" + str(commit_num) + " ...")
+
+    with open(CONFIG_OUTPUT_PCB_PATH + CONFIG_OUTPUT_PCB_PREFIX + str(commit_num) + ".kicad_pcb", "wb") as fout:
+        fout.write(pcb_data)
+
+
+# Outputs the .svg file using the KiCAD CLI, always on the full page so every render of the board has the same origin and size
+def export_svg(commit_num, layers=CONFIG_KICAD_LAYERS, drawing_sheet=True):
+    print("Exporting SVG (" + layers + ") from output file #" + str(commit_num) + "\n")
+##C:\Program Files\KiCad\7.0\bin\kicad-cli pcb export svg --output C:\Users\KevinBibby\Desktop\test3.svg -l F.Cu,B.Cu --page-size-mode 2 --exclude-drawing-sheet C:\freelance\git\pt115a_vrgo-fyt-electronics-main\design\pt115a_vrgo-fyt-electronics-main.kicad_pcb
+    cmd = [CONFIG_KICAD_CLI_PATH,
+            'pcb',
+            'export',
+            'svg',
+            '--output',
+            CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + str(commit_num) + ".svg",
+            '-l',
+            layers,
+            '--page-size-mode',
+            '0',    # (0 = page with frame and title block, 1 = current page size, 2 = board area only) [default: 0]
+            CONFIG_OUTPUT_PCB_PATH + CONFIG_OUTPUT_PCB_PREFIX + str(commit_num) + ".kicad_pcb"]
+    if not drawing_sheet:
+        cmd.insert(-1, '--exclude-drawing-sheet')
 
+    run_step(cmd, prefix="#" + str(commit_num) + " ")
 
-# First outputs all the commit hashes for the kicad_pcb file changes (only where PCB file has changed)
-# git -C repo_path log branch_name --follow -n 10 --pretty=format:%H -- <filename.ext>
-print("Getting Git commit hash list of all KICAD PCB file changes on branch '" + CONFIG_GIT_BRANCH + "', up to " + str(CONFIG_GIT_NUM_COMMITS_MAX) + " commits max...\n")
 
-cmd = [CONFIG_GIT_EXE_PATH,
-        '-C',
-        CONFIG_GIT_REPO_PATH,
-        'log',
-        CONFIG_GIT_BRANCH,
-        '--follow',
-        '-n ' + str(CONFIG_GIT_NUM_COMMITS_MAX),
-        '--pretty=format:%H',
-        '--',
-        CONFIG_GIT_PCB_PATH]
+# Renders the SVG to an image with the layer opacity applied, in memory if cairosvg is available or with Inkscape otherwise
+def render_frame(commit_num):
+    if cairosvg is not None and not CONFIG_USE_INKSCAPE:
+        return render_svg_in_process(commit_num)
 
-process = subprocess.Popen(args=cmd, 
-                        stdout=subprocess.PIPE,
-                        shell=True, 
-                        universal_newlines=True)
+    set_svg_opacity(commit_num)
+    convert_svg_to_png(commit_num)
+    return Image.open(CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + str("%04d" % (commit_num,)) + ".png")
 
-kicad_pcb_hashes = process.stdout.readlines()
-kicad_pcb_hashes_cnt = len(kicad_pcb_hashes)
 
-# Reverse the order (from earliest to latest commit)
-kicad_pcb_hashes.reverse()
+# Same as Inkscape's 'select-all:all;object-set-property:opacity' - sets the opacity on every top-level drawn element of the SVG
+SVG_NAMESPACE = "http://www.w3.org/2000/svg"
+SVG_NON_DRAWN_TAGS = ("defs", "title", "desc", "metadata", "style")
 
-# Print a message with the total found and the first 8 characters of the first/last Git commit hashes found
-print("Found " + str(kicad_pcb_hashes_cnt) + " commits, from #" + kicad_pcb_hashes[0][:8] + " (earliest) to #" + kicad_pcb_hashes[kicad_pcb_hashes_cnt - 1][:8] + " (latest)\n")
+def apply_svg_opacity(svg_data):
+    ET.register_namespace("", SVG_NAMESPACE)
+    ET.register_namespace("xlink", "http://www.w3.org/1999/xlink")
 
-# Now output all the .kicad_pcb files for these commit hashes
-commit_cnt = 0
-for commit_hash in kicad_pcb_hashes:
-    commit_cnt += 1
+    root = ET.fromstring(svg_data)
+    for element in root:
+        if element.tag.rsplit("}", 1)[-1] not in SVG_NON_DRAWN_TAGS:
+            element.set("opacity", str(CONFIG_OUTPUT_IMAGE_OPACITY / 100))
 
-    # Strip off any trailing '\n'
-    commit_hash = commit_hash.rstrip('\n')
+    return ET.tostring(root)
 
-    # Export KiCAD PCB file for this commit hash
-    print("Exporting KiCAD PCB file for commit #" + commit_hash + " as commit #" + str(commit_cnt) + " ...")
 
-    cmd = [CONFIG_GIT_EXE_PATH,
-            '-C',
-            CONFIG_GIT_REPO_PATH,
-            "show",
-            commit_hash + ":" + CONFIG_GIT_PCB_PATH,
-            ">",
-            CONFIG_OUTPUT_PCB_PATH + CONFIG_OUTPUT_PCB_PREFIX + str(commit_cnt) + ".kicad_pcb"]    # Save in reverse numbering
+# Sets the opacity and rasterises the SVG at CONFIG_OUTPUT_IMAGE_DPI without leaving this process, returning a PIL image for the crop step
+def render_svg_in_process(commit_num):
+    print("\nRendering SVG at " + str(CONFIG_OUTPUT_IMAGE_OPACITY) + "% opacity for output file #" + str(commit_num) + "\n")
 
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
-    print(process.stdout)
+    with open(CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + str(commit_num) + ".svg", "rb") as fin:
+        svg_data = apply_svg_opacity(fin.read())
 
+    png_data = cairosvg.svg2png(bytestring=svg_data, dpi=CONFIG_OUTPUT_IMAGE_DPI)
+    im = Image.open(io.BytesIO(png_data))
+    im.load()
+    return im
 
-# Next outputs all the X .svg files using the KiCAD CLI
-for commit_num in range(1,kicad_pcb_hashes_cnt+1):
-    print("Exporting SVG from output file #" + str(commit_num) + "\n")
-##C:\Program Files\KiCad\7.0\bin\kicad-cli pcb export svg --output C:\Users\KevinBibby\Desktop\test3.svg -l F.Cu,B.Cu --page-size-mode 2 --exclude-drawing-sheet C:\freelance\git\pt115a_vrgo-fyt-electronics-main\design\pt115a_vrgo-fyt-electronics-main.kicad_pcb
-    cmd = [CONFIG_KICAD_CLI_PATH,
-            'pcb',
-            'export',
-            'svg',
-            '--output',
-            CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + str(commit_num) + ".svg",
-            '-l',
-            CONFIG_KICAD_LAYERS,
-            '--page-size-mode',
-            '0',    # (0 = page with frame and title block, 1 = current page size, 2 = board area only) [default: 0]
-            CONFIG_OUTPUT_PCB_PATH + CONFIG_OUTPUT_PCB_PREFIX + str(commit_num) + ".kicad_pcb"]
-            
-
-    process = subprocess.run(args=cmd, 
-                            stdout=subprocess.PIPE,
-                            shell=True, 
-                            universal_newlines=True)
-    print(process.stdout)
 
-
-# Next, modifies the SVG opacity for all layers for better visual clarity
-for commit_num in range(1,kicad_pcb_hashes_cnt+1):
+# Modifies the SVG opacity for all layers for better visual clarity
+def set_svg_opacity(commit_num):
     print("\nSetting SVG to " + str(CONFIG_OUTPUT_IMAGE_OPACITY) + "% opacity for output file #" + str(commit_num) + "\n")
 
-    # read svg file -> write png file
-    process = subprocess.run([CONFIG_INKSCAPE_PATH,
-                            '--actions=select-all:all;object-set-property:opacity,0.' + str(CONFIG_OUTPUT_IMAGE_OPACITY) + ';export-overwrite;export-do;',
-                            CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + str(commit_num) + ".svg"])
-       
-    print(process.stdout)
-
-    time.sleep(0.2) # Delay between each as sometimes hung mid loop
+    # read svg file -> write svg file
+    run_step([CONFIG_INKSCAPE_PATH,
+            '--actions=select-all:all;object-set-property:opacity,0.' + str(CONFIG_OUTPUT_IMAGE_OPACITY) + ';export-overwrite;export-do;',
+            CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + str(commit_num) + ".svg"],
+            prefix="#" + str(commit_num) + " ")
 
 
-# Next converts the X .svg to .png using inkscape. Pads the output filenames with leading zeros
-for commit_num in range(1,kicad_pcb_hashes_cnt+1):
+# Converts the .svg to .png using inkscape. Pads the output filenames with leading zeros
+def convert_svg_to_png(commit_num):
     print("Converting SVG to PNG for output file #" + str(commit_num) + "\n")
 
     # read svg file -> write png file
-    process = subprocess.run([CONFIG_INKSCAPE_PATH,
-                            '--export-type=png',
-                            f'--export-filename={CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + str("%04d" % (commit_num,)) + ".png"}',
-                            f'--export-dpi={CONFIG_OUTPUT_IMAGE_DPI}',
-                            CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + str(commit_num) + ".svg"])
-    print(process.stdout)
+    run_step([CONFIG_INKSCAPE_PATH,
+            '--export-type=png',
+            f'--export-filename={CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + str("%04d" % (commit_num,)) + ".png"}',
+            f'--export-dpi={CONFIG_OUTPUT_IMAGE_DPI}',
+            CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + str(commit_num) + ".svg"],
+            prefix="#" + str(commit_num) + " ")
+
 
-    time.sleep(0.1) # Delay between each as sometimes hung mid loop
+# Setting the points for cropped image (assumes zero in top left)
+def crop_box(img_width, img_height):
+    return (CONFIG_OUTPUT_IMAGE_CROP_LEFT,
+            CONFIG_OUTPUT_IMAGE_CROP_TOP,
+            img_width - CONFIG_OUTPUT_IMAGE_CROP_RIGHT,
+            img_height - CONFIG_OUTPUT_IMAGE_CROP_BOTTOM)
 
 
-# Next crops the PNGs to a specified area
-for commit_num in range(1,kicad_pcb_hashes_cnt+1):
-    # Open image file and get size
-    im = Image.open(CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + str("%04d" % (commit_num,)) + ".png")
+# Crops the rendered image to a specified area
+def crop_png(commit_num, im):
+    # Get image size
     img_width, img_height = im.size
-    
-    # Setting the points for cropped image (assumes zero in top left)
-    left = CONFIG_OUTPUT_IMAGE_CROP_LEFT
-    top = CONFIG_OUTPUT_IMAGE_CROP_TOP
-    right = img_width - CONFIG_OUTPUT_IMAGE_CROP_RIGHT
-    bottom = img_height - CONFIG_OUTPUT_IMAGE_CROP_BOTTOM
+
+    left, top, right, bottom = crop_box(img_width, img_height)
     crop_string = "(l=" + str(left) + ", t=" + str(top) + ", r=" + str(right) + ", b=" + str(bottom) + ")"
     size_string = "(" + str(img_width) + "x" + str(img_height) + "px)"
 
     print("Cropping PNG for output file #" + str(commit_num) + ", at " + crop_string + ", for " + size_string + "\n")
-     
+
     # Cropped image of above dimension
     im_crop = im.crop((left, top, right, bottom))
     im_crop.save(CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + "-crop-" + str("%04d" % (commit_num,)) + ".png")
 
+    # When encoding, the frame is handed back to be held for its duration instead
+    if CONFIG_OUTPUT_ENCODE:
+        return im_crop
 
     # Finally, outputs duplicates of each frame (if configured) to ensure a subsequent interpolation still pauses on each frame
     for duplicate_num in range(CONFIG_OUTPUT_IMAGE_DUPLICATE):
         print("Duplication #" + str(duplicate_num) + " for output file #" + str(commit_num) + "\n")
         im_crop.save(CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + "-crop-final" + str("%04d" % (commit_num,)) + str(duplicate_num) + ".png")
 
-    # Then - use these generated frames in another program to interpolate and turn into animated Gif or MP4 or similar
+    return None
+
+
+# Encodes the cropped frames, in commit order, into one animation - GIF/APNG with Pillow, or MP4 by piping raw frames to ffmpeg
+class FrameEncoder:
+    def __init__(self, encode):
+        self.encode = encode
+        self.filepath = CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + {"gif": ".gif", "apng": ".png", "mp4": ".mp4"}[encode]
+        self.frames = []
+        self.durations = []
+        self.ffmpeg = None
+        self.size = None
+
+    def add(self, im, duration_ms):
+        # Flatten onto the background, as neither GIF nor MP4 handle partial transparency
+        im = im.convert("RGBA")
+        background = Image.new("RGBA", im.size, CONFIG_OUTPUT_BACKGROUND)
+        im = Image.alpha_composite(background, im).convert("RGB")
+
+        if self.encode == "mp4":
+            self.add_ffmpeg(im, duration_ms)
+        else:
+            self.frames.append(im)
+            self.durations.append(duration_ms)
+
+    def add_ffmpeg(self, im, duration_ms):
+        if self.ffmpeg is None:
+            self.size = im.size
+            cmd = [CONFIG_FFMPEG_PATH,
+                    '-y',
+                    '-loglevel', 'error',
+                    '-f', 'rawvideo',
+                    '-pix_fmt', 'rgb24',
+                    '-s', str(im.size[0]) + "x" + str(im.size[1]),
+                    '-framerate', str(CONFIG_FFMPEG_FPS),
+                    '-i', '-',
+                    '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',   # yuv420p needs even dimensions
+                    '-c:v', 'libx264',
+                    '-pix_fmt', 'yuv420p',
+                    '-crf', '15',
+                    self.filepath]
+            # Started directly rather than through run_step, as the frames are streamed to it as they finish (see the header)
+            self.ffmpeg = subprocess.Popen(args=cmd, stdin=subprocess.PIPE)
+
+        if im.size != self.size:
+            im = im.resize(self.size)
+
+        # Hold the frame for its duration at the output frame rate
+        data = im.tobytes()
+        for _ in range(max(1, round(duration_ms * CONFIG_FFMPEG_FPS / 1000))):
+            self.ffmpeg.stdin.write(data)
+
+    def close(self):
+        print("Encoding animation to " + self.filepath + " ...")
+        if self.ffmpeg is not None:
+            self.ffmpeg.stdin.close()
+            self.ffmpeg.wait()
+        elif self.frames:
+            self.frames[0].save(self.filepath,
+                                format="GIF" if self.encode == "gif" else "PNG",
+                                save_all=True,
+                                append_images=self.frames[1:],
+                                duration=self.durations,
+                                loop=0)
+
+
+# Gets the commits that changed the PCB file (from earliest to latest), along with the git blob id of the PCB file at each one
+def get_commits():
+    # git -C repo_path log branch_name --follow -n 10 --pretty=format:%H --raw --no-abbrev -- <filename.ext>
+    cmd = [CONFIG_GIT_EXE_PATH,
+            '-C',
+            CONFIG_GIT_REPO_PATH,
+            'log',
+            CONFIG_GIT_BRANCH,
+            '--follow',
+            '-n ' + str(CONFIG_GIT_NUM_COMMITS_MAX),
+            '--pretty=format:%H',
+            '--raw',
+            '--no-abbrev',
+            '--',
+            CONFIG_GIT_PCB_PATH]
+
+    process = run_step(cmd, echo=False)
+
+    # Each commit hash line is followed by a raw diff line ':<old mode> <new mode> <old blob> <new blob> <status>\t<path>'
+    commits = []
+    for line in process.stdout.splitlines():
+        if line.startswith(":"):
+            if commits and commits[-1][1] is None:
+                commits[-1][1] = line.split()[3]
+        elif line.strip():
+            commits.append([line.strip(), None])
+
+    # Commits without a diff line (e.g. merges) - look up their blob separately. If the PCB file isn't there under that path
+    # (e.g. renamed or deleted at a merge), the blob stays None and main() marks the commit's frame as failed
+    for commit in commits:
+        if commit[1] is None:
+            process = run_step([CONFIG_GIT_EXE_PATH, '-C', CONFIG_GIT_REPO_PATH, 'rev-parse', '--verify', '--quiet', commit[0] + ":" + CONFIG_GIT_PCB_PATH], echo=False)
+            if process.returncode == 0 and process.stdout.strip():
+                commit[1] = process.stdout.strip()
+
+    # Reverse the order (from earliest to latest commit)
+    commits.reverse()
+    return commits
+
+
+# Same PCB file contents and render settings give the same (uncropped) frame
+def frame_cache_key(blob, layers=CONFIG_KICAD_LAYERS, drawing_sheet=True):
+    renderer = "cairosvg" if cairosvg is not None and not CONFIG_USE_INKSCAPE else "inkscape"
+    settings = [blob, layers, str(CONFIG_OUTPUT_IMAGE_DPI), str(CONFIG_OUTPUT_IMAGE_OPACITY), renderer, CONFIG_KICAD_CLI_PATH]
+    if not drawing_sheet:
+        settings.append("no-drawing-sheet")
+    return hashlib.sha256("|".join(settings).encode()).hexdigest()[:32]
+
+
+def frame_cache_filepath(frame_key):
+    return CONFIG_FRAME_CACHE_PATH + frame_key + ".png"
+
+
+# Renders one PCB file version from pcb_data as output file #commit_num (or loads it from the frame cache if pcb_data is None), returning (image, cached)
+def load_or_render_frame(frame_key, commit_hash, commit_num, pcb_data, layers=CONFIG_KICAD_LAYERS, drawing_sheet=True):
+    cache_filepath = frame_cache_filepath(frame_key)
+
+    if pcb_data is None:
+        print("Using cached frame for output file #" + str(commit_num) + " (commit #" + commit_hash[:8] + ")\n")
+        return Image.open(cache_filepath), True
+
+    export_pcb(commit_num, commit_hash, pcb_data)
+    export_svg(commit_num, layers, drawing_sheet)
+
+    # Only needed on disk for kicad-cli, so don't leave a copy of every revision lying around
+    os.remove(CONFIG_OUTPUT_PCB_PATH + CONFIG_OUTPUT_PCB_PREFIX + str(commit_num) + ".kicad_pcb")
+
+    im = render_frame(commit_num)
+
+    if CONFIG_FRAME_CACHE:
+        # Write then rename, so an interrupted run never leaves a half-written frame in the cache
+        im.save(cache_filepath + ".tmp", format="PNG")
+        os.replace(cache_filepath + ".tmp", cache_filepath)
+
+    return im, False
+
+
+# All the steps for one PCB file version, run in a worker process so each frame is finished as soon as its own steps are done.
+# Renders it once (or loads it from the frame cache), then crops it for every commit number that has this version
+def process_frame(frame_key, commit_hash, commit_nums, pcb_data):
+    start = time.perf_counter()
+    im, cached = load_or_render_frame(frame_key, commit_hash, commit_nums[0], pcb_data)
+
+    crops = {}
+    for commit_num in commit_nums:
+        crops[commit_num] = crop_png(commit_num, im)
+
+    return time.perf_counter() - start, cached, crops
+
+
+def main():
+    # First outputs all the commit hashes for the kicad_pcb file changes (only where PCB file has changed)
+    print("Getting Git commit hash list of all KICAD PCB file changes on branch '" + CONFIG_GIT_BRANCH + "', up to " + str(CONFIG_GIT_NUM_COMMITS_MAX) + " commits max...\n")
+
+    commits = get_commits()
+    kicad_pcb_hashes_cnt = len(commits)
+
+    # Print a message with the total found and the first 8 characters of the first/last Git commit hashes found
+    print("Found " + str(kicad_pcb_hashes_cnt) + " commits, from #" + commits[0][0][:8] + " (earliest) to #" + commits[kicad_pcb_hashes_cnt - 1][0][:8] + " (latest)\n")
+
+    if CONFIG_FRAME_CACHE:
+        os.makedirs(CONFIG_FRAME_CACHE_PATH, exist_ok=True)
+
+    # Group the commits (numbered from 1, earliest) by frame, so each distinct PCB file version is only rendered once
+    frames = {}
+    failed = []
+    for commit_num, (commit_hash, blob) in enumerate(commits, start=1):
+        if blob is None:
+            failed.append(commit_num)
+            print("!! Frame #" + str(commit_num) + " failed: PCB file " + CONFIG_GIT_PCB_PATH + " not found at commit #" + commit_hash[:8] + "\n")
+            continue
+        frames.setdefault(frame_cache_key(blob), (commit_hash, blob, []))[2].append(commit_num)
+
+    print(str(len(frames)) + " distinct PCB file versions to render for " + str(kicad_pcb_hashes_cnt) + " commits\n")
+
+    # Each frame flows through all of its steps independently. Board revisions are read from git as workers become free,
+    # so only a couple of revisions per worker are held in memory at once
+    start = time.perf_counter()
+    cached_cnt = 0
+    done_cnt = len(failed)
+    futures = {}
+
+    # Frames finish out of order, so are held here until all the earlier ones have gone to the encoder
+    encoder = FrameEncoder(CONFIG_OUTPUT_ENCODE) if CONFIG_OUTPUT_ENCODE else None
+    crops = {}
+    next_num = 1
+
+    def encode_ready():
+        nonlocal next_num
+        while next_num in crops or next_num in failed:
+            im_crop = crops.pop(next_num, None)
+            if im_crop is not None:
+                last = next_num == kicad_pcb_hashes_cnt
+                encoder.add(im_crop, CONFIG_OUTPUT_LAST_FRAME_DURATION_MS if last else CONFIG_OUTPUT_FRAME_DURATION_MS)
+            next_num += 1
+
+    def finish(done):
+        nonlocal done_cnt, cached_cnt
+        for future in done:
+            commit_nums = futures.pop(future)
+            done_cnt += len(commit_nums)
+            frame_name = "#" + ", #".join(str(commit_num) for commit_num in commit_nums)
+            try:
+                frame_time, cached, frame_crops = future.result()
+                cached_cnt += cached
+                crops.update(frame_crops)
+                print("Finished frame " + frame_name + " in " + ("%.1f" % frame_time) + "s" + (" (cached)" if cached else "") + " (" + str(done_cnt) + "/" + str(kicad_pcb_hashes_cnt) + ")\n")
+            except Exception as e:
+                failed.extend(commit_nums)
+                print("!! Frame " + frame_name + " failed: " + str(e) + "\n")
+
+        if encoder is not None:
+            encode_ready()
+
+    with GitBlobReader() as reader, ProcessPoolExecutor(max_workers=CONFIG_MAX_WORKERS) as pool:
+        for frame_key, (commit_hash, blob, commit_nums) in frames.items():
+            if len(futures) >= 2 * CONFIG_MAX_WORKERS:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                finish(done)
+
+            if CONFIG_FRAME_CACHE and os.path.exists(frame_cache_filepath(frame_key)):
+                pcb_data = None
+            else:
+                try:
+                    pcb_data = reader.read(blob)
+                except RuntimeError as e:
+                    failed.extend(commit_nums)
+                    done_cnt += len(commit_nums)
+                    print("!! Frame #" + ", #".join(str(commit_num) for commit_num in commit_nums) + " failed: " + str(e) + "\n")
+                    continue
+
+            futures[pool.submit(process_frame, frame_key, commit_hash, commit_nums, pcb_data)] = commit_nums
+
+        finish(as_completed(list(futures)))
+
+    if encoder is not None:
+        encoder.close()
+
+    print("Finished " + str(kicad_pcb_hashes_cnt - len(failed)) + " of " + str(kicad_pcb_hashes_cnt) + " frames in " + ("%.1f" % (time.perf_counter() - start)) + "s, " + str(cached_cnt) + " of " + str(len(frames)) + " renders from the frame cache")
+    if failed:
+        print("Failed frames: " + ", ".join(str(commit_num) for commit_num in sorted(failed)))
+
+    # Then - use these generated frames (or the encoded animation) in another program to interpolate and turn into animated Gif or MP4 or similar
+
+
+# Gets the commit hash of a revision (tag, branch, commit etc), along with the git blob id of the PCB file at it
+def get_revision(revision):
+    commit_process = run_step([CONFIG_GIT_EXE_PATH, '-C', CONFIG_GIT_REPO_PATH, 'rev-parse', '--verify', '--quiet', revision + "^{commit}"], echo=False)
+    if commit_process.returncode != 0:
+        raise RuntimeError("Revision '" + revision + "' not found in " + CONFIG_GIT_REPO_PATH)
+    commit_hash = commit_process.stdout.strip()
+
+    blob_process = run_step([CONFIG_GIT_EXE_PATH, '-C', CONFIG_GIT_REPO_PATH, 'rev-parse', '--verify', '--quiet', commit_hash + ":" + CONFIG_GIT_PCB_PATH], echo=False)
+    if blob_process.returncode != 0:
+        raise RuntimeError("PCB file " + CONFIG_GIT_PCB_PATH + " not found at revision '" + revision + "'")
+    return commit_hash, blob_process.stdout.strip()
+
+
+# Pixels drawn on, as a boolean array - from the alpha channel, as renders have a transparent background.
+# Anti-aliased edges count once they are at least half covered, so the same edge in both revisions always gives the same pixels
+def drawn_mask(im):
+    alpha = np.asarray(im.convert("RGBA").getchannel("A"))
+    return alpha >= 255 * CONFIG_OUTPUT_IMAGE_OPACITY / 200
+
+
+# Pads a mask with undrawn pixels on the right and bottom, for boards whose page size changed between revisions (the origin is top left either way)
+def pad_mask(mask, shape):
+    if mask.shape == shape:
+        return mask
+    padded = np.zeros(shape, dtype=bool)
+    padded[:mask.shape[0], :mask.shape[1]] = mask
+    return padded
+
+
+# One layer of the diff, run in a worker process - renders (or loads from the frame cache) the OLD and NEW revisions of the layer, then compares them.
+# revisions is [(frame_key, commit_hash, commit_num, pcb_data)] for OLD then NEW. Writes the overlay PNG and returns the areas in mm2
+def diff_layer(layer_name, layers, drawing_sheet, revisions):
+    start = time.perf_counter()
+    masks = []
+    cached_cnt = 0
+    for frame_key, commit_hash, commit_num, pcb_data in revisions:
+        im, cached = load_or_render_frame(frame_key, commit_hash, commit_num, pcb_data, layers, drawing_sheet)
+        masks.append(drawn_mask(im))
+        cached_cnt += cached
+
+    shape = (max(mask.shape[0] for mask in masks), max(mask.shape[1] for mask in masks))
+    old, new = (pad_mask(mask, shape) for mask in masks)
+    added = new & ~old
+    removed = old & ~new
+
+    overlay = np.empty(shape + (3,), dtype=np.uint8)
+    overlay[:] = CONFIG_DIFF_COLOURS["background"]
+    overlay[old & new] = CONFIG_DIFF_COLOURS["unchanged"]
+    overlay[removed] = CONFIG_DIFF_COLOURS["removed"]
+    overlay[added] = CONFIG_DIFF_COLOURS["added"]
+
+    im = Image.fromarray(overlay)
+    im = im.crop(crop_box(*im.size))
+    filepath = CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + "-diff-" + layer_name.replace(".", "_") + ".png"
+    im.save(filepath)
+
+    # Where the changes are, in mm from the top left of the page - the same coordinates KiCAD shows
+    mm_per_px = 25.4 / CONFIG_OUTPUT_IMAGE_DPI
+    changed = added | removed
+    rows = np.flatnonzero(changed.any(axis=1))
+    cols = np.flatnonzero(changed.any(axis=0))
+    region = None
+    if rows.size:
+        region = (cols[0] * mm_per_px, rows[0] * mm_per_px, (cols[-1] + 1) * mm_per_px, (rows[-1] + 1) * mm_per_px)
+
+    mm2_per_px = mm_per_px * mm_per_px
+    return {"layer": layer_name,
+            "added": np.count_nonzero(added) * mm2_per_px,
+            "removed": np.count_nonzero(removed) * mm2_per_px,
+            "old": np.count_nonzero(old) * mm2_per_px,
+            "new": np.count_nonzero(new) * mm2_per_px,
+            "region": region,
+            "filepath": filepath,
+            "cached": cached_cnt,
+            "time": time.perf_counter() - start}
+
+
+# Compares two revisions of the PCB file layer by layer, writing an overlay PNG per layer and a summary CSV of the changed areas
+def diff(old_revision, new_revision):
+    if np is None:
+        print("Diff mode needs the 'numpy' python package - install using 'pip3 install numpy' on command line")
+        sys.exit(1)
+
+    revisions = []
+    for revision in (old_revision, new_revision):
+        commit_hash, blob = get_revision(revision)
+        revisions.append((commit_hash, blob))
+        print("Revision '" + revision + "' is commit #" + commit_hash[:8] + "\n")
+
+    if CONFIG_FRAME_CACHE:
+        os.makedirs(CONFIG_FRAME_CACHE_PATH, exist_ok=True)
+
+    # (name, layers rendered, with drawing sheet) - single layers without the drawing sheet, so title block changes don't show up as copper
+    diff_layers = [(layer, layer, False) for layer in CONFIG_DIFF_LAYERS.split(",")]
+    if CONFIG_DIFF_ALL_LAYERS:
+        diff_layers.append(("All", CONFIG_KICAD_LAYERS, True))
+
+    start = time.perf_counter()
+    results = {}
+    failed = []
+    with GitBlobReader() as reader, ProcessPoolExecutor(max_workers=CONFIG_MAX_WORKERS) as pool:
+        pcb_data = {}   # Each revision is read from git once, for all the layers that aren't cached
+        futures = {}
+        for layer_num, (layer_name, layers, drawing_sheet) in enumerate(diff_layers):
+            layer_revisions = []
+            for revision_num, (commit_hash, blob) in enumerate(revisions):
+                frame_key = frame_cache_key(blob, layers, drawing_sheet)
+                data = None
+                if not (CONFIG_FRAME_CACHE and os.path.exists(frame_cache_filepath(frame_key))):
+                    if blob not in pcb_data:
+                        pcb_data[blob] = reader.read(blob)
+                    data = pcb_data[blob]
+                # Every render has its own output file number, as they all run at once
+                layer_revisions.append((frame_key, commit_hash, 2 * layer_num + revision_num + 1, data))
+            futures[pool.submit(diff_layer, layer_name, layers, drawing_sheet, layer_revisions)] = layer_name
+
+        for future in as_completed(futures):
+            layer_name = futures[future]
+            try:
+                result = future.result()
+                results[layer_name] = result
+                print("Finished layer " + layer_name + " in " + ("%.1f" % result["time"]) + "s (" + str(result["cached"]) + " of 2 renders cached)\n")
+            except Exception as e:
+                failed.append(layer_name)
+                print("!! Layer " + layer_name + " failed: " + str(e) + "\n")
+
+    print("Changes from '" + old_revision + "' (#" + revisions[0][0][:8] + ") to '" + new_revision + "' (#" + revisions[1][0][:8] + "), in "
+          + ("%.1f" % (time.perf_counter() - start)) + "s;\n")
+    print("Layer".ljust(12) + "Added mm2".rjust(12) + "Removed mm2".rjust(14) + "Before mm2".rjust(14) + "After mm2".rjust(14) + "   Changed region (mm)")
+    rows = []
+    for layer_name, _, _ in diff_layers:
+        result = results.get(layer_name)
+        if result is None:
+            continue
+        region = result["region"]
+        region_string = "(%.1f, %.1f) to (%.1f, %.1f)" % region if region else "no change"
+        print(layer_name.ljust(12) + ("%.2f" % result["added"]).rjust(12) + ("%.2f" % result["removed"]).rjust(14)
+              + ("%.2f" % result["old"]).rjust(14) + ("%.2f" % result["new"]).rjust(14) + "   " + region_string)
+        rows.append([layer_name] + ["%.3f" % result[key] for key in ("added", "removed", "old", "new")]
+                    + (["%.2f" % value for value in region] if region else [""] * 4) + [result["filepath"]])
+
+    summary_filepath = CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + "-diff.csv"
+    with open(summary_filepath, "w", newline="") as fout:
+        writer = csv.writer(fout)
+        writer.writerow(["Layer", "Added mm2", "Removed mm2", "Before mm2", "After mm2", "Changed x1 mm", "Changed y1 mm", "Changed x2 mm", "Changed y2 mm", "Overlay"])
+        writer.writerows(rows)
+    print("\nOverlays written to " + CONFIG_OUTPUT_IMAGE_PATH + CONFIG_OUTPUT_IMAGE_PREFIX + "-diff-<layer>.png, summary to " + summary_filepath)
+
+    if failed:
+        print("Failed layers: " + ", ".join(failed))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--diff":
+        diff(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else CONFIG_GIT_BRANCH)
+    else:
+        main()
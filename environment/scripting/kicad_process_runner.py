@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Runs the external programs of the export and timelapse scripts (kicad-cli, git, Inkscape) - one asyncio event loop in a background
+thread drives every child process, so the scripts' own worker threads and processes just hand it commands and wait.
+
+  - stdout and stderr are read line by line while the process runs, and echoed with a prefix (e.g. the stage name) as they arrive,
+    so parallel jobs show their progress as it happens rather than in one block each at the end
+  - a timeout kills the process itself (never through a shell) and raises subprocess.TimeoutExpired, as subprocess.run does -
+    it counts from the call, so time spent queued for a free process slot is included
+  - jobs can be put in a JobGroup; cancelling the group kills its running processes and stops any more from starting
+    (raising JobCancelled in the callers), so one fatal failure doesn't leave its siblings running on to no purpose
+  - at most max_processes run at once across every caller using the same runner - shared_runner() gives one per Python process
+  - optionally samples each process's CPU time and peak memory while it runs, if 'psutil' is installed
+
+Usage:
+    from kicad_process_runner import JobGroup, shared_runner
+
+    runner = shared_runner(4)
+    jobs = JobGroup()
+    result = runner.run(["kicad-cli", "pcb", "drc", "board.kicad_pcb"], timeout=600, prefix="[drc] ", jobs=jobs)
+    result.returncode, result.stdout, result.stderr     # as a subprocess.CompletedProcess
+    jobs.cancel("DRC failed")                           # from any thread
+"""
+
+import asyncio
+import locale
+import os
+import subprocess
+import threading
+import time
+
+try:
+    import psutil # Optional, install with 'pip3 install psutil' to sample the CPU time and memory of each process
+except ImportError:
+    psutil = None
+
+
+DEFAULT_MAX_PROCESSES = os.cpu_count() or 4
+READ_LIMIT = 16 * 1024 * 1024    # Longest line read from a process, e.g. a JSON result on one line
+KILL_GRACE = 1.0                 # Seconds to finish reading the output of a killed process, in case something it started holds the pipes open
+
+
+class JobCancelled(subprocess.SubprocessError):
+    """Raised by a job whose group was cancelled - before it started, or by killing it."""
+
+    def __init__(self, cmd, reason):
+        super().__init__("Cancelled (" + reason + "): " + " ".join(str(arg) for arg in cmd[:2]))
+        self.cmd = cmd
+        self.reason = reason
+
+
+class ProcessResult(subprocess.CompletedProcess):
+    """A subprocess.CompletedProcess, plus the sampled CPU seconds and peak memory bytes (None if not sampled)."""
+
+    def __init__(self, args, returncode, stdout, stderr, wall_time, cpu_time=None, peak_rss=None):
+        super().__init__(args, returncode, stdout, stderr)
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.peak_rss = peak_rss
+
+
+class JobGroup:
+    """Jobs that are cancelled together. Groups can be nested - cancelling a group also cancels the groups made under it."""
+
+    def __init__(self, parent=None):
+        self.lock = threading.Lock()
+        self.reason = None          # Set once cancelled
+        self.processes = {}         # Running process -> (the loop it runs on, its 'killed' event)
+        self.children = []
+        if parent is not None:
+            with parent.lock:
+                parent.children.append(self)
+                self.reason = parent.reason
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def cancel(self, reason="cancelled"):
+        """Kill every running process of the group (and its child groups), and stop any more from starting. Safe from any thread."""
+        with self.lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+            processes = list(self.processes.items())
+            children = list(self.children)
+        for process, (loop, killed) in processes:
+            loop.call_soon_threadsafe(kill_process, process, killed)
+        for child in children:
+            child.cancel(reason)
+
+    def add(self, process, loop, killed):
+        with self.lock:
+            if self.reason is None:
+                self.processes[process] = (loop, killed)
+                return True
+        return False
+
+    def remove(self, process):
+        with self.lock:
+            self.processes.pop(process, None)
+
+
+def kill_process(process, killed):
+    killed.set()
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass    # Exited in the meantime
+
+
+class ProcessRunner:
+    """The event loop thread and the process limit. run() can be called from any number of threads at once."""
+
+    def __init__(self, max_processes=DEFAULT_MAX_PROCESSES):
+        self.max_processes = max_processes
+        self.pid = os.getpid()
+        self.encoding = locale.getpreferredencoding(False)   # As subprocess.run(universal_newlines=True)
+        self.loop = asyncio.new_event_loop()
+        self.semaphore = None   # Made on the loop, by the first job
+        self.thread = threading.Thread(target=self.loop.run_forever, name="process-runner", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def run(self, cmd, timeout=None, prefix="", echo=True, jobs=None, cwd=None, sample_interval=None):
+        """Run cmd to completion and return a ProcessResult - blocking the calling thread, not the other jobs.
+        Output lines are printed as prefix + line if echo, timeout is in seconds from now (None for no limit) including any wait
+        for a free process slot, and sample_interval is the seconds between CPU/memory samples (None, or without psutil, to not sample)."""
+        future = asyncio.run_coroutine_threadsafe(self.run_async(cmd, timeout, prefix, echo, jobs, cwd, sample_interval), self.loop)
+        try:
+            return future.result()
+        except BaseException:
+            # E.g. Ctrl+C in the calling thread - don't leave the process running
+            future.cancel()
+            raise
+
+    async def run_async(self, cmd, timeout=None, prefix="", echo=True, jobs=None, cwd=None, sample_interval=None):
+        """As run(), for coroutines already running on this runner's loop."""
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_processes)
+
+        # The deadline is set before queueing for the semaphore, so a job held up behind max_processes others still ends on time
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(cmd, timeout) from None
+
+        try:
+            if jobs is not None and jobs.cancelled:
+                raise JobCancelled(cmd, jobs.reason)
+
+            start = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(*cmd, cwd=cwd, limit=READ_LIMIT, stdin=subprocess.DEVNULL,
+                                                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            killed = asyncio.Event()
+            if jobs is not None and not jobs.add(process, self.loop, killed):
+                kill_process(process, killed)   # Cancelled while it was starting
+
+            stdout, stderr = [], []
+            sample = {"cpu_time": None, "peak_rss": None}
+            readers = [asyncio.ensure_future(self.read_lines(process.stdout, stdout, prefix if echo else None)),
+                       asyncio.ensure_future(self.read_lines(process.stderr, stderr, prefix if echo else None))]
+            sampler = None
+            if psutil is not None and sample_interval:
+                sampler = asyncio.ensure_future(sample_process(process.pid, sample_interval, sample))
+
+            # process.wait() only returns once the pipes are closed too, so a killed process is waited on (and its output
+            # read to the end) for at most KILL_GRACE, in case something it started is still holding them open
+            exited = asyncio.ensure_future(process.wait())
+            kill_requested = asyncio.ensure_future(killed.wait())
+            timed_out = False
+            try:
+                remaining = max(deadline - time.monotonic(), 0) if deadline is not None else None
+                await asyncio.wait([exited, kill_requested], timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not exited.done():
+                    timed_out = not killed.is_set()
+                    kill_process(process, killed)
+                await asyncio.wait([exited] + readers, timeout=KILL_GRACE if killed.is_set() else None)
+            except asyncio.CancelledError:
+                kill_process(process, killed)
+                raise
+            finally:
+                for task in readers + [exited, kill_requested]:
+                    task.cancel()
+                if sampler is not None:
+                    sampler.cancel()
+                if jobs is not None:
+                    jobs.remove(process)
+
+            if timed_out:
+                raise subprocess.TimeoutExpired(cmd, timeout, "".join(stdout), "".join(stderr))
+            if jobs is not None and jobs.cancelled:
+                raise JobCancelled(cmd, jobs.reason)
+            return ProcessResult(cmd, process.returncode, "".join(stdout), "".join(stderr), time.perf_counter() - start,
+                                 sample["cpu_time"], sample["peak_rss"])
+        finally:
+            self.semaphore.release()
+
+    async def read_lines(self, stream, lines, prefix):
+        while True:
+            data = await stream.readline()
+            if not data:
+                return
+            line = data.decode(self.encoding, errors="replace").replace("\r\n", "\n")
+            lines.append(line)
+            if prefix is not None and line.strip():
+                print(prefix + line.rstrip(), flush=True)
+
+
+async def sample_process(pid, interval, sample):
+    # Updates sample with the CPU time and peak memory of the process every interval, until cancelled or the process exits
+    try:
+        child = psutil.Process(pid)
+        while True:
+            with child.oneshot():
+                times = child.cpu_times()
+                memory = child.memory_info()
+            sample["cpu_time"] = times.user + times.system
+            sample["peak_rss"] = max(sample["peak_rss"] or 0, memory.rss, getattr(memory, "peak_wset", 0))   # Windows also tracks the true peak
+            await asyncio.sleep(interval)
+    except psutil.Error:
+        pass    # Exited
+
+
+_shared_runner = None
+_shared_lock = threading.Lock()
+
+def shared_runner(max_processes=DEFAULT_MAX_PROCESSES):
+    """The runner for this Python process, made on first use - max_processes is only taken from that first call.
+    A worker process forked from one that already had a runner gets its own, as the loop thread isn't forked with it."""
+    global _shared_runner
+    with _shared_lock:
+        if _shared_runner is None or _shared_runner.pid != os.getpid():
+            _shared_runner = ProcessRunner(max_processes)
+        return _shared_runner
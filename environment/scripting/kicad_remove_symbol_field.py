@@ -1,77 +1,127 @@
 #!/usr/bin/env python3
 """
-Remove all (property "<FIELDNAME>" ...) blocks from every *.kicad_sym file in the current folder. Originally used for migration to built-in DNP field.
-Preserves original formatting and whitespace.
+Apply a batch of field operations (remove, rename, set value) to every *.kicad_sym file in the current folder. Originally used for migration to built-in DNP field.
+All operations are applied in one pass per file, and files are processed in parallel.
+Preserves original formatting, whitespace and line endings - everything except the edited fields is written back byte for byte.
+Files are written atomically, and only files that actually change are backed up and rewritten.
 Created by ChatGPT-5. Tested with KiCad 9 symbol library format on Windows (and apparented Linux OK too).
 
 Usage:
     python remove_property_field.py
 """
 
-import re
+import os
 from pathlib import Path
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from kicad_sexpr import SymbolLibrary
 
 # ==== CONFIGURATION ====
-FIELD_NAME = "FitPart"   # ← change this to the property name to remove
+# Applied in order to each symbol, so later operations see the result of earlier ones (e.g. rename then set)
+#   ("remove", "<FIELD>")
+#   ("rename", "<FIELD>", "<NEW FIELD>")   - skipped for symbols that already have <NEW FIELD>
+#   ("set", "<FIELD>", "<VALUE>")          - only where the symbol already has <FIELD>
+FIELD_OPERATIONS = [
+    ("remove", "FitPart"),   # ← change this to the property name(s) to remove
+]
 RECURSIVE = False         # True → include subdirectories
 BACKUP_SUFFIX = ".bak"    # backup extension
+MAX_WORKERS = 4           # files processed in parallel
 # ========================
 
 
-# Regex pattern to match a full multi-line (property "FIELD_NAME" ...) block.
-# Uses non-greedy matching to ensure it stops at the first closing parenthesis pair.
-pattern = re.compile(
-    rf'\(\s*property\s+"{re.escape(FIELD_NAME)}"\s+[^)]*?\n(?:.*?\n)*?\s*\)\s*',
-    flags=re.IGNORECASE
-)
-
-
-def remove_field_blocks(text: str) -> str:
-    """Remove all matching (property "<FIELD_NAME>" ...) blocks."""
-    # Simpler, safe multi-line search by counting parentheses instead of regex (handles nesting)
-    lines = text.splitlines(keepends=True)
-    out_lines = []
-    skip = False
-    depth = 0
-    for line in lines:
-        if not skip:
-            if re.search(rf'\(\s*property\s+"{re.escape(FIELD_NAME)}"', line):
-                skip = True
-                depth = line.count('(') - line.count(')')
+def check_operations(operations):
+    """Fail before touching any file if an operation is malformed."""
+    arity = {"remove": 2, "rename": 3, "set": 3}
+    for op in operations:
+        if not op or op[0] not in arity or len(op) != arity[op[0]]:
+            raise ValueError(f"Invalid field operation {op!r} - expected one of ('remove', field), ('rename', field, new_field), ('set', field, value)")
+
+
+def apply_operations(lib: SymbolLibrary, operations) -> dict:
+    """Apply all operations to every symbol of lib. Returns the number of symbols changed by each operation.
+    The operations are folded per property before any edit is recorded - a remove replaces an earlier rename or set of the
+    same property, and a later rename or set an earlier one - so each property gets one edit of each kind, which never overlap."""
+    counts = {op: 0 for op in operations}
+    for symbol in lib.symbols:
+        props = symbol.properties
+        removed = []
+        names = {}     # property -> its name after the operations
+        values = {}    # property -> its value after the operations
+        for op in operations:
+            prop = props.get(op[1])
+            if prop is None:
                 continue
-            else:
-                out_lines.append(line)
-        else:
-            depth += line.count('(') - line.count(')')
-            if depth <= 0:
-                skip = False
-    return ''.join(out_lines)
-
-
-def process_file(path: Path):
-    print(f"Processing: {path}")
-    backup_path = path.with_suffix(path.suffix + BACKUP_SUFFIX)
-    shutil.copy2(path, backup_path)
-
-    text = path.read_text(encoding="utf-8", errors="ignore")
-    new_text = remove_field_blocks(text)
-
-    if new_text != text:
-        path.write_text(new_text, encoding="utf-8", newline="\n")
-        print(f" → Field '{FIELD_NAME}' removed where present (backup: {backup_path.name})")
+
+            if op[0] == "remove":
+                names.pop(prop, None)
+                values.pop(prop, None)
+                removed.append(prop)
+                del props[op[1]]
+            elif op[0] == "rename":
+                if op[2] in props:
+                    continue
+                names[prop] = op[2]
+                del props[op[1]]
+                props[op[2]] = prop
+            elif op[0] == "set":
+                if values.get(prop, prop.value) == op[2]:
+                    continue
+                values[prop] = op[2]
+            counts[op] += 1
+
+        for prop in removed:
+            lib.remove(prop)
+        for prop, name in names.items():
+            if name != prop.name:
+                lib.rename(prop, name)
+        for prop, value in values.items():
+            if value != prop.value:
+                lib.set_value(prop, value)
+    return counts
+
+
+def describe(op) -> str:
+    if op[0] == "remove":
+        return f"'{op[1]}' removed"
+    if op[0] == "rename":
+        return f"'{op[1]}' renamed to '{op[2]}'"
+    return f"'{op[1]}' set to '{op[2]}'"
+
+
+def process_file(path: Path, operations):
+    """Edit one library. Returns the lines to report, so output from parallel workers isn't interleaved."""
+    report = [f"Processing: {path}"]
+
+    lib = SymbolLibrary.load(path)
+    counts = apply_operations(lib, operations)
+
+    if lib.changed:
+        backup_path = path.with_suffix(path.suffix + BACKUP_SUFFIX)
+        shutil.copy2(path, backup_path)
+        lib.save()
+        for op, count in counts.items():
+            if count:
+                report.append(f" → Field {describe(op)} in {count} symbol(s)")
+        report.append(f"   (backup: {backup_path.name})")
     else:
-        print(f" → No '{FIELD_NAME}' field found (no changes)")
+        report.append(" → No matching fields found (no changes)")
+    return report
 
 
 def main():
+    check_operations(FIELD_OPERATIONS)
+
     base = Path(".")
-    files = base.rglob("*.kicad_sym") if RECURSIVE else base.glob("*.kicad_sym")
-    for f in files:
-        try:
-            process_file(f)
-        except Exception as e:
-            print(f" !! Error processing {f}: {e}")
+    files = sorted(base.rglob("*.kicad_sym") if RECURSIVE else base.glob("*.kicad_sym"))
+    with ProcessPoolExecutor(max_workers=min(MAX_WORKERS, os.cpu_count() or 1)) as pool:
+        futures = [(f, pool.submit(process_file, f, FIELD_OPERATIONS)) for f in files]
+        for f, future in futures:
+            try:
+                print("\n".join(future.result()))
+            except Exception as e:
+                print(f" !! Error processing {f}: {e}")
 
 
 if __name__ == "__main__":
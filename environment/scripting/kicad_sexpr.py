@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Fast, quote-aware parser for KiCad S-expression files (.kicad_sym, .kicad_mod, sym-lib-table etc), for the library scripts to build on.
+Parentheses inside quoted strings (e.g. Description values) are handled correctly, and only the nesting levels asked for are built.
+Every node keeps its offsets into the original text, and edits are spliced into that text, so everything not edited is written back byte for byte.
+
+Usage:
+    from kicad_sexpr import SymbolLibrary
+
+    lib = SymbolLibrary.load("capacitors.kicad_sym")
+    for symbol in lib.symbols:
+        prop = symbol.properties.get("FitPart")
+        if prop is not None:
+            lib.remove(prop)
+    lib.save()
+
+Run directly to check round-trips and benchmark against the old line-scanning field remover:
+    python kicad_sexpr.py [symbols folder] [field name]
+"""
+
+import gc
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+
+# Quoted strings (with backslash escapes), and the atoms found between parentheses - a quoted string or a bare word
+STRING = r'"(?:[^"\\]|\\.)*"'
+ATOM_RE = re.compile(STRING + r'|[^\s()"]+', flags=re.DOTALL)
+# The next structural parenthesis - quoted strings are matched too, so any parentheses inside them are stepped over
+TOKEN_RE = re.compile(STRING + r'|([()])', flags=re.DOTALL)
+SUBTREE_LEVELS = 8   # Deepest list SUBTREE_RE skips in one match - deeper ones are walked parenthesis by parenthesis
+
+
+def subtree_re(levels):
+    """Regex matching a whole balanced list nested up to levels deep, with quoted strings, so a list not being built is skipped in one match."""
+    pattern = r'\([^()"]*(?:' + STRING + r'[^()"]*)*\)'
+    for _ in range(levels - 1):
+        pattern = r'\([^()"]*(?:(?:' + STRING + '|' + pattern + r')[^()"]*)*\)'
+    return re.compile(pattern, flags=re.DOTALL)
+
+
+SUBTREE_RE = subtree_re(SUBTREE_LEVELS)
+
+ESCAPES = {"n": "\n", "r": "\r", "t": "\t"}
+
+
+class SexprError(ValueError):
+    """Raised for unbalanced parentheses or conflicting edits."""
+
+
+def unquote(raw: str) -> str:
+    """Value of an atom, with the quotes and backslash escapes of a quoted string removed."""
+    if not raw.startswith('"'):
+        return raw
+    if "\\" not in raw:
+        return raw[1:-1]
+    return re.sub(r'\\(.)', lambda m: ESCAPES.get(m.group(1), m.group(1)), raw[1:-1], flags=re.DOTALL)
+
+
+def quote(value: str) -> str:
+    """Quoted string atom for value, escaped the same way KiCad writes it."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+class Atom:
+    """A bare or quoted atom, with its raw text and offsets in the source."""
+    __slots__ = ("raw", "start", "end")
+
+    def __init__(self, raw, start, end):
+        self.raw = raw
+        self.start = start
+        self.end = end
+
+    @property
+    def value(self):
+        return unquote(self.raw)
+
+
+class Node:
+    """A parenthesised list, from its '(' to its ')' in the source. items are Atoms and child Nodes."""
+    __slots__ = ("start", "end", "items")
+
+    def __init__(self, start):
+        self.start = start
+        self.end = None
+        self.items = []
+
+    @property
+    def head(self):
+        """Name of the list, e.g. 'property' for (property "Value" "1k" ...)."""
+        if self.items and isinstance(self.items[0], Atom):
+            return self.items[0].raw
+        return None
+
+    def atoms(self):
+        """The atoms directly in this list after the head."""
+        return [item for item in self.items[1:] if isinstance(item, Atom)]
+
+    def children(self, head=None):
+        """Child lists, optionally only those with the given head."""
+        return [item for item in self.items if isinstance(item, Node) and (head is None or item.head == head)]
+
+    def find(self, head):
+        """First child list with the given head, or None."""
+        for item in self.items:
+            if isinstance(item, Node) and item.head == head:
+                return item
+        return None
+
+
+def iter_nodes(text: str, depth: int = 1, max_depth: int = None):
+    """
+    Yield each list at the given nesting depth (1 = top level) as soon as its ')' is reached.
+    Only lists from depth down to max_depth are built - lists below max_depth are skipped whole by SUBTREE_RE - so e.g.
+    depth=2, max_depth=3 streams the symbols of a library with their properties, without building the library node or any of the graphics.
+    """
+    deepest = max_depth if max_depth is not None else 1 << 30
+    search = TOKEN_RE.search
+    skip = SUBTREE_RE.match
+
+    stack = []
+    level = 0
+    last = 0
+    pos = 0
+    while True:
+        match = search(text, pos)
+        if match is None:
+            break
+        pos = match.end()
+        paren = match.group(1)
+        if paren is None:
+            continue    # A quoted string - picked up with the other atoms below if its list is being built
+        start = match.start()
+
+        # Atoms between the previous parenthesis and this one belong to the innermost open list
+        if start > last and depth <= level <= deepest and not text[last:start].isspace():
+            items = stack[-1].items
+            for atom in ATOM_RE.finditer(text, last, start):
+                items.append(Atom(atom.group(), atom.start(), atom.end()))
+
+        if paren == "(":
+            if level >= deepest:
+                subtree = skip(text, start)
+                if subtree is not None:
+                    pos = last = subtree.end()
+                    continue
+            level += 1
+            if depth <= level <= deepest:
+                node = Node(start)
+                if stack:
+                    stack[-1].items.append(node)
+                stack.append(node)
+        else:
+            if level == 0:
+                raise SexprError("Unbalanced ')' at offset " + str(start))
+            if depth <= level <= deepest:
+                node = stack.pop()
+                node.end = pos
+                if level == depth:
+                    yield node
+            level -= 1
+
+        last = pos
+
+    if level:
+        raise SexprError("Unclosed '(' - " + str(level) + " list(s) still open at end of text")
+
+
+def parse(text: str):
+    """All the top-level lists in text, as complete trees."""
+    return list(iter_nodes(text, 1))
+
+
+def apply_edits(text: str, edits) -> str:
+    """text with each (start, end, replacement) edit spliced in, offsets being into the original text."""
+    out = []
+    pos = 0
+    for start, end, replacement in sorted(edits):
+        if start < pos:
+            raise SexprError("Overlapping edits at offset " + str(start))
+        out.append(text[pos:start])
+        out.append(replacement)
+        pos = end
+    out.append(text[pos:])
+    return "".join(out)
+
+
+class Property:
+    """A (property "Name" "Value" ...) of a symbol."""
+    __slots__ = ("node", "name", "value")
+
+    def __init__(self, node):
+        self.node = node
+        atoms = node.atoms()
+        self.name = atoms[0].value if atoms else ""
+        self.value = atoms[1].value if len(atoms) > 1 else ""
+
+
+class Symbol:
+    """A top-level (symbol "Name" ...) of a library, with its properties by name."""
+    __slots__ = ("node", "name", "properties")
+
+    def __init__(self, node):
+        self.node = node
+        atoms = node.atoms()
+        self.name = atoms[0].value if atoms else ""
+        self.properties = {}
+        for child in node.children("property"):
+            prop = Property(child)
+            self.properties[prop.name] = prop
+
+
+class SymbolLibrary:
+    """
+    A .kicad_sym library as its original text plus symbol objects pointing into it.
+    Edits are recorded against the original offsets and only applied by to_text()/save(), so all other formatting is preserved.
+    """
+    __slots__ = ("path", "text", "symbols", "edits")
+
+    def __init__(self, text: str, path=None):
+        self.path = path
+        self.text = text
+        # Only the symbols and their direct children (properties etc) are needed, not the graphics and pins below them
+        self.symbols = [Symbol(node) for node in iter_nodes(text, 2, 3) if node.head == "symbol"]
+        self.edits = []
+
+    @classmethod
+    def load(cls, path):
+        # newline="" keeps CRLF files as CRLF when written back
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            return cls(f.read(), Path(path))
+
+    @property
+    def changed(self):
+        return bool(self.edits)
+
+    def remove(self, item):
+        """Remove a Property or Symbol, along with its whole line(s) if nothing else shares them."""
+        node = item.node
+        start, end = node.start, node.end
+
+        line_start = self.text.rfind("\n", 0, start) + 1
+        line_end = self.text.find("\n", end)
+        if line_end == -1:
+            line_end = len(self.text) - 1
+        if not self.text[line_start:start].strip() and not self.text[end:line_end + 1].strip():
+            start, end = line_start, line_end + 1
+
+        self.edits.append((start, end, ""))
+
+    def set_value(self, prop, value: str):
+        """Set the value of a Property, keeping everything else about it."""
+        atoms = prop.node.atoms()
+        if len(atoms) < 2:
+            raise SexprError("Property '" + prop.name + "' has no value to set")
+        self.edits.append((atoms[1].start, atoms[1].end, quote(value)))
+        prop.value = value
+
+    def rename(self, prop, name: str):
+        """Rename a Property, keeping its value and everything else about it."""
+        atoms = prop.node.atoms()
+        self.edits.append((atoms[0].start, atoms[0].end, quote(name)))
+        prop.name = name
+
+    def to_text(self) -> str:
+        return apply_edits(self.text, self.edits)
+
+    def save(self, path=None):
+        """Write the edited text atomically - via a temporary file, so an interrupted run never leaves a half-written library."""
+        path = Path(path or self.path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            f.write(self.to_text())
+        os.replace(tmp_path, path)
+
+
+###########################################
+#   Round-trip check and benchmark against the original line-scanning field remover
+###########################################
+
+def legacy_remove_field_blocks(text: str, field_name: str) -> str:
+    """The original kicad_remove_symbol_field.py approach - per-line regex and '(' / ')' counting, not quote-aware."""
+    lines = text.splitlines(keepends=True)
+    out_lines = []
+    skip = False
+    depth = 0
+    for line in lines:
+        if not skip:
+            if re.search(rf'\(\s*property\s+"{re.escape(field_name)}"', line):
+                skip = True
+                depth = line.count('(') - line.count(')')
+                continue
+            else:
+                out_lines.append(line)
+        else:
+            depth += line.count('(') - line.count(')')
+            if depth <= 0:
+                skip = False
+    return ''.join(out_lines)
+
+
+def benchmark(folder: Path, field_name: str, repeat: int = 5):
+    files = sorted(folder.rglob("*.kicad_sym"))
+    texts = {}
+    for path in files:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            texts[path] = f.read()
+
+    total_bytes = sum(len(text.encode("utf-8")) for text in texts.values())
+    print(f"{len(files)} libraries, {total_bytes / 1e6:.2f} MB, removing field '{field_name}', best of {repeat}\n")
+
+    def remove_with_parser(text):
+        lib = SymbolLibrary(text)
+        for symbol in lib.symbols:
+            prop = symbol.properties.get(field_name)
+            if prop is not None:
+                lib.remove(prop)
+        return lib.to_text()
+
+    results = {}
+    for label, func in (("line scanning", lambda text: legacy_remove_field_blocks(text, field_name)),
+                        ("parser", remove_with_parser),
+                        ("parse only", lambda text: len(SymbolLibrary(text).symbols))):   # Not kept, as the other outputs aren't
+        best = None
+        for _ in range(repeat):
+            # As timeit does, without the garbage collector, so one approach isn't charged for collecting another's objects
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                outputs = {path: func(text) for path, text in texts.items()}
+                elapsed = time.perf_counter() - start
+            finally:
+                gc.enable()
+            best = elapsed if best is None else min(best, elapsed)
+        results[label] = outputs
+        print(f"  {label:<15} {best * 1000:8.1f} ms   {total_bytes / 1e6 / best:6.1f} MB/s")
+
+    symbols = sum(len(SymbolLibrary(text).symbols) for text in texts.values())
+    lossless = all(SymbolLibrary(text).to_text() == text for text in texts.values())
+    differ = [path.name for path in files if results["line scanning"][path] != results["parser"][path]]
+    print(f"\n  {symbols} symbols, unedited round-trip identical: {lossless}")
+    print(f"  Outputs differing from line scanning: {', '.join(differ) if differ else 'none'}")
+
+
+if __name__ == "__main__":
+    benchmark(Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).resolve().parent.parent.parent / "symbols",
+              sys.argv[2] if len(sys.argv) > 2 else "Vendor2")